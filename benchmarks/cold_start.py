@@ -0,0 +1,129 @@
+"""Measure how long a fresh web worker takes to become useful.
+
+Each run starts a new interpreter, so nothing is shared between runs:
+
+- import: time to ``import lease_generator.main`` (and whether WeasyPrint got pulled in)
+- first_response: time from launching uvicorn to the first ``GET /`` response
+
+Usage: python benchmarks/cold_start.py [--runs N] [--output results.json]
+                                       [--import-budget-ms MS] [--first-response-budget-ms MS]
+
+Exits with status 1 when a median exceeds its budget, so it can gate CI.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+
+IMPORT_SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+import lease_generator.main
+print(json.dumps({"seconds": time.perf_counter() - started, "weasyprint_loaded": "weasyprint" in sys.modules}))
+"""
+
+FIRST_RESPONSE_TIMEOUT_SECONDS = 60
+
+
+def measure_import() -> dict:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_first_response() -> dict:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "lease_generator.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < FIRST_RESPONSE_TIMEOUT_SECONDS:
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with status {server.returncode} before responding")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+                continue
+            return {"seconds": time.perf_counter() - started, "status": status}
+        raise RuntimeError(f"no response from {url} within {FIRST_RESPONSE_TIMEOUT_SECONDS}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def summarize(samples: list) -> dict:
+    seconds = [sample["seconds"] for sample in samples]
+    return {
+        "median_ms": statistics.median(seconds) * 1000,
+        "min_ms": min(seconds) * 1000,
+        "max_ms": max(seconds) * 1000,
+        "samples_ms": [round(value * 1000, 2) for value in seconds],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure lease_generator cold-start time")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement (default: 5)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--import-budget-ms", type=float, help="Fail when the median import time exceeds this")
+    parser.add_argument("--first-response-budget-ms", type=float, help="Fail when the median time to first response exceeds this")
+    args = parser.parse_args(argv)
+
+    imports = [measure_import() for _ in range(args.runs)]
+    first_responses = [measure_first_response() for _ in range(args.runs)]
+
+    results = {
+        "benchmark": "cold_start",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "render_prewarm": os.environ.get("LEASE_RENDER_PREWARM", "background"),
+        "import": {**summarize(imports), "weasyprint_loaded": any(sample["weasyprint_loaded"] for sample in imports)},
+        "first_response": {**summarize(first_responses), "statuses": sorted({sample["status"] for sample in first_responses})},
+    }
+
+    print(f"import lease_generator.main: median {results['import']['median_ms']:.1f} ms "
+          f"(min {results['import']['min_ms']:.1f}, max {results['import']['max_ms']:.1f}), "
+          f"weasyprint loaded: {results['import']['weasyprint_loaded']}")
+    print(f"first GET / response:        median {results['first_response']['median_ms']:.1f} ms "
+          f"(min {results['first_response']['min_ms']:.1f}, max {results['first_response']['max_ms']:.1f}), "
+          f"status {results['first_response']['statuses']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    over_budget = []
+    if args.import_budget_ms is not None and results["import"]["median_ms"] > args.import_budget_ms:
+        over_budget.append(f"import {results['import']['median_ms']:.1f} ms > {args.import_budget_ms} ms")
+    if args.first_response_budget_ms is not None and results["first_response"]["median_ms"] > args.first_response_budget_ms:
+        over_budget.append(f"first response {results['first_response']['median_ms']:.1f} ms > {args.first_response_budget_ms} ms")
+    for message in over_budget:
+        print(f"OVER BUDGET: {message}", file=sys.stderr)
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
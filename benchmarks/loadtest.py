@@ -0,0 +1,392 @@
+"""End-to-end load test of /generate against a locally started uvicorn.
+
+The server listens on a Unix socket in a temporary directory (with its own
+database and caches), so nothing goes over the network. Requests are /generate
+form submissions built from example_template.json with randomized tenants,
+rents, rent increases and custom payments, mixed across output formats:
+
+- html, pdf, renewal_message   output_format of the form
+- save_config                  configuration download (save_config=true)
+
+The mix runs at each --concurrency level to show where throughput stops
+growing, then each format runs alone at the highest level for its own peak
+RSS. Every run reports throughput and p50/p95/p99 latency per format and the
+peak RSS of the server and its render workers. Request bodies depend only on
+--seed, so results are comparable across commits.
+
+Usage: python benchmarks/loadtest.py [--requests N] [--concurrency 1,4,16]
+                                     [--mix html=50,pdf=30,renewal_message=10,save_config=10]
+                                     [--output results.json] [--compare baseline.json] [--max-regression 0.25]
+
+With --compare, exits with status 1 when a format's p95 latency grows, or a
+run's throughput falls, by more than --max-regression against the baseline.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import urlencode
+
+from lease_generator.batch import percentile
+
+
+EXAMPLE_PATH = Path(__file__).resolve().parent.parent / "example_template.json"
+FORMATS = ("html", "pdf", "renewal_message", "save_config")
+DEFAULT_MIX = "html=50,pdf=30,renewal_message=10,save_config=10"
+SERVER_START_TIMEOUT_SECONDS = 60
+RSS_SAMPLE_SECONDS = 0.1
+
+FIRST_NAMES = ("Jane", "John", "Maria", "Wei", "Aisha", "Carlos", "Olga", "Sam", "Priya", "Tomás")
+LAST_NAMES = ("Doe", "Smith", "Garcia", "Chen", "Okafor", "Novak", "Müller", "Patel", "Kim", "O'Brien")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in FORMATS:
+            raise argparse.ArgumentTypeError(f"unknown format {name.strip()!r}; choose from {', '.join(FORMATS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def form_fields(example: dict, rng: random.Random, kind: str, number: int) -> dict:
+    """One /generate submission: the example lease with randomized tenant, term, rent and schedule"""
+    parties, details = example["parties"], example["property_details"]
+    terms, features = example["lease_terms"], example["property_features"]
+    additional = example["additional_terms"]
+
+    start = date(2025, rng.randint(1, 12), 1)
+    months = rng.choice((6, 12, 12, 12, 24, 36))
+    end = date(start.year + (start.month - 1 + months) // 12, (start.month - 1 + months) % 12 + 1, 1) - timedelta(days=1)
+    rent = rng.randrange(800, 3500, 25)
+    increases, increased = [], rent
+    for year in range(1, months // 12 + 1):
+        if year * 12 < months and rng.random() < 0.7:
+            increased += rng.randrange(25, 150, 25)
+            increases.append({"date": date(start.year + year, start.month, 1).isoformat(), "new_rent": increased,
+                              "comment": f"Year {year + 1} rent"})
+    payments = [{"due_date": "Lease signing", "security_deposit": rent, "total": rent, "comment": "Security deposit"}]
+    if rng.random() < 0.5:
+        payments.append({"due_date": (start + timedelta(days=rng.randint(10, 60))).isoformat(),
+                         "other_fees": rng.randrange(25, 200, 5), "comment": "Key replacement"})
+    for payment in payments:
+        payment["total"] = sum(payment.get(field, 0) for field in ("rent_amount", "security_deposit", "pet_deposit", "other_fees"))
+    # Renewal messages need the previous rent; other requests are renewals some of the time
+    renewal = kind == "renewal_message" or rng.random() < 0.3
+
+    fields = {
+        "landlord_name": parties["landlord_name"],
+        "landlord_address": parties["landlord_address"],
+        "tenant_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {number}",
+        "tenant_address": parties["tenant_address"] or "",
+        "tenant_email": parties["tenant_email"] or "",
+        "mailing_address": f"{rng.randint(1, 999)} {details['mailing_address']}",
+        "residence_type": details["residence_type"],
+        "bedrooms": rng.randint(1, 4),
+        "bathrooms": rng.randint(1, 3),
+        "appliances": ", ".join(details["appliances"]),
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "monthly_rent": rent,
+        "pet_deposit": terms["pet_deposit"] or 0,
+        "late_fee": terms["late_fee"],
+        "nsf_fee": terms["nsf_fee"],
+        "payment_instructions": terms["payment_instructions"],
+        "parking_spaces": features["parking_spaces"] or 0,
+        "utilities_included": ", ".join(features["utilities_included"]),
+        "pets_allowed": str(features["pets_allowed"]).lower(),
+        "early_termination_notice": additional["early_termination_notice"],
+        "landlord_contact_phone": additional["landlord_contact_phone"] or "",
+        "landlord_contact_email": additional["landlord_contact_email"] or "",
+        "special_conditions": "\n".join(additional["special_conditions"] * rng.choice((1, 1, 2, 4))),
+        "include_payment_schedule": "true",
+        "auto_generate_schedule": "true",
+        "rent_increases": json.dumps(increases),
+        "custom_payments": json.dumps(payments),
+        "governing_law_state": example["governing_law_state"],
+        "agreement_date": (start - timedelta(days=14)).isoformat(),
+        "output_format": "html" if kind == "save_config" else kind,
+    }
+    if renewal:
+        fields["use_custom_security_deposit"] = "true"
+        fields["previous_rent"] = rent - rng.randrange(25, 200, 25)
+    if kind == "save_config":
+        fields["save_config"] = "true"
+    return fields
+
+
+def build_requests(example: dict, mix: dict, count: int, seed: str) -> list:
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    requests = []
+    for number in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        requests.append((kind, urlencode(form_fields(example, rng, kind, number)).encode("utf-8")))
+    return requests
+
+
+def process_tree_rss(pid: int) -> int:
+    """Resident memory in bytes of a process and all its descendants (Linux /proc; 0 elsewhere)"""
+    parents = {}
+    for entry in Path("/proc").iterdir() if Path("/proc").is_dir() else ():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # The command name can contain spaces; fields after it are fixed
+        parents[int(entry.name)] = int(stat.rsplit(")", 1)[1].split()[1])
+    tree, frontier = {pid}, [pid]
+    while frontier:
+        parent = frontier.pop()
+        children = [child for child, ppid in parents.items() if ppid == parent and child not in tree]
+        tree.update(children)
+        frontier.extend(children)
+    total = 0
+    for member in tree:
+        try:
+            for line in Path(f"/proc/{member}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total
+
+
+class RSSSampler:
+    """Tracks the server's peak resident memory in the background during a run"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            if self._stop.wait(RSS_SAMPLE_SECONDS):
+                return
+
+
+def run_load(socket_path: str, requests: list, concurrency: int, timeout: float) -> tuple:
+    """Send the requests from `concurrency` keep-alive connections; returns ([(kind, status, seconds)], wall seconds)"""
+    results, lock = [], threading.Lock()
+    pending = iter(requests)
+
+    def client():
+        connection = UnixHTTPConnection(socket_path, timeout)
+        try:
+            while True:
+                with lock:
+                    item = next(pending, None)
+                if item is None:
+                    return
+                kind, body = item
+                started = time.perf_counter()
+                try:
+                    connection.request("POST", "/generate", body=body,
+                                       headers={"Content-Type": "application/x-www-form-urlencoded"})
+                    response = connection.getresponse()
+                    response.read()
+                    status = response.status
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    status = 0
+                elapsed = time.perf_counter() - started
+                with lock:
+                    results.append((kind, status, elapsed))
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results: list, seconds: float) -> dict:
+    formats = {}
+    for kind in FORMATS:
+        latencies = sorted(elapsed for result_kind, status, elapsed in results if result_kind == kind and status == 200)
+        statuses = [status for result_kind, status, _ in results if result_kind == kind]
+        if not statuses:
+            continue
+        formats[kind] = {
+            "count": len(statuses),
+            "errors": {str(status): statuses.count(status) for status in sorted(set(statuses)) if status != 200},
+            "throughput_rps": round(len(latencies) / seconds, 2),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        }
+    ok = sum(1 for _, status, _ in results if status == 200)
+    return {"seconds": round(seconds, 3), "requests": len(results), "ok": ok,
+            "throughput_rps": round(ok / seconds, 2), "formats": formats}
+
+
+def start_server(directory: Path, workers) -> tuple:
+    socket_path = str(directory / "lease.sock")
+    env = dict(os.environ)
+    # A fresh database and caches, so earlier runs can't turn renders into cache hits
+    env.update({
+        "LEASE_DB_PATH": str(directory / "lease_generator.db"),
+        "LEASE_CACHE_DIR": str(directory / "cache"),
+        "LEASE_JOB_DIR": str(directory / "jobs"),
+        "LEASE_JOB_WORKERS": "0",
+        "LEASE_RENDER_PREWARM": "startup",
+    })
+    # Every request comes from this one client; measure saturation, not the per-client limit
+    env.setdefault("LEASE_ADMISSION_PER_CLIENT", "100000")
+    if workers:
+        env["LEASE_RENDER_WORKERS"] = str(workers)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "lease_generator.main:app", "--uds", socket_path, "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+    started = time.perf_counter()
+    while time.perf_counter() - started < SERVER_START_TIMEOUT_SECONDS:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode} before responding")
+        try:
+            connection = UnixHTTPConnection(socket_path, timeout=5)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            connection.close()
+            return server, socket_path
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError(f"server did not respond within {SERVER_START_TIMEOUT_SECONDS}s")
+
+
+def compare(runs: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    for name, run in runs.items():
+        previous = baseline.get("runs", {}).get(name)
+        if not previous:
+            continue
+        if previous["throughput_rps"] and run["throughput_rps"] < previous["throughput_rps"] / (1 + max_regression):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {run['throughput_rps']} req/s")
+        for kind, stats in run["formats"].items():
+            before = previous["formats"].get(kind)
+            if before and before["p95_ms"] and stats["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+                regressions.append(f"{name} {kind}: p95 {before['p95_ms']} -> {stats['p95_ms']} ms")
+    return regressions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=EXAMPLE_PATH.parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test /generate with a mix of output formats")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per run (default: 200)")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels (default: 1,4,16)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Relative weight of each format (default: {DEFAULT_MIX})")
+    parser.add_argument("--skip-isolated", action="store_true", help="Don't run each format on its own")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before the first run (default: 10)")
+    parser.add_argument("--workers", type=int, help="LEASE_RENDER_WORKERS for the server (default: its own default)")
+    parser.add_argument("--seed", default="1", help="Seed for the generated leases (default: 1)")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds (default: 120)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Allowed p95 growth / throughput loss against the baseline (default: 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    with open(EXAMPLE_PATH) as f:
+        example = json.load(f)
+    plans = [(f"mixed@c{level}", args.mix, level) for level in levels]
+    if not args.skip_isolated:
+        plans += [(f"{kind}@c{max(levels)}", {kind: 1.0}, max(levels)) for kind in args.mix]
+
+    runs = {}
+    with tempfile.TemporaryDirectory(prefix="lease_loadtest_") as tmp:
+        server, socket_path = start_server(Path(tmp), args.workers)
+        try:
+            if args.warmup:
+                run_load(socket_path, build_requests(example, args.mix, args.warmup, f"{args.seed}:warmup"), 1, args.timeout)
+            for name, mix, level in plans:
+                # A different seed per run, so no run repeats documents an earlier one cached
+                requests = build_requests(example, mix, args.requests, f"{args.seed}:{name}")
+                with RSSSampler(server.pid) as rss:
+                    results, seconds = run_load(socket_path, requests, level, args.timeout)
+                runs[name] = {"concurrency": level, **summarize(results, seconds), "peak_rss_mb": round(rss.peak / 2**20, 1)}
+                run = runs[name]
+                print(f"{name:<24} {run['throughput_rps']:>8.2f} req/s  peak RSS {run['peak_rss_mb']:>8.1f} MB  "
+                      f"({run['ok']}/{run['requests']} ok)")
+                for kind, stats in run["formats"].items():
+                    errors = f"  errors {stats['errors']}" if stats["errors"] else ""
+                    print(f"    {kind:<16} n={stats['count']:<5} p50 {stats['p50_ms']:>9.1f} ms  "
+                          f"p95 {stats['p95_ms']:>9.1f} ms  p99 {stats['p99_ms']:>9.1f} ms{errors}")
+        finally:
+            server.terminate()
+            server.wait()
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(runs, json.load(f), args.max_regression)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "loadtest",
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "settings": {"requests": args.requests, "concurrency": levels, "mix": args.mix, "seed": args.seed,
+                             "workers": args.workers, "warmup": args.warmup},
+                "runs": runs,
+            }, f, indent=2)
+
+    for message in regressions:
+        print(f"REGRESSION: {message}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Microbenchmarks for each stage of the lease pipeline.
+
+Inputs are built from example_template.json plus scaled-up variants of it
+(a short lease and a 30-year lease with many rent increases). Each stage is
+timed on its own so a regression shows up where it happens:
+
+- schedule.*   create_payment_schedule / build_schedule_rows
+- currency.*   format_currency
+- model.*      LeaseConfiguration validation, lease construction and model_dump
+- template.*   lease_template.html rendered in full and through the section cache
+- pdf.*        WeasyPrint PDF output (skipped when WeasyPrint isn't installed)
+
+Usage: python benchmarks/microbench.py [--only SUBSTRING] [--repeat N] [--output results.json]
+                                       [--compare baseline.json] [--max-regression 0.25]
+
+With --compare, exits with status 1 when any stage's median is more than
+--max-regression slower than in the baseline results.
+"""
+import argparse
+import importlib.util
+import json
+import platform
+import statistics
+import sys
+import timeit
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+from lease_generator.documents import (
+    format_currency, lease_from_configuration, lease_template_context, prepare_lease, render_lease_document, template_env,
+)
+from lease_generator.models import LeaseConfiguration
+from lease_generator.schedule import build_schedule_rows, create_payment_schedule
+
+
+EXAMPLE_PATH = Path(__file__).resolve().parent.parent / "example_template.json"
+AGREEMENT_DATE = date(2025, 1, 1)
+CURRENCY_AMOUNTS = [0, 35, 50.5, 975, 1200, 1234.56, 25000, 99999.99, None, 1e6] * 10
+
+
+def example_data() -> dict:
+    with open(EXAMPLE_PATH) as f:
+        return json.load(f)
+
+
+def scaled_data(years: int, increases_per_year: int, condition_copies: int) -> dict:
+    """The example lease stretched to a number of years, with regular rent increases"""
+    data = example_data()
+    start = date.fromisoformat(data["lease_terms"]["start_date"])
+    data["lease_terms"]["end_date"] = date(start.year + years, start.month, start.day).isoformat()
+    rent = data["lease_terms"]["monthly_rent"]
+    increases = []
+    for year in range(years):
+        for step in range(increases_per_year):
+            month = 1 + step * (12 // increases_per_year)
+            rent += 25
+            increases.append({"date": date(start.year + year, month, 1).isoformat(), "new_rent": rent,
+                              "comment": f"Increase {len(increases) + 1}"})
+    data["additional_terms"]["payment_schedule"]["rent_increases"] = increases
+    data["additional_terms"]["special_conditions"] = data["additional_terms"]["special_conditions"] * condition_copies
+    return data
+
+
+def variants() -> dict:
+    short = example_data()
+    short["lease_terms"]["end_date"] = "2025-03-31"
+    return {
+        "short": short,
+        "12_month": example_data(),
+        "30_year": scaled_data(years=30, increases_per_year=2, condition_copies=4),
+    }
+
+
+def schedule_args(data: dict) -> tuple:
+    terms = data["lease_terms"]
+    return (date.fromisoformat(terms["start_date"]), date.fromisoformat(terms["end_date"]), terms["monthly_rent"],
+            data["additional_terms"]["payment_schedule"]["rent_increases"], [], 0.0, "", 0.0)
+
+
+def benchmarks(pdf: bool) -> dict:
+    """Stage name -> zero-argument callable; all inputs are prepared up front"""
+    cases = {}
+    template = template_env.get_template("lease_template.html")
+    for name, data in variants().items():
+        args = schedule_args(data)
+        config = LeaseConfiguration.model_validate(data)
+        lease, rows = prepare_lease(config, AGREEMENT_DATE)
+        full_lease = lease_from_configuration(config, AGREEMENT_DATE)
+        context = lease_template_context(lease, rows)
+        html = render_lease_document(context)
+
+        cases[f"schedule.create_payment_schedule.{name}"] = lambda args=args: create_payment_schedule(*args)
+        cases[f"schedule.build_schedule_rows.{name}"] = lambda args=args: build_schedule_rows(*args)
+        cases[f"model.validate_configuration.{name}"] = lambda data=data: LeaseConfiguration.model_validate(data)
+        cases[f"model.prepare_lease.{name}"] = lambda config=config: prepare_lease(config, AGREEMENT_DATE)
+        cases[f"model.dump.{name}"] = lambda full_lease=full_lease: full_lease.model_dump(mode="json")
+        cases[f"template.full_render.{name}"] = lambda context=context: template.render(context)
+        cases[f"template.section_cache_warm.{name}"] = lambda context=context: render_lease_document(context)
+        if pdf:
+            from lease_generator.render import render_pdf
+            cases[f"pdf.render_pdf.{name}"] = lambda html=html: render_pdf(html)
+
+    cases["currency.format_currency.x100"] = lambda: [format_currency(amount) for amount in CURRENCY_AMOUNTS]
+    return cases
+
+
+def measure(func, repeat: int) -> dict:
+    timer = timeit.Timer(func)
+    # Enough calls per sample for ~0.2s, so timer resolution doesn't matter
+    loops, _ = timer.autorange()
+    per_call = [sample / loops for sample in timer.repeat(repeat=repeat, number=loops)]
+    return {
+        "median_us": statistics.median(per_call) * 1e6,
+        "min_us": min(per_call) * 1e6,
+        "loops": loops,
+        "samples_us": [round(value * 1e6, 3) for value in per_call],
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or "median_us" not in previous or "median_us" not in result:
+            continue
+        ratio = result["median_us"] / previous["median_us"]
+        result["baseline_ratio"] = round(ratio, 3)
+        if ratio > 1 + max_regression:
+            regressions.append(f"{name}: {previous['median_us']:.1f} us -> {result['median_us']:.1f} us ({ratio:.2f}x)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the lease pipeline")
+    parser.add_argument("--only", help="Only run stages whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="Samples per stage (default: 5)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline before failing (default: 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    pdf_skipped = None if importlib.util.find_spec("weasyprint") else "WeasyPrint is not installed"
+
+    results = {}
+    for name, func in benchmarks(pdf=pdf_skipped is None).items():
+        if args.only and args.only not in name:
+            continue
+        results[name] = measure(func, args.repeat)
+        print(f"{name:<50} median {results[name]['median_us']:>12.1f} us   min {results[name]['min_us']:>12.1f} us")
+    if pdf_skipped:
+        print(f"pdf.* skipped: {pdf_skipped}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "benchmark": "microbench",
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "repeat": args.repeat,
+                "pdf_skipped": pdf_skipped,
+                "results": results,
+            }, f, indent=2)
+
+    for message in regressions:
+        print(f"REGRESSION: {message}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException, Request
+
+from .metrics import DURATION_BUCKETS, Histogram, sample_lines
+from .render import RENDER_WORKERS
+
+
+# Admission limits - override with environment variables in production
+# Renders in progress at once per web process; further requests wait in a bounded queue
+ADMISSION_CONCURRENCY = int(os.environ.get("LEASE_ADMISSION_CONCURRENCY", str(max(1, RENDER_WORKERS) * 2)))
+# Renders one client may have in progress or waiting
+ADMISSION_PER_CLIENT = int(os.environ.get("LEASE_ADMISSION_PER_CLIENT", "4"))
+ADMISSION_QUEUE = int(os.environ.get("LEASE_ADMISSION_QUEUE", str(ADMISSION_CONCURRENCY * 4)))
+ADMISSION_WAIT_SECONDS = float(os.environ.get("LEASE_ADMISSION_WAIT_SECONDS", "10"))
+# Header naming the client behind a proxy (e.g. X-Forwarded-For); the peer address is used without it
+ADMISSION_CLIENT_HEADER = os.environ.get("LEASE_ADMISSION_CLIENT_HEADER", "").lower()
+
+# Waiting requests are admitted in this order; a preview can take a queued PDF's place in a full queue
+PRIORITIES = ("preview", "pdf")
+
+WAIT_SECONDS = Histogram("lease_admission_wait_seconds", "Time render requests waited for a render slot",
+                         DURATION_BUCKETS, ("priority",))
+
+
+def admission_client(request: Request) -> str:
+    """Who a request counts against for the per-client limit"""
+    if ADMISSION_CLIENT_HEADER:
+        value = request.headers.get(ADMISSION_CLIENT_HEADER)
+        if value:
+            return value.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class AdmissionController:
+    """Bounded admission for render work, so a burst is queued or turned away instead of piling up.
+
+    Up to ``limit`` requests hold a render slot at once. Others wait, previews
+    ahead of PDFs, in a queue of at most ``max_queue`` requests for up to
+    ``max_wait`` seconds. A client with ``per_client`` requests admitted or
+    waiting gets a 429; a full queue or an expired wait gets a 503. Both carry a
+    Retry-After estimated from how long slots are held. Freed slots are handed
+    straight to the next waiter. Only used from the event loop, so no locking.
+    """
+
+    def __init__(self, limit: int = ADMISSION_CONCURRENCY, per_client: int = ADMISSION_PER_CLIENT,
+                 max_queue: int = ADMISSION_QUEUE, max_wait: float = ADMISSION_WAIT_SECONDS):
+        self.limit = max(1, limit)
+        self.per_client = max(1, per_client)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.admitted: Dict[str, int] = {priority: 0 for priority in PRIORITIES}
+        self.rejected: Dict[Tuple[str, str], int] = {}
+        self._clients: Dict[str, int] = {}
+        # (rank, sequence, future, priority); entries whose future is done are stale and skipped
+        self._queue: list = []
+        self._sequence = itertools.count()
+        # Moving average of how long a slot is held, for Retry-After
+        self._hold_seconds = 1.0
+
+    def _rejection(self, status_code: int, priority: str, reason: str, detail: str) -> HTTPException:
+        self.rejected[(priority, reason)] = self.rejected.get((priority, reason), 0) + 1
+        retry_after = max(1, math.ceil(self._hold_seconds * (self.waiting / self.limit + 1)))
+        return HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    @asynccontextmanager
+    async def slot(self, client: str, priority: str):
+        """Hold a render slot for the duration of the block"""
+        if self._clients.get(client, 0) >= self.per_client:
+            raise self._rejection(429, priority, "client_limit", "Too many documents in progress for this client")
+        self._clients[client] = self._clients.get(client, 0) + 1
+        try:
+            started = time.perf_counter()
+            if self.active < self.limit:
+                self.active += 1
+            else:
+                await self._wait(priority)
+            WAIT_SECONDS.observe(time.perf_counter() - started, priority)
+            self.admitted[priority] += 1
+            held = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * (time.perf_counter() - held)
+                self._release()
+        finally:
+            remaining = self._clients.pop(client) - 1
+            if remaining:
+                self._clients[client] = remaining
+
+    async def _wait(self, priority: str):
+        rank = PRIORITIES.index(priority)
+        if self.waiting >= self.max_queue:
+            # Shed the newest waiter of a lower priority, or this request when there is none
+            lower = [entry for entry in self._queue if entry[0] > rank and not entry[2].done()]
+            if not lower:
+                raise self._rejection(503, priority, "queue_full",
+                                      "Document rendering is at capacity; retry later or submit it to /jobs")
+            victim = max(lower)
+            victim[2].set_exception(self._rejection(503, victim[3], "displaced",
+                                                    "Document rendering is at capacity; retry later or submit it to /jobs"))
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (rank, next(self._sequence), future, priority))
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+            raise self._rejection(503, priority, "timeout",
+                                  "Timed out waiting for a render slot; retry later or submit it to /jobs")
+        except asyncio.CancelledError:
+            # The client went away while waiting
+            self._abandon(future)
+            raise
+        finally:
+            self.waiting -= 1
+
+    def _abandon(self, future: asyncio.Future):
+        # A slot handed over just as the wait ended must be passed on
+        if future.done() and not future.cancelled() and future.exception() is None:
+            self._release()
+
+    def _release(self):
+        while self._queue:
+            _, _, future, _ = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def metric_lines(self) -> List[List[str]]:
+        """Exposition blocks for /metrics"""
+        return [
+            sample_lines("lease_admission_active", "gauge", "Render requests holding a render slot", [({}, self.active)]),
+            sample_lines("lease_admission_limit", "gauge", "Render slots in this process", [({}, self.limit)]),
+            sample_lines("lease_admission_queue_depth", "gauge", "Render requests waiting for a slot", [({}, self.waiting)]),
+            sample_lines("lease_admission_admitted_total", "counter", "Render requests given a slot",
+                         [({"priority": priority}, count) for priority, count in self.admitted.items()]),
+            sample_lines("lease_admission_rejected_total", "counter", "Render requests turned away, by reason",
+                         [({"priority": priority, "reason": reason}, count)
+                          for (priority, reason), count in sorted(self.rejected.items())]),
+            WAIT_SECONDS.expose(),
+        ]
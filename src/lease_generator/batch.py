@@ -0,0 +1,148 @@
+"""Render every saved lease configuration in a directory to PDF without the web app.
+
+Usage: python -m lease_generator.batch <configs_dir> <out_dir> [--jobs N]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pydantic import ValidationError
+
+from .bulk import CONFIGURATION_PATTERN, unique_name
+from .documents import document_filename, input_hash, pdf_stylesheets, prepare_lease, render_lease_html, templates_fingerprint
+from .models import LeaseConfiguration
+from .render import render_pdf, warm_up_worker
+
+
+# Remembers which input produced each output so unchanged leases are skipped
+MANIFEST_NAME = ".batch_manifest.json"
+
+
+class BatchInput(NamedTuple):
+    config: LeaseConfiguration
+    output: str  # PDF filename in out_dir
+    input_hash: str  # Of the configuration file as read, the agreement date and the templates
+
+
+def render_configuration(config: LeaseConfiguration, out_dir: Path, filename: str, agreement_date: Optional[date]) -> dict:
+    """Render and write one validated lease to out_dir/filename (runs inside a pool worker)"""
+    started = time.perf_counter()
+    # Default to the date the configuration was saved so re-runs produce identical PDFs
+    lease, schedule_rows = prepare_lease(config, agreement_date or config.updated_at.date())
+
+    pdf = render_pdf(render_lease_html(lease, schedule_rows))
+    tmp_path = out_dir / f".{filename}.tmp"
+    tmp_path.write_bytes(pdf)
+    os.replace(tmp_path, out_dir / filename)
+    return {"output": filename, "seconds": time.perf_counter() - started}
+
+
+def read_configurations(config_paths: List[Path], agreement_date: Optional[date],
+                        fingerprint: str) -> Tuple[Dict[Path, BatchInput], Dict[Path, str]]:
+    """Read and validate each configuration once, and the error of each one that can't be used.
+
+    Leases for the same tenant and start date get numbered names in file order,
+    as in /generate/bulk, instead of overwriting each other's PDF.
+    """
+    inputs, errors, used_names = {}, {}, set()
+    for config_path in config_paths:
+        try:
+            data = config_path.read_bytes()
+            config = LeaseConfiguration.model_validate_json(data)
+        except (OSError, ValidationError) as e:
+            errors[config_path] = str(e)
+            continue
+        filename = document_filename("lease_agreement", config.parties.tenant_name,
+                                     config.lease_terms.start_date.isoformat(), "pdf")
+        inputs[config_path] = BatchInput(config, unique_name(filename, used_names),
+                                         input_hash(data, agreement_date, fingerprint))
+    return inputs, errors
+
+
+def load_manifest(out_dir: Path) -> dict:
+    try:
+        return json.loads((out_dir / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile; 0 when there are no values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m lease_generator.batch", description="Render saved lease configurations to PDF")
+    parser.add_argument("configs_dir", type=Path, help=f"Directory containing {CONFIGURATION_PATTERN} files")
+    parser.add_argument("out_dir", type=Path, help="Directory the PDFs are written to")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of render processes (default: CPU count)")
+    parser.add_argument("--agreement-date", type=date.fromisoformat, default=None,
+                        help="Agreement date printed on every lease (default: each configuration's updated_at date)")
+    parser.add_argument("--force", action="store_true", help="Re-render leases even when their output is up to date")
+    args = parser.parse_args(argv)
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(args.out_dir)
+    fingerprint = templates_fingerprint()
+
+    inputs, errors = read_configurations(sorted(args.configs_dir.glob(CONFIGURATION_PATTERN)), args.agreement_date, fingerprint)
+    failures = len(errors)
+    for config_path, error in errors.items():
+        manifest.pop(config_path.name, None)
+        print(f"FAILED {config_path.name}: {error}", file=sys.stderr)
+
+    # Work out which configurations changed since the last run
+    to_render = {}
+    skipped = 0
+    for config_path, batch_input in inputs.items():
+        previous = manifest.get(config_path.name)
+        if (not args.force and previous and previous["input_hash"] == batch_input.input_hash
+                and previous["output"] == batch_input.output and (args.out_dir / batch_input.output).exists()):
+            skipped += 1
+            continue
+        to_render[config_path] = batch_input
+
+    durations = []
+    started = time.perf_counter()
+    if to_render:
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs), initializer=warm_up_worker,
+                                 initargs=(pdf_stylesheets(),)) as executor:
+            futures = {
+                executor.submit(render_configuration, batch_input.config, args.out_dir, batch_input.output,
+                                args.agreement_date): config_path
+                for config_path, batch_input in to_render.items()
+            }
+            for future in as_completed(futures):
+                config_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failures += 1
+                    manifest.pop(config_path.name, None)
+                    print(f"FAILED {config_path.name}: {e}", file=sys.stderr)
+                    continue
+                durations.append(result["seconds"])
+                manifest[config_path.name] = {"input_hash": to_render[config_path].input_hash, "output": result["output"]}
+    elapsed = time.perf_counter() - started
+
+    (args.out_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+    print(f"Rendered {len(durations)} leases, skipped {skipped} up to date, {failures} failed")
+    if durations:
+        print(f"Throughput: {len(durations) / elapsed:.2f} leases/sec over {elapsed:.2f}s with {args.jobs} jobs")
+        print(f"Per-lease time: p50 {percentile(durations, 0.50) * 1000:.1f} ms, p95 {percentile(durations, 0.95) * 1000:.1f} ms")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
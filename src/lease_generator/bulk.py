@@ -0,0 +1,159 @@
+import asyncio
+import json
+import zipfile
+from collections import deque
+from fnmatch import fnmatch
+from typing import IO, AsyncIterator, Awaitable, Callable, Iterator, NamedTuple, Optional
+
+from pydantic import ValidationError
+
+from .documents import document_filename, prepare_lease, render_lease_html
+from .models import LeaseConfiguration
+
+
+# Files inside an uploaded ZIP that are treated as lease configurations (the save_config naming)
+CONFIGURATION_PATTERN = "lease_configuration_*.json"
+
+
+class BulkItem(NamedTuple):
+    source: str  # Where the configuration came from: "line 3" or the ZIP member name
+    config: Optional[LeaseConfiguration]
+    error: Optional[str]
+
+
+def iter_jsonl_configurations(stream: IO[bytes]) -> Iterator[BulkItem]:
+    """Validate one LeaseConfiguration per line, one line at a time"""
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        source = f"line {line_number}"
+        try:
+            yield BulkItem(source, LeaseConfiguration.model_validate_json(line), None)
+        except ValidationError as e:
+            yield BulkItem(source, None, str(e))
+
+
+def iter_zip_configurations(stream: IO[bytes]) -> Iterator[BulkItem]:
+    """Validate each lease_configuration_*.json member, reading one member at a time.
+
+    A member that can't be read (bad CRC, truncated or corrupt data, an
+    unsupported compression method) is reported like an invalid one, so one
+    broken file doesn't end the batch.
+    """
+    with zipfile.ZipFile(stream) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or not fnmatch(info.filename.rsplit('/', 1)[-1], CONFIGURATION_PATTERN):
+                continue
+            try:
+                config = LeaseConfiguration.model_validate_json(archive.read(info))
+            except Exception as e:
+                yield BulkItem(info.filename, None, str(e) or type(e).__name__)
+                continue
+            yield BulkItem(info.filename, config, None)
+
+
+def iter_configurations(stream: IO[bytes]) -> Iterator[BulkItem]:
+    """Detect whether an upload is a ZIP of configuration files or JSONL"""
+    is_zip = zipfile.is_zipfile(stream)
+    stream.seek(0)
+    if is_zip:
+        return iter_zip_configurations(stream)
+    return iter_jsonl_configurations(stream)
+
+
+class _ZipChunks:
+    """Write-only file object that collects ZipFile output until it is drained.
+
+    ZipFile falls back to streaming mode (data descriptors, no seeking) when
+    its file object can't tell(), so the archive can be sent as it is built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_name(filename: str, used_names: set) -> str:
+    """The filename, or the first free ``_2``, ``_3``... variant of it; the result is marked used"""
+    name, suffix = filename, 2
+    stem, dot, extension = filename.rpartition(".")
+    while name in used_names:
+        name = f"{stem}_{suffix}{dot}{extension}"
+        suffix += 1
+    used_names.add(name)
+    return name
+
+
+def _lease_document(config: LeaseConfiguration):
+    lease, schedule_rows = prepare_lease(config)
+    filename = document_filename("lease_agreement", lease.parties.tenant_name, lease.lease_terms.start_date.isoformat(), "pdf")
+    return filename, render_lease_html(lease, schedule_rows)
+
+
+async def stream_lease_pdfs(items: Iterator[BulkItem], render: Callable[[str], Awaitable[bytes]],
+                            concurrency: int) -> AsyncIterator[bytes]:
+    """Render configurations in parallel and stream them back as a ZIP of PDFs.
+
+    At most ``concurrency`` leases are in flight at once and results are
+    written in input order, so memory use doesn't grow with the batch size.
+    Items are read and validated in a worker thread, off the event loop.
+    The archive ends with manifest.json listing the outcome of every item.
+    """
+    output = _ZipChunks()
+    archive = zipfile.ZipFile(output, mode="w")
+    manifest = []
+    used_names = set()
+    pending = deque()
+
+    async def render_item(item: BulkItem):
+        if item.error:
+            return item, None, None, item.error
+        try:
+            filename, html_content = await asyncio.to_thread(_lease_document, item.config)
+            return item, filename, await render(html_content), None
+        except Exception as e:
+            return item, None, None, str(e)
+
+    def write_result(item: BulkItem, filename: Optional[str], pdf: Optional[bytes], error: Optional[str]):
+        if error:
+            manifest.append({"source": item.source, "status": "error", "error": error})
+            return
+        # Two leases for the same tenant and start date would otherwise overwrite each other
+        name = unique_name(filename, used_names)
+        # PDFs are already compressed internally
+        archive.writestr(name, pdf, compress_type=zipfile.ZIP_STORED)
+        manifest.append({"source": item.source, "status": "ok", "file": name})
+
+    try:
+        while (item := await asyncio.to_thread(next, items, None)) is not None:
+            pending.append(asyncio.ensure_future(render_item(item)))
+            if len(pending) >= concurrency:
+                write_result(*await pending.popleft())
+                yield output.drain()
+        while pending:
+            write_result(*await pending.popleft())
+            yield output.drain()
+
+        summary = {
+            "rendered": sum(1 for entry in manifest if entry["status"] == "ok"),
+            "failed": sum(1 for entry in manifest if entry["status"] == "error"),
+            "items": manifest,
+        }
+        archive.writestr("manifest.json", json.dumps(summary, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+        archive.close()
+        yield output.drain()
+    finally:
+        # Client went away mid-stream: don't keep rendering for nobody
+        for task in pending:
+            task.cancel()
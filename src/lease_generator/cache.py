@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: documents are still cached, but two workers may render the same one
+    fcntl = None
+
+
+def user_temp_path(name: str) -> Path:
+    """Default location for per-user state under the temp directory, which other users share"""
+    return Path(tempfile.gettempdir()) / (f"{name}-{os.getuid()}" if hasattr(os, "getuid") else name)
+
+
+def private_directory(path: Path) -> Path:
+    """Create a directory only this user can use, or make sure an existing one is.
+
+    Whatever is cached in these directories (template bytecode, PDFs, job
+    results) is loaded back and trusted, so a directory owned by another user -
+    e.g. one planted in /tmp ahead of us - is refused rather than used.
+    """
+    path = Path(path)
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if not hasattr(os, "getuid"):
+        return path
+    # Follows symlinks, so a link to someone else's directory is refused too
+    info = os.stat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise RuntimeError(f"{path} is not a directory owned by this user; refusing to use it")
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+# Cache sizing - override with environment variables in production
+CACHE_MEMORY_BYTES = int(os.environ.get("LEASE_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+# An empty LEASE_CACHE_DIR turns the disk tier off, leaving a memory-only cache
+_cache_dir = os.environ.get("LEASE_CACHE_DIR", str(user_temp_path("lease_generator_cache")))
+CACHE_DIR: Optional[Path] = Path(_cache_dir) if _cache_dir else None
+CACHE_TTL_SECONDS = int(os.environ.get("LEASE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# How often the disk tier is swept for expired entries
+SWEEP_INTERVAL_SECONDS = 300
+# Partly written files (*.tmp) older than this were left by a writer that died;
+# no render or cache write takes anywhere near as long
+STALE_TEMP_SECONDS = 3600
+
+
+def content_key(content: str, options: dict) -> str:
+    """Hash rendered document content together with the options used to render it"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(content.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class FileLock:
+    """Exclusive advisory lock (flock) on a file, held across processes.
+
+    Only ever taken without blocking, so callers on an event loop can poll it.
+    The lock file is removed on release, so a lock taken on a file that has
+    since been unlinked or replaced is dropped again: only the file currently
+    at the path counts. Whoever takes the lock next must still re-check
+    whatever it guards.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self) -> bool:
+        """Take the lock if nobody holds it; returns whether it was taken"""
+        if fcntl is None:
+            return True
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            try:
+                current = os.stat(self.path)
+            except FileNotFoundError:
+                current = None
+            opened = os.fstat(fd)
+            if current is not None and (current.st_ino, current.st_dev) == (opened.st_ino, opened.st_dev):
+                self._fd = fd
+                return True
+            # The holder released (and unlinked) this file after we opened it; try the one there now
+            os.close(fd)
+
+    def release(self):
+        if self._fd is None:
+            return
+        self.path.unlink(missing_ok=True)
+        os.close(self._fd)
+        self._fd = None
+
+
+class DocumentCache:
+    """Content-addressed two-tier cache for rendered documents.
+
+    The memory tier is an LRU bounded by total bytes; the disk tier survives
+    restarts and is shared by every worker pointing at the same directory.
+    Disk entries older than ``ttl_seconds`` are treated as misses and removed.
+    ``lock(key)`` lets one worker claim a document while it renders it.
+    """
+
+    def __init__(self, memory_bytes: int = CACHE_MEMORY_BYTES, directory: Optional[Path] = CACHE_DIR,
+                 ttl_seconds: int = CACHE_TTL_SECONDS, suffix: str = ".pdf"):
+        self.memory_bytes = memory_bytes
+        self.directory = Path(directory) if directory else None
+        self.ttl_seconds = ttl_seconds
+        self.suffix = suffix
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        if self.directory:
+            private_directory(self.directory)
+
+    def path(self, key: str) -> Path:
+        """Where the disk tier stores a document"""
+        # Fan out by prefix so a large cache doesn't end up in one huge directory
+        return self.directory / key[:2] / f"{key}{self.suffix}"
+
+    def lock(self, key: str) -> FileLock:
+        """Per-document lock, held by whichever worker sharing the directory is rendering it"""
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        return FileLock(path.with_name(f"{key}.lock"))
+
+    def fresh_path(self, key: str, count: bool = True) -> Optional[Path]:
+        """Disk tier file for a document if present and within the TTL, without reading it"""
+        if not self.directory:
+            return None
+        path = self.path(key)
+        try:
+            fresh = time.time() - path.stat().st_mtime <= self.ttl_seconds
+        except FileNotFoundError:
+            fresh = False
+        if count:
+            with self._lock:
+                if fresh:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return path if fresh else None
+
+    def get(self, key: str, count: bool = True) -> Optional[bytes]:
+        """Cached document, if any; ``count=False`` leaves the hit/miss counters alone (for re-checks)"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += count
+                return data
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += count
+                return None
+            self.hits += count
+            self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+        self.sweep_if_due()
+
+    def _remember(self, key: str, data: bytes):
+        # Documents larger than the whole budget stay on disk only
+        if len(data) > self.memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= len(previous)
+        self._memory[key] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.directory:
+            return None
+        path = self.path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                return None
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, data: bytes):
+        if not self.directory:
+            return
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        # Write to a temporary name first so readers never see a partial file
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+
+    def sweep_if_due(self):
+        """Remove expired disk entries, at most once every SWEEP_INTERVAL_SECONDS"""
+        now = time.time()
+        if not self.directory or now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        # Lock and temporary files are only left behind by a worker that died mid-render or mid-write
+        for pattern, max_age in ((f"*/*{self.suffix}", self.ttl_seconds), ("*/*.lock", self.ttl_seconds),
+                                 ("*/*.tmp", min(self.ttl_seconds, STALE_TEMP_SECONDS))):
+            for path in self.directory.glob(pattern):
+                try:
+                    if now - path.stat().st_mtime > max_age:
+                        path.unlink(missing_ok=True)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,410 @@
+import copyreg
+import csv
+import hashlib
+import io
+import json
+import operator
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Literal, NamedTuple, Optional, Tuple, Union, get_args
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateError, meta, nodes, select_autoescape
+
+from .cache import private_directory, user_temp_path
+from .models import LeaseAgreement, LeaseConfiguration, LeaseTerms
+from .render import RENDER_OPTIONS, inline_stylesheets
+from .schedule import ScheduleRow, build_schedule_rows
+
+
+# Compiled templates are shared on disk by every process; entries are keyed by a
+# checksum of the template source, so an edited template is simply recompiled
+TEMPLATE_CACHE_DIR = private_directory(Path(os.environ.get("LEASE_TEMPLATE_CACHE_DIR", user_temp_path("lease_generator_templates"))))
+
+# Setup templates - shared by the web app and headless renderers
+templates_dir = Path(__file__).parent / "templates"
+template_env = Environment(
+    loader=FileSystemLoader(str(templates_dir)),
+    autoescape=select_autoescape(),
+    bytecode_cache=FileSystemBytecodeCache(str(TEMPLATE_CACHE_DIR)),
+)
+
+def format_currency(amount):
+    """Format currency with commas and no .00 for whole numbers"""
+    if amount is None:
+        return "$0"
+    
+    # Check if it's a whole number
+    if float(amount) == int(amount):
+        return f"${int(amount):,}"
+    else:
+        return f"${amount:,.2f}"
+
+# Add the filter to Jinja2 environment
+template_env.filters['currency'] = format_currency
+
+
+def precompile_templates() -> Dict[str, str]:
+    """Compile every template into memory and the shared bytecode cache.
+
+    Returns the templates that failed to compile, mapped to their error.
+    """
+    errors = {}
+    for name in template_env.list_templates():
+        try:
+            template_env.get_template(name)
+        except TemplateError as e:
+            errors[name] = f"line {getattr(e, 'lineno', '?')}: {e}"
+    return errors
+
+
+def pdf_stylesheets() -> List[str]:
+    """CSS of every document rendered to PDF, read fresh from the templates"""
+    return [css_text for name in ("lease/head.html", "payment_schedule.html")
+            for css_text in inline_stylesheets((templates_dir / name).read_text(encoding="utf-8"))]
+
+
+# Template files are checked for edits at most this often
+FINGERPRINT_CHECK_SECONDS = 1.0
+
+_fingerprint = (0.0, None, "")
+
+
+def templates_fingerprint() -> str:
+    """Hash of every template file - changes whenever a template is edited"""
+    global _fingerprint
+    checked_at, previous_signature, fingerprint = _fingerprint
+    now = time.monotonic()
+    if fingerprint and now - checked_at < FINGERPRINT_CHECK_SECONDS:
+        return fingerprint
+    paths = sorted(path for path in templates_dir.rglob("*") if path.is_file())
+    # Only re-read the templates when one of them has been touched
+    signature = tuple((path, path.stat().st_mtime_ns, path.stat().st_size) for path in paths)
+    if signature != previous_signature:
+        digest = hashlib.sha256()
+        for path in paths:
+            digest.update(path.relative_to(templates_dir).as_posix().encode("utf-8"))
+            digest.update(path.read_bytes())
+        fingerprint = digest.hexdigest()
+    _fingerprint = (now, signature, fingerprint)
+    return fingerprint
+
+
+def input_hash(config_bytes: bytes, agreement_date: Optional[date], fingerprint: str) -> str:
+    """Hash everything that determines a lease document: configuration, agreement date, templates and renderer"""
+    digest = hashlib.sha256()
+    digest.update(config_bytes)
+    digest.update(str(agreement_date).encode("utf-8"))
+    digest.update(fingerprint.encode("utf-8"))
+    digest.update(json.dumps(RENDER_OPTIONS, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def document_key(lease: LeaseAgreement, fingerprint: str) -> str:
+    """Identify the document a lease renders to: its canonical JSON (agreement date included), templates and renderer"""
+    return input_hash(lease.model_dump_json().encode("utf-8"), lease.agreement_date, fingerprint)[:32]
+
+
+# What a lease can be rendered as, by /api/leases/render and /jobs
+LeaseOutputFormat = Literal["html", "pdf", "config", "renewal_message"]
+LEASE_OUTPUT_FORMATS = get_args(LeaseOutputFormat)
+
+
+def document_filename(prefix: str, tenant_name: str, start_date: str, extension: str) -> str:
+    """Build the <prefix>_<tenant_name>_<lease_start_date>.<ext> names used for downloads"""
+    tenant_name_clean = tenant_name.replace(' ', '_').replace('/', '_').lower()
+    start_date_clean = start_date.replace('-', '_')
+    return f"{prefix}_{tenant_name_clean}_{start_date_clean}.{extension}"
+
+
+def configuration_schedule_rows(config: Union[LeaseConfiguration, LeaseAgreement]) -> List[ScheduleRow]:
+    """Generate the full payment schedule for a saved configuration (or a lease), even when it isn't set to auto-generate.
+
+    The one place schedule rows are derived from, so every route renders the same rows for the same lease.
+    """
+    terms = config.lease_terms
+    payment_schedule = config.additional_terms.payment_schedule
+
+    # Same security deposit rules as the form: only renewals with a known previous rent
+    details = terms.security_deposit_details
+    previous_rent = (details.previous_rent or 0.0) if details else 0.0
+    security_increase = 0.0
+    if details and details.use_custom_section and previous_rent > 0:
+        security_increase = terms.monthly_rent - previous_rent
+
+    return build_schedule_rows(
+        terms.start_date,
+        terms.end_date,
+        terms.monthly_rent,
+        payment_schedule.rent_increases if payment_schedule else [],
+        payment_schedule.custom_entries if payment_schedule else [],
+        security_increase,
+        (payment_schedule.lease_start_comment if payment_schedule else None) or "",
+        previous_rent
+    )
+
+
+def prepare_lease(config: LeaseConfiguration, agreement_date: Optional[date] = None) -> Tuple[LeaseAgreement, Optional[List[ScheduleRow]]]:
+    """Build a lease agreement from a saved configuration plus its generated payment schedule rows.
+
+    The agreement keeps the configured (manual) schedule entries; the rows are
+    None unless the schedule is auto-generated.
+    """
+    payment_schedule = config.additional_terms.payment_schedule
+    schedule_rows = None
+    if payment_schedule and payment_schedule.auto_generate:
+        schedule_rows = configuration_schedule_rows(config)
+
+    lease = LeaseAgreement(
+        parties=config.parties,
+        property_details=config.property_details,
+        lease_terms=config.lease_terms,
+        property_features=config.property_features,
+        additional_terms=config.additional_terms,
+        governing_law_state=config.governing_law_state,
+        agreement_date=agreement_date or date.today(),
+        lead_paint_disclosure=config.lead_paint_disclosure
+    )
+    return lease, schedule_rows
+
+
+def lease_configuration(lease: LeaseAgreement) -> LeaseConfiguration:
+    """The saved configuration for a lease: everything but the agreement date, stamped now.
+
+    A lease only carries the manual schedule entries (generated rows are kept
+    separately), so its additional terms are exactly what gets saved.
+    """
+    now = datetime.now()
+    return LeaseConfiguration(
+        parties=lease.parties,
+        property_details=lease.property_details,
+        lease_terms=lease.lease_terms,
+        property_features=lease.property_features,
+        additional_terms=lease.additional_terms,
+        governing_law_state=lease.governing_law_state,
+        lead_paint_disclosure=lease.lead_paint_disclosure,
+        created_at=now,
+        updated_at=now
+    )
+
+
+def renewal_previous_rent(terms: LeaseTerms) -> float:
+    """Rent before this lease when it is a renewal with a custom security deposit section, else 0"""
+    details = terms.security_deposit_details
+    return (details.previous_rent or 0.0) if details and details.use_custom_section else 0.0
+
+
+def generate_renewal_message(tenant_name: str, previous_rent: float, current_rent: float) -> str:
+    """Generate a dynamic renewal message text"""
+    # Extract first name (first word of full name)
+    first_name = tenant_name.split()[0]
+    
+    # Calculate rent increase amount and percentage
+    rent_increase = current_rent - previous_rent
+    if previous_rent > 0:
+        increase_percentage = (rent_increase / previous_rent) * 100
+        increase_percentage = round(increase_percentage)  # Round to whole number
+    else:
+        increase_percentage = 0
+    
+    # Calculate sign by date (2 weeks from today)
+    sign_by_date = (datetime.now() + timedelta(days=14)).strftime('%B %d, %Y')
+    
+    # Format the message
+    message = f"""Hi {first_name}! I hope you're doing well. I wanted to thank you for being such a great tenant over the past year—I really appreciate how well you've taken care of the place. Attached is the lease renewal for the upcoming year. The rent will increase by {increase_percentage}% ({format_currency(rent_increase)}), bringing the monthly total to {format_currency(current_rent)}, and you'll see the updated payment schedule included in the lease. Please review and sign within the next two weeks, by {sign_by_date}, and let me know if you have any questions or concerns. Thanks again!"""
+    
+    return message
+
+
+def lease_from_configuration(config: LeaseConfiguration, agreement_date: Optional[date] = None) -> LeaseAgreement:
+    """Build a lease agreement from a saved configuration, with the full payment schedule as models"""
+    lease, schedule_rows = prepare_lease(config, agreement_date)
+    if schedule_rows is None:
+        return lease
+    payment_schedule = lease.additional_terms.payment_schedule.model_copy(update={
+        "custom_entries": [row.to_entry() for row in schedule_rows]
+    })
+    return lease.model_copy(update={
+        "additional_terms": lease.additional_terms.model_copy(update={"payment_schedule": payment_schedule})
+    })
+
+
+def lease_template_context(lease: LeaseAgreement, schedule_rows: Optional[List[ScheduleRow]] = None) -> dict:
+    """Serialize a lease for lease_template.html with dates formatted for display"""
+    lease_data = lease.model_dump(mode='json')
+    lease_data['agreement_date'] = lease.agreement_date.strftime('%m/%d/%Y')
+    lease_data['lease_terms']['start_date'] = lease.lease_terms.start_date.strftime('%m/%d/%Y')
+    lease_data['lease_terms']['end_date'] = lease.lease_terms.end_date.strftime('%m/%d/%Y')
+    # The template reads generated rows directly - no per-row model or dict
+    if schedule_rows is not None:
+        lease_data['additional_terms']['payment_schedule']['custom_entries'] = schedule_rows
+    return lease_data
+
+
+# Rendered lease sections kept per process; a section is a few KB of HTML
+FRAGMENT_CACHE_SIZE = 1024
+
+
+class LeaseSection(NamedTuple):
+    name: str
+    # Top-level context names the section reads, with the attributes it reads
+    # from each - None when the value is used as a whole
+    fields: Dict[str, Optional[FrozenSet[str]]]
+
+
+_sections = (None, [])
+_fragments: "OrderedDict[tuple, str]" = OrderedDict()
+_fragments_lock = threading.Lock()
+# Section lookups served from / missing the cache, for the metrics endpoint
+fragment_stats = {"hits": 0, "misses": 0}
+
+
+def _fields_read(template_name: str) -> Dict[str, Optional[FrozenSet[str]]]:
+    """Find the context values a template reads, e.g. {"lease_terms": {"monthly_rent", ...}}"""
+    source = template_env.loader.get_source(template_env, template_name)[0]
+    ast = template_env.parse(source)
+    top_level = meta.find_undeclared_variables(ast)
+
+    attributes, narrowed = {}, set()
+    for node in ast.find_all((nodes.Getattr, nodes.Getitem)):
+        if not (isinstance(node.node, nodes.Name) and node.node.name in top_level):
+            continue
+        if isinstance(node, nodes.Getattr):
+            attribute = node.attr
+        elif isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+            attribute = node.arg.value
+        else:
+            continue
+        attributes.setdefault(node.node.name, set()).add(attribute)
+        narrowed.add(id(node.node))
+
+    fields = {name: frozenset(names) for name, names in attributes.items()}
+    # Any other use (a bare name, a dynamic subscript) depends on the whole value
+    for node in ast.find_all(nodes.Name):
+        if node.name in top_level and id(node) not in narrowed:
+            fields[node.name] = None
+    return fields
+
+
+def lease_sections(fingerprint: str) -> List[LeaseSection]:
+    """The sections lease_template.html includes, in document order"""
+    global _sections
+    if _sections[0] != fingerprint:
+        source = template_env.loader.get_source(template_env, "lease_template.html")[0]
+        names = [node.template.value for node in template_env.parse(source).find_all(nodes.Include)]
+        _sections = (fingerprint, [LeaseSection(name, _fields_read(name)) for name in names])
+    return _sections[1]
+
+
+def _section_context(section: LeaseSection, context: dict) -> dict:
+    projected = {}
+    for name, attributes in section.fields.items():
+        if name not in context:
+            continue
+        value = context[name]
+        if attributes is not None and isinstance(value, dict):
+            value = {attribute: value[attribute] for attribute in attributes if attribute in value}
+        projected[name] = value
+    return projected
+
+
+# Schedule rows pickle as plain tuples of their values
+_row_values = operator.attrgetter(*ScheduleRow.__slots__)
+_key_dispatch = copyreg.dispatch_table.copy()
+_key_dispatch[ScheduleRow] = lambda row: (tuple, (_row_values(row),))
+
+
+def _values_digest(values: dict) -> bytes:
+    # Pickle is much faster than JSON for the schedule rows; equal bytes always
+    # mean equal values, and the rare spurious difference is only a cache miss
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = _key_dispatch
+    pickler.dump(values)
+    return hashlib.sha256(buffer.getvalue()).digest()
+
+
+def render_lease_document(context: dict) -> str:
+    """Render lease_template.html one section at a time, reusing cached sections.
+
+    Each section is rendered with - and cached on - only the values it reads,
+    so changing the rent re-renders the rent and schedule sections while the
+    parties, property, standard terms and disclosures come from the cache.
+    The result is identical to rendering lease_template.html directly.
+    """
+    fingerprint = templates_fingerprint()
+    parts = []
+    for section in lease_sections(fingerprint):
+        section_context = _section_context(section, context)
+        key = (section.name, fingerprint, _values_digest(section_context))
+        with _fragments_lock:
+            html = _fragments.get(key)
+            if html is not None:
+                _fragments.move_to_end(key)
+                fragment_stats["hits"] += 1
+            else:
+                fragment_stats["misses"] += 1
+        if html is None:
+            html = template_env.get_template(section.name).render(section_context)
+            with _fragments_lock:
+                _fragments[key] = html
+                if len(_fragments) > FRAGMENT_CACHE_SIZE:
+                    _fragments.popitem(last=False)
+        parts.append(html)
+    # Sections are included one per line, so the template joins them with newlines
+    return "\n".join(parts)
+
+
+def render_lease_html(lease: LeaseAgreement, schedule_rows: Optional[List[ScheduleRow]] = None) -> str:
+    return render_lease_document(lease_template_context(lease, schedule_rows))
+
+
+# Payment schedule exports - entries are serialized PaymentEntry dicts
+SCHEDULE_COLUMNS = ("entry_number", "due_date", "rent_amount", "security_deposit", "pet_deposit", "other_fees", "total", "comment")
+# Rows (or template output pieces) sent per chunk when streaming a schedule
+SCHEDULE_CHUNK_ROWS = 256
+
+
+def payment_schedule_document(lease_data: dict, entries: List[dict]) -> Iterator[str]:
+    """Stream the standalone payment schedule HTML in chunks, escaped by the template"""
+    parties = lease_data.get("parties") or {}
+    terms = lease_data.get("lease_terms") or {}
+    stream = template_env.get_template("payment_schedule.html").stream({
+        "tenant_name": parties.get("tenant_name", ""),
+        "mailing_address": (lease_data.get("property_details") or {}).get("mailing_address", ""),
+        "start_date": terms.get("start_date", ""),
+        "end_date": terms.get("end_date", ""),
+        "entries": entries,
+    })
+    stream.enable_buffering(SCHEDULE_CHUNK_ROWS)
+    return stream
+
+
+def payment_schedule_csv(entries: Iterable[dict]) -> Iterator[str]:
+    """Stream schedule entries as CSV with a header row; memory use doesn't grow with the schedule"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SCHEDULE_COLUMNS)
+    for count, entry in enumerate(entries, 1):
+        writer.writerow([entry.get(column) for column in SCHEDULE_COLUMNS])
+        if count % SCHEDULE_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def payment_schedule_jsonl(entries: Iterable[dict]) -> Iterator[str]:
+    """Stream schedule entries as one JSON object per line"""
+    lines = []
+    for entry in entries:
+        lines.append(json.dumps({column: entry.get(column) for column in SCHEDULE_COLUMNS}) + "\n")
+        if len(lines) >= SCHEDULE_CHUNK_ROWS:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
@@ -0,0 +1,400 @@
+"""Durable background jobs for long-running lease and bulk renders.
+
+Jobs are queued in SQLite and drained by workers inside each web process
+(LEASE_JOB_WORKERS) and/or by dedicated worker processes, so rendering
+capacity can grow without adding web processes:
+
+Usage: python -m lease_generator.jobs [--workers N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import traceback
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from datetime import date, datetime
+from pathlib import Path
+from typing import IO, Dict, NamedTuple, Optional, Tuple
+
+from pydantic import ValidationError
+
+from .bulk import iter_configurations, stream_lease_pdfs
+from .cache import DocumentCache, private_directory, user_temp_path
+from .documents import (
+    LEASE_OUTPUT_FORMATS, document_filename, generate_renewal_message, pdf_stylesheets, prepare_lease, render_lease_html,
+    renewal_previous_rent,
+)
+from .models import configuration_adapter
+from .render import PDFRenderPool
+from .store import LEASE_DB_PATH
+
+
+# Queue settings - override with environment variables in production
+# Jobs each web process works on at once; 0 leaves them to `python -m lease_generator.jobs`
+JOB_WORKERS = int(os.environ.get("LEASE_JOB_WORKERS", "2"))
+JOB_DIR = Path(os.environ.get("LEASE_JOB_DIR", user_temp_path("lease_generator_jobs")))
+JOB_RESULT_TTL_SECONDS = int(os.environ.get("LEASE_JOB_RESULT_TTL_SECONDS", str(24 * 3600)))
+JOB_MAX_ATTEMPTS = int(os.environ.get("LEASE_JOB_MAX_ATTEMPTS", "3"))
+
+# A running job whose worker hasn't checked in for this long is assumed dead and retried
+JOB_CLAIM_SECONDS = 120
+HEARTBEAT_SECONDS = 10
+POLL_SECONDS = 0.5
+# Pause after an unexpected error before a worker carries on
+WORKER_ERROR_SECONDS = 5
+# How often finished jobs past their TTL are removed
+EXPIRE_INTERVAL_SECONDS = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT NOT NULL DEFAULT '',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    media_type TEXT,
+    filename TEXT,
+    claimed_until REAL,
+    expires_at REAL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+class Job(NamedTuple):
+    job_id: str
+    kind: str  # "lease" or "bulk"
+    payload: dict
+    status: str  # queued, running, done or failed
+    progress: str
+    attempts: int
+    error: Optional[str]
+    media_type: Optional[str]
+    filename: Optional[str]
+    created_at: str
+    updated_at: str
+
+    def summary(self) -> dict:
+        return {name: getattr(self, name) for name in
+                ("job_id", "kind", "status", "progress", "attempts", "error", "created_at", "updated_at")}
+
+
+class JobInputError(ValueError):
+    """The job itself is invalid, so retrying it can't help"""
+
+
+class JobQueue:
+    """SQLite-backed job queue shared by every process using the same database.
+
+    Workers claim a job for JOB_CLAIM_SECONDS and extend the claim while they
+    work; a job whose worker crashed is claimed again once its claim lapses,
+    up to JOB_MAX_ATTEMPTS attempts. Inputs and results are files in
+    ``directory``; finished jobs are removed ``result_ttl_seconds`` after they end.
+    """
+
+    def __init__(self, path: Path = LEASE_DB_PATH, directory: Path = JOB_DIR,
+                 result_ttl_seconds: int = JOB_RESULT_TTL_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.directory = Path(directory)
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_attempts = max_attempts
+        self._last_expiry = 0.0
+        private_directory(self.directory)
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call, so the queue is safe to use from any thread
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def input_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.input"
+
+    def result_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.result"
+
+    def submit(self, kind: str, payload: dict, upload: Optional[IO[bytes]] = None) -> str:
+        """Queue a job; an uploaded input file is copied to the job directory first"""
+        job_id = uuid.uuid4().hex
+        if upload is not None:
+            tmp_path = self.input_path(job_id).with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(upload, f)
+            os.replace(tmp_path, self.input_path(job_id))
+        now = datetime.now().isoformat()
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT INTO jobs (job_id, kind, payload, status, progress, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def _job(self, row: sqlite3.Row) -> Job:
+        return Job(row["job_id"], row["kind"], json.loads(row["payload"]), row["status"], row["progress"],
+                   row["attempts"], row["error"], row["media_type"], row["filename"], row["created_at"], row["updated_at"])
+
+    def claim(self) -> Optional[Job]:
+        """Take the oldest queued job, or one whose worker stopped checking in"""
+        with closing(self._connect()) as db:
+            # IMMEDIATE takes the write lock up front, so two workers never claim the same job
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    now = time.time()
+                    row = db.execute(
+                        "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND claimed_until < ?) "
+                        "ORDER BY created_at LIMIT 1",
+                        (now,),
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    if row["attempts"] >= self.max_attempts:
+                        db.execute(
+                            "UPDATE jobs SET status = 'failed', error = ?, claimed_until = NULL, expires_at = ?, updated_at = ? "
+                            "WHERE job_id = ?",
+                            (f"Gave up after {row['attempts']} attempts: {row['error'] or 'worker stopped responding'}",
+                             now + self.result_ttl_seconds, datetime.now().isoformat(), row["job_id"]),
+                        )
+                        continue
+                    db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, progress = 'started', "
+                        "claimed_until = ?, updated_at = ? WHERE job_id = ?",
+                        (now + JOB_CLAIM_SECONDS, datetime.now().isoformat(), row["job_id"]),
+                    )
+                    return self._job(row)._replace(status="running", attempts=row["attempts"] + 1, progress="started")
+            finally:
+                db.commit()
+
+    def heartbeat(self, job_id: str, progress: str):
+        """Record progress and extend the worker's claim on a running job"""
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE jobs SET progress = ?, claimed_until = ?, updated_at = ? WHERE job_id = ? AND status = 'running'",
+                (progress, time.time() + JOB_CLAIM_SECONDS, datetime.now().isoformat(), job_id),
+            )
+
+    def complete(self, job_id: str, media_type: str, filename: str):
+        """Mark a job done; its result must already be at result_path(job_id)"""
+        self._finish(job_id, "done", "done", None, media_type, filename)
+
+    def fail(self, job_id: str, error: str, retry: bool):
+        """Record a failed attempt; the job is queued again while it has attempts left"""
+        job = self.get(job_id)
+        if retry and job is not None and job.attempts < self.max_attempts:
+            with closing(self._connect()) as db, db:
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', progress = 'queued', error = ?, claimed_until = NULL, "
+                    "updated_at = ? WHERE job_id = ?",
+                    (error, datetime.now().isoformat(), job_id),
+                )
+            return
+        self._finish(job_id, "failed", "failed", error, None, None)
+
+    def release(self, job_id: str):
+        """Put a job back without counting the attempt, e.g. when its worker shuts down"""
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE jobs SET status = 'queued', progress = 'queued', attempts = MAX(attempts - 1, 0), "
+                "claimed_until = NULL, updated_at = ? WHERE job_id = ? AND status = 'running'",
+                (datetime.now().isoformat(), job_id),
+            )
+
+    def _finish(self, job_id: str, status: str, progress: str, error: Optional[str],
+                media_type: Optional[str], filename: Optional[str]):
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE jobs SET status = ?, progress = ?, error = ?, media_type = ?, filename = ?, "
+                "claimed_until = NULL, expires_at = ?, updated_at = ? WHERE job_id = ?",
+                (status, progress, error, media_type, filename, time.time() + self.result_ttl_seconds,
+                 datetime.now().isoformat(), job_id),
+            )
+        self.input_path(job_id).unlink(missing_ok=True)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs in each status"""
+        with closing(self._connect()) as db:
+            return dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def expire_if_due(self):
+        """Remove finished jobs past their TTL, at most once every EXPIRE_INTERVAL_SECONDS"""
+        now = time.time()
+        if now - self._last_expiry < EXPIRE_INTERVAL_SECONDS:
+            return
+        self._last_expiry = now
+        with closing(self._connect()) as db, db:
+            expired = [row[0] for row in db.execute(
+                "SELECT job_id FROM jobs WHERE status IN ('done', 'failed') AND expires_at < ?", (now,))]
+            db.executemany("DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in expired])
+        for job_id in expired:
+            self.result_path(job_id).unlink(missing_ok=True)
+            self.input_path(job_id).unlink(missing_ok=True)
+
+
+def _write_result(path: Path, content: bytes):
+    tmp_path = path.with_suffix(".tmp")
+    try:
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+async def _run_lease_job(queue: JobQueue, job: Job, render_pool: PDFRenderPool, progress: Dict[str, str]) -> Tuple[str, str]:
+    """Render one lease into the job's result file; returns (media_type, filename)"""
+    try:
+        config = configuration_adapter.validate_json(job.payload["configuration"])
+    except ValidationError as e:
+        raise JobInputError(str(e))
+    agreement_date = date.fromisoformat(job.payload["agreement_date"])
+    output_format = job.payload["output_format"]
+    if output_format not in LEASE_OUTPUT_FORMATS:
+        raise JobInputError(f"Unknown output format: {output_format}")
+    tenant_name = config.parties.tenant_name
+    start_date = config.lease_terms.start_date.isoformat()
+    result_path = queue.result_path(job.job_id)
+
+    if output_format == "config":
+        content = json.dumps(config.model_dump(mode='json'), indent=2).encode("utf-8")
+        await asyncio.to_thread(_write_result, result_path, content)
+        return "application/json", document_filename("lease_configuration", tenant_name, start_date, "json")
+    if output_format == "renewal_message":
+        previous_rent = renewal_previous_rent(config.lease_terms)
+        if previous_rent <= 0:
+            raise JobInputError("Renewal message can only be generated when previous rent is specified")
+        content = generate_renewal_message(tenant_name, previous_rent, config.lease_terms.monthly_rent).encode("utf-8")
+        await asyncio.to_thread(_write_result, result_path, content)
+        return "text/plain; charset=utf-8", document_filename("renewal_message", tenant_name, start_date, "txt")
+
+    progress["text"] = "rendering html"
+    # Templating takes milliseconds per lease; keep it off the event loop the web app shares
+    lease, schedule_rows = await asyncio.to_thread(prepare_lease, config, agreement_date)
+    html_content = await asyncio.to_thread(render_lease_html, lease, schedule_rows)
+    if output_format == "html":
+        await asyncio.to_thread(_write_result, result_path, html_content.encode("utf-8"))
+        return "text/html; charset=utf-8", document_filename("lease_agreement", tenant_name, start_date, "html")
+
+    progress["text"] = "rendering pdf"
+    rendered = await render_pool.render_file(html_content)
+    if rendered.temporary:
+        await asyncio.to_thread(os.replace, rendered.path, result_path)
+    else:
+        # The cache keeps its own copy
+        await asyncio.to_thread(shutil.copyfile, rendered.path, result_path)
+    return "application/pdf", document_filename("lease_agreement", tenant_name, start_date, "pdf")
+
+
+async def _run_bulk_job(queue: JobQueue, job: Job, render_pool: PDFRenderPool, progress: Dict[str, str]) -> Tuple[str, str]:
+    """Render an uploaded batch into a ZIP of PDFs, written to disk as it is built"""
+    tmp_path = queue.result_path(job.job_id).with_suffix(".tmp")
+    try:
+        with open(queue.input_path(job.job_id), "rb") as upload, open(tmp_path, "wb") as output:
+            def counted(items):
+                for count, item in enumerate(items, 1):
+                    progress["text"] = f"{count} configurations read"
+                    yield item
+
+            items = counted(await asyncio.to_thread(iter_configurations, upload))
+            async for chunk in stream_lease_pdfs(items, render_pool.render, concurrency=render_pool.workers * 2):
+                if chunk:
+                    await asyncio.to_thread(output.write, chunk)
+        os.replace(tmp_path, queue.result_path(job.job_id))
+    finally:
+        # A partial archive from a failed attempt; the next attempt starts over
+        tmp_path.unlink(missing_ok=True)
+    return "application/zip", "lease_agreements.zip"
+
+
+JOB_RUNNERS = {"lease": _run_lease_job, "bulk": _run_bulk_job}
+
+
+async def run_job(queue: JobQueue, job: Job, render_pool: PDFRenderPool):
+    """Run a claimed job to completion, checking in with the queue while it works"""
+    progress = {"text": "started"}
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            await asyncio.to_thread(queue.heartbeat, job.job_id, progress["text"])
+
+    beating = asyncio.create_task(heartbeat())
+    try:
+        media_type, filename = await JOB_RUNNERS[job.kind](queue, job, render_pool, progress)
+    except asyncio.CancelledError:
+        await asyncio.shield(asyncio.to_thread(queue.release, job.job_id))
+        raise
+    except JobInputError as e:
+        await asyncio.to_thread(queue.fail, job.job_id, str(e), False)
+    except (BrokenProcessPool, OSError) as e:
+        # The render worker died or the disk hiccuped - worth another attempt
+        await asyncio.to_thread(queue.fail, job.job_id, f"{type(e).__name__}: {e}", True)
+    except Exception as e:
+        await asyncio.to_thread(queue.fail, job.job_id, f"{type(e).__name__}: {e}", False)
+    else:
+        await asyncio.to_thread(queue.complete, job.job_id, media_type, filename)
+    finally:
+        beating.cancel()
+
+
+async def run_worker(queue: JobQueue, render_pool: PDFRenderPool):
+    """Claim and run jobs one at a time until cancelled"""
+    while True:
+        try:
+            await asyncio.to_thread(queue.expire_if_due)
+            job = await asyncio.to_thread(queue.claim)
+            if job is None:
+                await asyncio.sleep(POLL_SECONDS)
+                continue
+            await run_job(queue, job, render_pool)
+        except Exception:
+            # e.g. "database is locked" with many writers; nothing restarts a worker that
+            # returns, and a job it claimed is retried once the claim lapses
+            print("Job worker error, retrying:", file=sys.stderr)
+            traceback.print_exc()
+            await asyncio.sleep(WORKER_ERROR_SECONDS)
+
+
+async def _serve(workers: int):
+    queue = JobQueue()
+    # The disk tier of the PDF cache is shared with the web processes
+    render_pool = PDFRenderPool(cache=DocumentCache(), warm_stylesheets=pdf_stylesheets)
+    await render_pool.start()
+    try:
+        await asyncio.gather(*[run_worker(queue, render_pool) for _ in range(workers)])
+    finally:
+        render_pool.shutdown()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m lease_generator.jobs", description="Run background render job workers")
+    parser.add_argument("--workers", type=int, default=max(1, JOB_WORKERS),
+                        help="Jobs worked on at once (default: LEASE_JOB_WORKERS, at least 1)")
+    args = parser.parse_args(argv)
+    print(f"Working on up to {args.workers} jobs at once from {LEASE_DB_PATH}")
+    try:
+        asyncio.run(_serve(args.workers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
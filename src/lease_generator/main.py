@@ -1,193 +1,238 @@
-from fastapi import FastAPI, Form, Request, File, UploadFile
-from fastapi.responses import HTMLResponse, Response
+from fastapi import Depends, FastAPI, Form, HTTPException, Request, File, UploadFile
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-import weasyprint
-from datetime import date, datetime, timedelta
-from typing import List, Optional
+from starlette.background import BackgroundTask
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import AsyncIterator, List, Literal, NamedTuple, Optional
+from pydantic import ValidationError
+import asyncio
 import json
+import logging
+import os
+import tempfile
+import time
 from pathlib import Path
 
 from .models import (
     LeaseAgreement, LeaseParties, PropertyDetails, 
     LeaseTerms, PropertyFeatures, AdditionalTerms, LeaseConfiguration,
-    SecurityDepositDetails, PaymentEntry, PaymentSchedule
+    SecurityDepositDetails, PaymentEntry, PaymentSchedule, configuration_adapter
 )
+from .admission import AdmissionController, admission_client
+from .bulk import iter_configurations, stream_lease_pdfs
+from .cache import DocumentCache
+from .documents import (
+    template_env, configuration_schedule_rows, document_filename, lease_template_context, pdf_stylesheets, fragment_stats,
+    document_key, generate_renewal_message, input_hash, lease_configuration, payment_schedule_csv, payment_schedule_document,
+    payment_schedule_jsonl, precompile_templates, prepare_lease, render_lease_document, render_lease_html,
+    renewal_previous_rent, templates_fingerprint, LEASE_OUTPUT_FORMATS, LeaseOutputFormat
+)
+from .jobs import JOB_WORKERS, JobQueue, run_worker
+from .metrics import TimingMiddleware, exposition, request_timings, sample_lines
+from .pages import CompressedPage, PageCache, negotiate_encoding
+from .portfolio import rollup
+from .profiling import ProfilingMiddleware, profiling_enabled, request_profile
+from .schedule import ScheduleRow
+from .render import PDFRenderPool, RenderedFile, RENDER_PREWARM
+from .store import LeaseStore
 
-app = FastAPI(title="Lease Generator", description="Generate residential lease agreements")
+logger = logging.getLogger(__name__)
 
-# Setup Jinja2 templates
+# PDF rendering runs in a separate process pool so it never blocks the event loop;
+# identical documents are served from the cache instead of being laid out again
+pdf_cache = DocumentCache()
+render_pool = PDFRenderPool(cache=pdf_cache, warm_stylesheets=pdf_stylesheets)
 
-# Setup templates
-templates_dir = Path(__file__).parent / "templates"
-templates = Jinja2Templates(directory=str(templates_dir))
+# Saved leases and the documents rendered from them
+lease_store = LeaseStore()
+SAVED_LEASES_SHOWN = 20
 
-# Add custom currency filter
-def format_currency(amount):
-    """Format currency with commas and no .00 for whole numbers"""
-    if amount is None:
-        return "$0"
-    
-    # Check if it's a whole number
-    if float(amount) == int(amount):
-        return f"${int(amount):,}"
-    else:
-        return f"${amount:,.2f}"
+# Bounds the render work in progress in this process (see admission.py)
+render_admission = AdmissionController()
 
-# Add the filter to Jinja2 environment
-templates.env.filters['currency'] = format_currency
+# The form pages are rendered and compressed once, then again only when their inputs change
+page_cache = PageCache()
+EXAMPLE_TEMPLATE_PATH = Path(__file__).resolve().parent.parent.parent / "example_template.json"
 
+# /documents/{key}/{kind} URLs only ever serve one document, so browsers and proxies may keep them
+DOCUMENT_CACHE_CONTROL = os.environ.get("LEASE_DOCUMENT_CACHE_CONTROL", "public, max-age=31536000, immutable")
+# GET /templates/example only changes with the templates or example_template.json, and its ETag changes with it
+EXAMPLE_PAGE_CACHE_CONTROL = os.environ.get("LEASE_EXAMPLE_PAGE_CACHE_CONTROL", "public, max-age=86400")
 
-def generate_renewal_message(tenant_name: str, previous_rent: float, current_rent: float) -> str:
-    """Generate a dynamic renewal message text"""
-    # Extract first name (first word of full name)
-    first_name = tenant_name.split()[0]
-    
-    # Calculate rent increase amount and percentage
-    rent_increase = current_rent - previous_rent
-    if previous_rent > 0:
-        increase_percentage = (rent_increase / previous_rent) * 100
-        increase_percentage = round(increase_percentage)  # Round to whole number
-    else:
-        increase_percentage = 0
-    
-    # Calculate sign by date (2 weeks from today)
-    sign_by_date = (datetime.now() + timedelta(days=14)).strftime('%B %d, %Y')
-    
-    # Format the message
-    message = f"""Hi {first_name}! I hope you're doing well. I wanted to thank you for being such a great tenant over the past year—I really appreciate how well you've taken care of the place. Attached is the lease renewal for the upcoming year. The rent will increase by {increase_percentage}% ({format_currency(rent_increase)}), bringing the monthly total to {format_currency(current_rent)}, and you'll see the updated payment schedule included in the lease. Please review and sign within the next two weeks, by {sign_by_date}, and let me know if you have any questions or concerns. Thanks again!"""
-    
-    return message
+# Long-running renders submitted to /jobs; workers here share the render pool with requests
+job_queue = JobQueue()
 
 
-def create_payment_schedule(start_date: date, end_date: date, monthly_rent: float, rent_increases: List[dict], custom_entries: List[PaymentEntry], security_deposit_increase: float = 0.0, lease_start_comment: str = "", previous_rent: float = 0.0) -> List[PaymentEntry]:
-    """Generate a complete payment schedule with auto-generated monthly payments and custom entries"""
-    if custom_entries is None:
-        custom_entries = []
-        
-    schedule = []
-    entry_number = 1
-    
-    # Add custom entries first (they take priority)
-    custom_by_date = {}
-    for entry in custom_entries:
-        if isinstance(entry.due_date, date):
-            custom_by_date[entry.due_date] = entry
-        # Non-date entries (like "Lease signing") are added separately
-        else:
-            entry.entry_number = entry_number if not entry.entry_number else entry.entry_number
-            schedule.append(entry)
-            entry_number += 1
-    
-    # Create rent increase lookup
-    rent_by_date = {monthly_rent: start_date}  # Start with initial rent
-    for increase in rent_increases:
-        increase_date = date.fromisoformat(increase['date']) if isinstance(increase['date'], str) else increase['date']
-        rent_by_date[increase['new_rent']] = increase_date
-    
-    # Sort rent increases by date
-    sorted_increases = sorted([(d, r) for r, d in rent_by_date.items()])
-    
-    # Add previous month rent entry if there's a rent increase (previous_rent > 0)
-    if previous_rent > 0 and previous_rent != monthly_rent:
-        # Calculate the previous month date (month before lease start)
-        if start_date.month == 1:
-            prev_month_date = date(start_date.year - 1, 12, 1)
-        else:
-            prev_month_date = date(start_date.year, start_date.month - 1, 1)
-        
-        # Add entry for previous month at old rate
-        prev_month_entry = PaymentEntry(
-            due_date=prev_month_date,
-            rent_amount=previous_rent,
-            security_deposit=0.0,
-            pet_deposit=0.0,
-            other_fees=0.0,
-            total=previous_rent,
-            comment="Last month at current rate",
-            is_manual=False,
-            entry_number=entry_number
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Have every template compiled (from the shared bytecode cache when warm) before the first request
+    for name, error in precompile_templates().items():
+        logger.error("Template %s failed to compile: %s", name, error)
+    await asyncio.to_thread(prerender_pages)
+    # Start render workers without holding up the first request unless configured otherwise
+    warm_up = None
+    if RENDER_PREWARM == "startup":
+        await render_pool.start()
+    elif RENDER_PREWARM == "background":
+        warm_up = asyncio.create_task(render_pool.start())
+    job_workers = [asyncio.create_task(run_worker(job_queue, render_pool)) for _ in range(JOB_WORKERS)]
+    yield
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+    # Cancelled workers hand their jobs back to the queue
+    for worker in job_workers:
+        worker.cancel()
+    await asyncio.gather(*job_workers, return_exceptions=True)
+    render_pool.shutdown()
+
+
+app = FastAPI(title="Lease Generator", description="Generate residential lease agreements", lifespan=lifespan)
+# Server-Timing headers and latency histograms for /metrics
+app.add_middleware(TimingMiddleware)
+# Only installed when LEASE_PROFILE_TOKEN or LEASE_PROFILE_SAMPLE_RATE is set
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+
+# Setup templates (the Jinja2 environment with the currency filter lives in documents.py)
+templates = Jinja2Templates(env=template_env)
+
+
+def pdf_file_response(rendered: RenderedFile, filename: str) -> FileResponse:
+    """Stream a rendered PDF from disk - supports Content-Length and Range requests"""
+    return FileResponse(
+        rendered.path,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}"
+        },
+        background=BackgroundTask(os.unlink, rendered.path) if rendered.temporary else None
+    )
+
+
+def release_after(slot, chunks: AsyncIterator[bytes]) -> tuple:
+    """Wrap a response body so an entered admission slot is left once the response is over.
+
+    Returns the body and a background task for the response; whichever runs
+    first leaves the slot. The body's own cleanup doesn't run when the client
+    is gone before it is first read, the background task doesn't run when
+    streaming fails.
+    """
+    released = False
+
+    async def release():
+        nonlocal released
+        if not released:
+            released = True
+            await slot.__aexit__(None, None, None)
+
+    async def body():
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await release()
+
+    return body(), BackgroundTask(release)
+
+
+def stored_pdf_file(lease_id: str, artifact_hash: str) -> Optional[RenderedFile]:
+    """A saved lease's stored PDF artifact, copied to a temporary file to stream from"""
+    fd, tmp_name = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    path = Path(tmp_name)
+    try:
+        if lease_store.copy_artifact(lease_id, "pdf", artifact_hash, path):
+            return RenderedFile(path, True)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    path.unlink()
+    return None
+
+
+def document_etag(key: str, kind: str) -> str:
+    return f'"{key}-{kind}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match lists this ETag (weak comparison, as RFC 9110 requires for it)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+async def document_validators(request: Request, lease: LeaseAgreement, kind: str) -> dict:
+    """ETag and canonical Content-Location for a lease rendered as html, pdf or renewal_message.
+
+    The inputs are remembered under the document key so the canonical URL can
+    render the document again later, until it goes unused for LEASE_DOCUMENT_TTL_SECONDS.
+    """
+    timings = request_timings(request)
+    with timings.stage("etag"):
+        fingerprint = templates_fingerprint()
+        key = document_key(lease, fingerprint)
+    if kind == "renewal_message":
+        # The message's sign-by date moves with the calendar, so it has no canonical URL
+        return {"ETag": document_etag(key, f"renewal_message-{date.today().isoformat()}"), "Cache-Control": "no-cache"}
+    with timings.stage("store"):
+        if not await asyncio.to_thread(lease_store.touch_document, key):
+            await asyncio.to_thread(lease_store.put_document, key, lease_configuration(lease), lease.agreement_date, fingerprint)
+    return {
+        "ETag": document_etag(key, kind),
+        "Cache-Control": "no-cache",
+        "Content-Location": str(app.url_path_for("canonical_document", key=key, kind=kind))
+    }
+
+
+def home_page() -> CompressedPage:
+    """The blank form with the most recent saved leases"""
+    configurations = lease_store.search(limit=SAVED_LEASES_SHOWN)
+    return page_cache.get("home", (templates_fingerprint(), tuple(configurations)),
+                          lambda: template_env.get_template("form.html").render(configurations=configurations))
+
+
+def example_page() -> CompressedPage:
+    """The form filled in from example_template.json"""
+    stat = EXAMPLE_TEMPLATE_PATH.stat()
+
+    def render() -> str:
+        with open(EXAMPLE_TEMPLATE_PATH, 'r') as f:
+            config_data = json.load(f)
+        # Keep dates as strings for form rendering - they'll be converted to date objects when the form is submitted
+        return template_env.get_template("form.html").render(
+            config_data=config_data,
+            upload_success="Example template loaded successfully! You can now customize the form data."
         )
-        schedule.append(prev_month_entry)
-        entry_number += 1
-    
-    # Generate monthly payments - start with first of the month
-    current_date = date(start_date.year, start_date.month, 1)
-    current_rent = monthly_rent
-    
-    while current_date <= end_date:
-        # Check if there's a rent increase for this month
-        for increase_date, rent_amount in sorted_increases:
-            if current_date >= increase_date and rent_amount != current_rent:
-                current_rent = rent_amount
-                break
-        
-        # Skip if there's already a custom entry for this date
-        if current_date not in custom_by_date:
-            # Check if this is a rent increase month
-            is_rent_increase = any(
-                current_date.year == date.fromisoformat(inc['date']).year and 
-                current_date.month == date.fromisoformat(inc['date']).month 
-                for inc in rent_increases
-            )
-            
-            # Check if this is the lease start date (first payment)
-            is_lease_start = current_date.year == start_date.year and current_date.month == start_date.month
-            
-            comment = ""
-            additional_deposit = 0.0
-            
-            if is_lease_start:
-                if security_deposit_increase > 0:
-                    # Apply the calculated security deposit increase for lease start
-                    additional_deposit = security_deposit_increase
-                    if lease_start_comment:
-                        comment = lease_start_comment
-                    else:
-                        # Generate default comment with actual dollar amount
-                        comment = f"New lease first month rent plus ${int(security_deposit_increase):,} security deposit increase."
-                else:
-                    # No security deposit increase, just first month
-                    if lease_start_comment:
-                        comment = lease_start_comment
-                    else:
-                        comment = "First month rent"
-            elif is_rent_increase:
-                matching_increase = next(inc for inc in rent_increases if 
-                    current_date.year == date.fromisoformat(inc['date']).year and 
-                    current_date.month == date.fromisoformat(inc['date']).month)
-                comment = matching_increase.get('comment', '')
-                # Add security deposit difference if rent increased
-                if current_rent > monthly_rent:
-                    additional_deposit = current_rent - monthly_rent
-            
-            entry = PaymentEntry(
-                due_date=current_date,
-                rent_amount=current_rent,
-                security_deposit=additional_deposit,
-                pet_deposit=0.0,
-                other_fees=0.0,
-                total=current_rent + additional_deposit,
-                comment=comment,
-                is_manual=False,
-                entry_number=entry_number
-            )
-            schedule.append(entry)
-            entry_number += 1
-        else:
-            # Add the custom entry
-            custom_entry = custom_by_date[current_date]
-            custom_entry.entry_number = entry_number if not custom_entry.entry_number else custom_entry.entry_number
-            schedule.append(custom_entry)
-            entry_number += 1
-        
-        # Move to next month
-        if current_date.month == 12:
-            current_date = date(current_date.year + 1, 1, 1)
-        else:
-            current_date = date(current_date.year, current_date.month + 1, 1)
-    
-    return sorted(schedule, key=lambda x: (isinstance(x.due_date, str), x.due_date if isinstance(x.due_date, date) else date.min))
+
+    return page_cache.get("example", (templates_fingerprint(), stat.st_mtime_ns, stat.st_size), render)
+
+
+def prerender_pages():
+    """Build the form pages ahead of the first request"""
+    home_page()
+    try:
+        example_page()
+    except (OSError, ValueError) as e:
+        logger.warning("Example template could not be pre-rendered: %s", e)
+
+
+def page_response(request: Request, page: CompressedPage, cache_control: str = "no-cache") -> Response:
+    """Serve a pre-compressed page in the best encoding the client accepts"""
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""), page.variants)
+    # By default clients revalidate (a 304 when nothing changed) - saving a lease changes the home page
+    headers = {"ETag": page.variant_etag(encoding), "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=page.variants[encoding], media_type="text/html", headers=headers)
+
 
 # Serve static files
 static_dir = Path(__file__).parent / "static"
@@ -197,13 +242,20 @@ app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    return templates.TemplateResponse("form.html", {
-        "request": request
-    })
+    return page_response(request, await asyncio.to_thread(home_page))
 
 
-@app.post("/generate")
-async def generate_lease(
+class LeaseForm(NamedTuple):
+    """A lease submitted through the form, plus what to do with it"""
+    lease: LeaseAgreement
+    schedule_rows: Optional[List[ScheduleRow]]
+    output_format: str
+    save_config: bool
+    save_lease: bool
+    lease_id: str
+
+
+async def lease_form(
     request: Request,
     # Parties
     landlord_name: str = Form(...),
@@ -267,8 +319,16 @@ async def generate_lease(
     output_format: str = Form("html"),
     
     # Configuration saving
-    save_config: bool = Form(False)
-):
+    save_config: bool = Form(False),
+    save_lease: bool = Form(False),
+    lease_id: str = Form("")
+) -> LeaseForm:
+    """Read the lease form (shared by /generate and /jobs) into a validated lease"""
+    # Everything up to here was FastAPI reading and converting the form
+    timings = request_timings(request)
+    timings.record("parse", time.perf_counter() - timings.started)
+    timings.output_format = output_format
+    
     # Parse arrays from comma-separated strings
     appliances_list = [a.strip() for a in appliances.split(",") if a.strip()] if appliances else []
     utilities_list = [u.strip() for u in utilities_included.split(",") if u.strip()] if utilities_included else []
@@ -319,37 +379,16 @@ async def generate_lease(
             except json.JSONDecodeError:
                 custom_entries_list = []
         
-        # Generate the complete schedule if auto_generate is enabled
-        final_entries = custom_entries_list
-        if auto_generate_schedule:
-            start_date_obj = date.fromisoformat(start_date)
-            end_date_obj = date.fromisoformat(end_date)
-            
-            # Calculate security deposit increase from existing logic
-            security_increase = 0.0
-            if use_custom_security_deposit and previous_rent > 0:
-                security_increase = monthly_rent - previous_rent
-            
-            final_entries = create_payment_schedule(
-                start_date_obj, 
-                end_date_obj, 
-                monthly_rent, 
-                rent_increases_list, 
-                custom_entries_list,
-                security_increase,
-                lease_start_comment,
-                previous_rent
-            )
-        
         payment_schedule = PaymentSchedule(
             include_in_lease=include_payment_schedule,
             auto_generate=auto_generate_schedule,
-            custom_entries=final_entries,
+            custom_entries=custom_entries_list,  # Generated rows are passed to the template separately
             rent_increases=rent_increases_list,
             lease_start_comment=lease_start_comment if lease_start_comment else None
         )
     
     # Create lease agreement object
+    validate_started = time.perf_counter()
     lease = LeaseAgreement(
         parties=LeaseParties(
             landlord_name=landlord_name,
@@ -400,148 +439,296 @@ async def generate_lease(
         agreement_date=date.fromisoformat(agreement_date),
         lead_paint_disclosure=lead_paint_disclosure
     )
-    
-    # Handle configuration download if requested
-    if save_config:
-        # Create a clean payment schedule for configuration (preserve original settings)
-        config_payment_schedule = None
-        if include_payment_schedule or rent_increases or custom_payments:
-            # Only save the original manual entries, not auto-generated ones
-            config_custom_entries = []
-            if custom_payments.strip():
-                try:
-                    custom_entries_data = json.loads(custom_payments)
-                    for entry_data in custom_entries_data:
-                        # Parse due_date - handle both date strings and text like "Lease signing"
-                        due_date_str = entry_data.get('due_date', '')
-                        if due_date_str:
-                            try:
-                                # Try to parse as date
-                                parsed_date = date.fromisoformat(due_date_str)
-                            except:
-                                # If not a date, use as string (like "Lease signing")
-                                parsed_date = due_date_str
-                        else:
-                            parsed_date = due_date_str
-                        
-                        entry = PaymentEntry(
-                            due_date=parsed_date,
-                            rent_amount=entry_data.get('rent_amount', 0.0),
-                            security_deposit=entry_data.get('security_deposit', 0.0),
-                            pet_deposit=entry_data.get('pet_deposit', 0.0),
-                            other_fees=entry_data.get('other_fees', 0.0),
-                            total=entry_data.get('total', 0.0),
-                            comment=entry_data.get('comment'),
-                            is_manual=True
-                        )
-                        config_custom_entries.append(entry)
-                except json.JSONDecodeError:
-                    config_custom_entries = []
+    timings.record("validate", time.perf_counter() - validate_started)
+    
+    # Generate the complete schedule if auto_generate is enabled. The rows come from the
+    # lease itself, exactly as for a saved configuration, so a document key (a hash of the
+    # lease) always stands for the same document
+    schedule_rows = None
+    if payment_schedule is not None and auto_generate_schedule:
+        with timings.stage("schedule"):
+            schedule_rows = configuration_schedule_rows(lease)
+    return LeaseForm(lease, schedule_rows, output_format, save_config, save_lease, lease_id)
+
+
+@app.post("/generate")
+async def generate_lease(request: Request, form: LeaseForm = Depends(lease_form)):
+    lease, schedule_rows, output_format, save_config, save_lease, lease_id = form
+    tenant_name = lease.parties.tenant_name
+    start_date = lease.lease_terms.start_date.isoformat()
+    timings = request_timings(request)
+    
+    # Handle configuration download or lease store save if requested
+    if save_config or save_lease:
+        with timings.stage("validate"):
+            config = lease_configuration(lease)
+        
+        if save_config:
+            # Return configuration as downloadable JSON instead of generating lease
+            config_json = json.dumps(config.model_dump(mode='json'), indent=2)
+            
+            # Auto-generate filename: lease_configuration_tenant_name_lease_start_date
+            filename = document_filename("lease_configuration", tenant_name, start_date, "json")
             
-            config_payment_schedule = PaymentSchedule(
-                include_in_lease=include_payment_schedule,
-                auto_generate=auto_generate_schedule,
-                custom_entries=config_custom_entries,  # Only manual entries
-                rent_increases=rent_increases_list,
-                lease_start_comment=lease_start_comment if lease_start_comment else None
+            return Response(
+                content=config_json,
+                media_type="application/json",
+                headers={
+                    "Content-Disposition": f"attachment; filename={filename}"
+                }
             )
+    
+    if save_lease:
+        # Store the lease; the documents generated below are kept as its artifacts
+        with timings.stage("store"):
+            lease_id = await asyncio.to_thread(lease_store.save, config, lease.agreement_date, lease_id or None)
+        if lease_id is None:
+            raise HTTPException(status_code=404, detail="Lease not found")
+        artifact_hash = input_hash(config.model_dump_json().encode("utf-8"), lease.agreement_date, templates_fingerprint())
+    
+    # Tell the client where a stored lease can be loaded from again
+    lease_headers = {"X-Lease-Id": lease_id} if save_lease else {}
+    profile = request_profile(request)
+    if profile is not None:
+        profile.tag(tenant=tenant_name, lease_id=lease_id, output_format=output_format)
+    
+    # A client that already has this exact document gets a 304 before taking a render slot;
+    # any format other than pdf or renewal_message is previewed, so it is the html document
+    document_kind = output_format if output_format in ("pdf", "renewal_message") else "html"
+    validators = await document_validators(request, lease, document_kind)
+    lease_headers.update(validators)
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code=304, headers=lease_headers)
+    
+    # Under load, PDFs wait behind previews for a render slot or are turned away with a Retry-After
+    async with render_admission.slot(admission_client(request), "pdf" if output_format == "pdf" else "preview"):
+        # Generate HTML - serialize with mode='json' and format dates
+        with timings.stage("template"):
+            lease_data = lease_template_context(lease, schedule_rows)
+            html_content = render_lease_document(lease_data)
+        if save_lease:
+            with timings.stage("store"):
+                await asyncio.to_thread(lease_store.put_artifact, lease_id, "html", artifact_hash, html_content.encode("utf-8"))
         
-        # Create additional terms with clean payment schedule
-        config_additional_terms = AdditionalTerms(
-            early_termination_notice=lease.additional_terms.early_termination_notice,
-            landlord_contact_phone=lease.additional_terms.landlord_contact_phone,
-            landlord_contact_email=lease.additional_terms.landlord_contact_email,
-            special_conditions=lease.additional_terms.special_conditions,
-            payment_schedule=config_payment_schedule
-        )
-        
-        config = LeaseConfiguration(
-            parties=lease.parties,
-            property_details=lease.property_details,
-            lease_terms=lease.lease_terms,
-            property_features=lease.property_features,
-            additional_terms=config_additional_terms,
-            governing_law_state=lease.governing_law_state,
-            lead_paint_disclosure=lease.lead_paint_disclosure,
-            created_at=datetime.now(),
-            updated_at=datetime.now()
-        )
-        
-        # Return configuration as downloadable JSON instead of generating lease
-        config_json = json.dumps(config.model_dump(mode='json'), indent=2)
-        
-        # Auto-generate filename: lease_configuration_tenant_name_lease_start_date
-        tenant_name_clean = tenant_name.replace(' ', '_').replace('/', '_').lower()
-        start_date_clean = start_date.replace('-', '_')
-        filename = f"lease_configuration_{tenant_name_clean}_{start_date_clean}.json"
-        
+        if output_format == "pdf":
+            # Generate PDF
+            with timings.stage("pdf"):
+                rendered = await render_pool.render_file(html_content, profile)
+            if save_lease:
+                with timings.stage("store"):
+                    await asyncio.to_thread(lease_store.put_artifact_file, lease_id, "pdf", artifact_hash, rendered.path)
+            response = pdf_file_response(rendered, document_filename('lease_agreement', tenant_name, start_date, 'pdf'))
+            response.headers.update(lease_headers)
+            return response
+        elif output_format == "renewal_message":
+            # Generate renewal message text file
+            # Only generate if there's a previous rent (indicating a renewal)
+            previous_rent = renewal_previous_rent(lease.lease_terms)
+            if previous_rent > 0:
+                message_text = generate_renewal_message(tenant_name, previous_rent, lease.lease_terms.monthly_rent)
+                
+                # Generate filename
+                filename = document_filename("renewal_message", tenant_name, start_date, "txt")
+                
+                return Response(
+                    content=message_text,
+                    media_type="text/plain",
+                    headers={
+                        "Content-Disposition": f"attachment; filename={filename}",
+                        **lease_headers
+                    }
+                )
+            else:
+                # Return error message if no previous rent specified
+                return HTMLResponse(
+                    content="<h1>Error</h1><p>Renewal message can only be generated when previous rent is specified (for rent increase calculation). Please enable 'Customize security deposit' and enter the previous rent amount.</p>", 
+                    status_code=400
+                )
+        else:
+            # Return HTML preview
+            return HTMLResponse(content=html_content, headers=lease_headers)
+
+
+@app.post("/api/leases/render")
+async def render_lease_api(
+    request: Request,
+    output_format: LeaseOutputFormat = "html",
+    agreement_date: Optional[date] = None
+):
+    """Render a lease from a LeaseConfiguration JSON body - the same JSON the form saves.
+
+    The body is validated straight from bytes in one pass, skipping form decoding
+    and per-field model construction. The agreement date defaults to today.
+    """
+    timings = request_timings(request)
+    timings.output_format = output_format
+    with timings.stage("parse"):
+        body = await request.body()
+    try:
+        with timings.stage("validate"):
+            config = configuration_adapter.validate_json(body)
+    except ValidationError as e:
+        # Same 422 response FastAPI gives for a declared body model
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)])
+    
+    tenant_name = config.parties.tenant_name
+    terms = config.lease_terms
+    start_date = terms.start_date.isoformat()
+    
+    if output_format == "config":
         return Response(
-            content=config_json,
+            content=configuration_adapter.dump_json(config, indent=2),
             media_type="application/json",
             headers={
-                "Content-Disposition": f"attachment; filename={filename}"
+                "Content-Disposition": f"attachment; filename={document_filename('lease_configuration', tenant_name, start_date, 'json')}"
             }
         )
     
-    # Generate HTML - serialize with mode='json' and format dates
-    lease_data = lease.model_dump(mode='json')
-    
-    # Debug: Print special conditions to see what we're working with
-    if 'additional_terms' in lease_data and 'special_conditions' in lease_data['additional_terms']:
-        print("DEBUG: special_conditions type and content:")
-        for i, condition in enumerate(lease_data['additional_terms']['special_conditions']):
-            print(f"  {i}: {type(condition)} - {condition}")
-    
-    # Format dates for template display
-    if 'agreement_date' in lease_data:
-        lease_data['agreement_date'] = lease.agreement_date.strftime('%m/%d/%Y')
-    if 'lease_terms' in lease_data:
-        if 'start_date' in lease_data['lease_terms']:
-            lease_data['lease_terms']['start_date'] = lease.lease_terms.start_date.strftime('%m/%d/%Y')
-        if 'end_date' in lease_data['lease_terms']:
-            lease_data['lease_terms']['end_date'] = lease.lease_terms.end_date.strftime('%m/%d/%Y')
-    
-    html_content = templates.get_template("lease_template.html").render(lease_data)
-    
-    if output_format == "pdf":
-        # Generate PDF
-        pdf = weasyprint.HTML(string=html_content).write_pdf()
+    if output_format == "renewal_message":
+        previous_rent = renewal_previous_rent(terms)
+        if previous_rent <= 0:
+            raise HTTPException(
+                status_code=400,
+                detail="Renewal message needs lease_terms.security_deposit_details with use_custom_section and previous_rent"
+            )
         return Response(
-            content=pdf,
-            media_type="application/pdf",
+            content=generate_renewal_message(tenant_name, previous_rent, terms.monthly_rent),
+            media_type="text/plain",
             headers={
-                "Content-Disposition": f"attachment; filename=lease_agreement_{tenant_name.replace(' ', '_').replace('/', '_').lower()}_{start_date.replace('-', '_')}.pdf"
+                "Content-Disposition": f"attachment; filename={document_filename('renewal_message', tenant_name, start_date, 'txt')}"
             }
         )
-    elif output_format == "renewal_message":
-        # Generate renewal message text file
-        # Only generate if there's a previous rent (indicating a renewal)
-        if use_custom_security_deposit and previous_rent > 0:
-            message_text = generate_renewal_message(tenant_name, previous_rent, monthly_rent)
-            
-            # Generate filename
-            tenant_name_clean = tenant_name.replace(' ', '_').replace('/', '_').lower()
-            start_date_clean = start_date.replace('-', '_')
-            filename = f"renewal_message_{tenant_name_clean}_{start_date_clean}.txt"
-            
-            return Response(
-                content=message_text,
-                media_type="text/plain",
-                headers={
-                    "Content-Disposition": f"attachment; filename={filename}"
-                }
-            )
-        else:
-            # Return error message if no previous rent specified
-            return HTMLResponse(
-                content="<h1>Error</h1><p>Renewal message can only be generated when previous rent is specified (for rent increase calculation). Please enable 'Customize security deposit' and enter the previous rent amount.</p>", 
-                status_code=400
-            )
-    else:
-        # Return HTML preview
-        return HTMLResponse(content=html_content)
+    
+    with timings.stage("schedule"):
+        lease, schedule_rows = prepare_lease(config, agreement_date)
+    profile = request_profile(request)
+    if profile is not None:
+        profile.tag(tenant=tenant_name, output_format=output_format)
+    validators = await document_validators(request, lease, output_format)
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code=304, headers=validators)
+    async with render_admission.slot(admission_client(request), "pdf" if output_format == "pdf" else "preview"):
+        with timings.stage("template"):
+            html_content = render_lease_document(lease_template_context(lease, schedule_rows))
+        if output_format == "html":
+            return HTMLResponse(content=html_content, headers=validators)
+        
+        with timings.stage("pdf"):
+            rendered = await render_pool.render_file(html_content, profile)
+    response = pdf_file_response(rendered, document_filename("lease_agreement", tenant_name, start_date, "pdf"))
+    response.headers.update(validators)
+    return response
+
+
+@app.post("/generate/bulk")
+async def generate_bulk(request: Request, configurations: UploadFile = File(...)):
+    """Render many saved configurations (JSONL or a ZIP of lease_configuration_*.json files) into a ZIP of PDFs"""
+    items = await asyncio.to_thread(iter_configurations, configurations.file)
+    # The whole archive holds one PDF slot, taken before the response starts so a
+    # rejection is still a 429/503, and given back when the stream ends or is dropped
+    slot = render_admission.slot(admission_client(request), "pdf")
+    await slot.__aenter__()
+    # Keep every render worker busy with one lease queued behind it
+    body, release = release_after(slot, stream_lease_pdfs(items, render_pool.render, concurrency=render_pool.workers * 2))
+    return StreamingResponse(
+        body,
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": "attachment; filename=lease_agreements.zip"
+        },
+        background=release
+    )
+
+
+def job_response(job_id: str) -> JSONResponse:
+    """202 Accepted pointing at the job's status URL"""
+    status_url = app.url_path_for("job_status", job_id=job_id)
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued", "status_url": status_url},
+        headers={"Location": status_url}
+    )
+
+
+@app.post("/jobs")
+async def submit_lease_job(request: Request, form: LeaseForm = Depends(lease_form)):
+    """Queue a lease render with the same form fields as /generate; poll the returned status URL for the result"""
+    lease, _, output_format, save_config, save_lease, lease_id = form
+    if save_config:
+        output_format = "config"
+    if output_format not in LEASE_OUTPUT_FORMATS:
+        # /generate previews anything it doesn't know; a queued job has to say what it produces
+        raise HTTPException(status_code=422, detail=f"output_format must be one of: {', '.join(LEASE_OUTPUT_FORMATS)}")
+    if output_format == "renewal_message" and renewal_previous_rent(lease.lease_terms) <= 0:
+        raise HTTPException(status_code=400, detail="Renewal message can only be generated when previous rent is specified")
+    config = lease_configuration(lease)
+    if save_lease:
+        lease_id = await asyncio.to_thread(lease_store.save, config, lease.agreement_date, lease_id or None)
+        if lease_id is None:
+            raise HTTPException(status_code=404, detail="Lease not found")
+    job_id = await asyncio.to_thread(job_queue.submit, "lease", {
+        "configuration": config.model_dump_json(),
+        "agreement_date": lease.agreement_date.isoformat(),
+        "output_format": output_format,
+    })
+    response = job_response(job_id)
+    if save_lease:
+        response.headers["X-Lease-Id"] = lease_id
+    return response
+
+
+@app.post("/jobs/bulk")
+async def submit_bulk_job(configurations: UploadFile = File(...)):
+    """Queue a /generate/bulk render; the finished ZIP is kept on disk until the job expires"""
+    job_id = await asyncio.to_thread(job_queue.submit, "bulk", {"filename": configurations.filename}, configurations.file)
+    return job_response(job_id)
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Progress of a queued job, with a result URL once it is done"""
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    status = job.summary()
+    if job.status == "done":
+        status["result_url"] = app.url_path_for("job_result", job_id=job_id)
+    return status
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """The finished job's document"""
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}" + (f": {job.error}" if job.error else ""))
+    return FileResponse(
+        job_queue.result_path(job_id),
+        media_type=job.media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename={job.filename}"
+        }
+    )
 
 
+@app.post("/portfolio/rollup")
+async def portfolio_rollup(
+    configurations: UploadFile = File(...),
+    output_format: Literal["json", "csv"] = "json"
+):
+    """Expected rent and deposits per month across many saved configurations (JSONL or a ZIP of lease_configuration_*.json files)"""
+    result = await asyncio.to_thread(rollup, iter_configurations(configurations.file))
+    if output_format == "csv":
+        return StreamingResponse(
+            result.csv_lines(),
+            media_type="text/csv",
+            headers={
+                "Content-Disposition": "attachment; filename=portfolio_rollup.csv"
+            }
+        )
+    return result.to_json()
 
 
 @app.post("/templates/upload")
@@ -558,14 +745,14 @@ async def upload_template(request: Request, template_file: UploadFile = File(...
         # Convert to the format expected by the form
         config_data = template.model_dump(mode='json')
         
-        return templates.TemplateResponse("form.html", {
+        return templates.TemplateResponse(request, "form.html", {
             "request": request,
             "config_data": config_data,
             "upload_success": "Template loaded successfully!"
         })
         
     except Exception as e:
-        return templates.TemplateResponse("form.html", {
+        return templates.TemplateResponse(request, "form.html", {
             "request": request,
             "upload_error": f"Error loading template: {str(e)}"
         })
@@ -574,124 +761,81 @@ async def upload_template(request: Request, template_file: UploadFile = File(...
 @app.post("/generate-payment-schedule")
 async def generate_payment_schedule(
     request: Request,
-    lease_data: dict
+    lease_data: dict,
+    output_format: Literal["pdf", "html", "csv", "jsonl"] = "pdf"
 ):
-    """Generate and export payment schedule as separate document"""
+    """Generate and export payment schedule as separate document.
+
+    PDF goes through the payment_schedule.html template; HTML, CSV and JSONL
+    are streamed row by row without PDF layout, so long schedules export in
+    time linear in the number of rows.
+    """
+    # Extract payment schedule data
+    payment_schedule = (lease_data.get("additional_terms") or {}).get("payment_schedule")
+    if not payment_schedule:
+        return HTMLResponse("No payment schedule data found", status_code=400)
+    entries = payment_schedule.get("custom_entries") or []
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        return HTMLResponse("custom_entries must be a list of payment entries", status_code=400)
+    # Validated up front: once a streamed export has started its 200 can't become an error
     try:
-        # Extract payment schedule data
-        payment_schedule = lease_data.get("additional_terms", {}).get("payment_schedule")
-        if not payment_schedule:
-            return HTMLResponse("No payment schedule data found", status_code=400)
-        
-        # Render payment schedule template
-        schedule_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Payment Schedule</title>
-            <style>
-                body {{ font-family: Times, serif; margin: 40px; }}
-                h1 {{ text-align: center; margin-bottom: 30px; }}
-                .payment-table {{ width: 100%; border-collapse: collapse; margin-top: 20px; }}
-                .payment-table th, .payment-table td {{ border: 1px solid black; padding: 8px; text-align: left; }}
-                .payment-table th {{ background-color: #f0f0f0; }}
-            </style>
-        </head>
-        <body>
-            <h1>PAYMENT SCHEDULE</h1>
-            <p><strong>Tenant:</strong> {lease_data.get('parties', {}).get('tenant_name', '')}</p>
-            <p><strong>Property:</strong> {lease_data.get('property_details', {}).get('mailing_address', '')}</p>
-            <p><strong>Lease Term:</strong> {lease_data.get('lease_terms', {}).get('start_date', '')} to {lease_data.get('lease_terms', {}).get('end_date', '')}</p>
-        """
-        
-        if payment_schedule.get("custom_entries"):
-            schedule_html += """
-            <table class="payment-table">
-                <thead>
-                    <tr>
-                        <th>#</th>
-                        <th>Due Date</th>
-                        <th>Rent</th>
-                        <th>Security & Pet Deposit</th>
-                        <th>Total</th>
-                        <th>Comment</th>
-                    </tr>
-                </thead>
-                <tbody>
-            """
-            
-            for i, entry in enumerate(payment_schedule["custom_entries"], 1):
-                due_date = entry.get("due_date", "")
-                if isinstance(due_date, str):
-                    due_date_str = due_date
-                else:
-                    due_date_str = due_date.strftime('%m/%d/%Y') if due_date else ''
-                
-                schedule_html += f"""
-                    <tr>
-                        <td>{entry.get('entry_number', '')}</td>
-                        <td>{due_date_str}</td>
-                        <td>{format_currency(entry.get('rent_amount', 0))}</td>
-                        <td>{format_currency(entry.get('security_deposit', 0) + entry.get('pet_deposit', 0))}</td>
-                        <td>{format_currency(entry.get('total', 0))}</td>
-                        <td>{entry.get('comment', '')}</td>
-                    </tr>
-                """
-            
-            schedule_html += """
-                </tbody>
-            </table>
-            """
-        
-        schedule_html += """
-        </body>
-        </html>
-        """
-        
-        # Generate PDF
-        pdf = weasyprint.HTML(string=schedule_html).write_pdf()
-        return Response(
-            content=pdf,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename=payment_schedule_{lease_data.get('parties', {}).get('tenant_name', 'tenant').replace(' ', '_').replace('/', '_').lower()}_{lease_data.get('lease_terms', {}).get('start_date', '').replace('/', '_')}.pdf"
-            }
-        )
+        entries = [PaymentEntry.model_validate(entry).model_dump(mode="json") for entry in entries]
+    except ValidationError as e:
+        return HTMLResponse(f"Invalid payment schedule entry: {e}", status_code=400)
+    
+    tenant_name = (lease_data.get("parties") or {}).get("tenant_name") or "tenant"
+    start_date = str((lease_data.get("lease_terms") or {}).get("start_date", ""))
+    filename = f"payment_schedule_{tenant_name.replace(' ', '_').replace('/', '_').lower()}_{start_date.replace('/', '_')}"
+    timings = request_timings(request)
+    timings.output_format = output_format
+    profile = request_profile(request)
+    if profile is not None:
+        profile.tag(tenant=tenant_name, output_format=output_format)
+    
+    if output_format == "csv":
+        return StreamingResponse(payment_schedule_csv(entries), media_type="text/csv",
+                                 headers={"Content-Disposition": f"attachment; filename={filename}.csv"})
+    if output_format == "jsonl":
+        return StreamingResponse(payment_schedule_jsonl(entries), media_type="application/x-ndjson",
+                                 headers={"Content-Disposition": f"attachment; filename={filename}.jsonl"})
+    if output_format == "html":
+        return StreamingResponse(payment_schedule_document(lease_data, entries), media_type="text/html")
+    
+    try:
+        async with render_admission.slot(admission_client(request), "pdf"):
+            with timings.stage("template"):
+                schedule_html = "".join(payment_schedule_document(lease_data, entries))
+            # Generate PDF
+            with timings.stage("pdf"):
+                rendered = await render_pool.render_file(schedule_html, profile)
+        return pdf_file_response(rendered, f"{filename}.pdf")
         
+    except HTTPException:
+        raise
     except Exception as e:
         return HTMLResponse(f"Error generating payment schedule: {str(e)}", status_code=500)
 
 
-
-
+@app.get("/templates/example")
+async def example_template(request: Request):
+    """The form filled in with the example template - cacheable, unlike the POST below"""
+    return await load_example_template(request)
 
 
 @app.post("/templates/load-example")
 async def load_example_template(request: Request):
     """Load the example template"""
-    import json
-    import os
-    
-    # Path to the example template (go up from src/lease_generator/ to project root)
-    example_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "example_template.json")
-    
     try:
-        with open(example_path, 'r') as f:
-            config_data = json.load(f)
-        
-        # Keep dates as strings for form rendering - they'll be converted to date objects when the form is submitted
-        return templates.TemplateResponse("form.html", {
-            "request": request, 
-            "config_data": config_data,
-            "upload_success": "Example template loaded successfully! You can now customize the form data."
-        })
+        # Only GET responses are reused or revalidated by browsers and shared caches
+        cache_control = EXAMPLE_PAGE_CACHE_CONTROL if request.method == "GET" else "no-cache"
+        return page_response(request, await asyncio.to_thread(example_page), cache_control)
     except FileNotFoundError:
-        return templates.TemplateResponse("form.html", {
+        return templates.TemplateResponse(request, "form.html", {
             "request": request,
             "error_message": "Example template file not found. Please ensure example_template.json exists in the project root."
         })
     except Exception as e:
-        return templates.TemplateResponse("form.html", {
+        return templates.TemplateResponse(request, "form.html", {
             "request": request,
             "error_message": f"Error loading example template: {str(e)}"
         })
@@ -699,9 +843,151 @@ async def load_example_template(request: Request):
 
 @app.get("/edit/{lease_id}")
 async def edit_lease(request: Request, lease_id: str):
-    # For now, return the form with placeholder data
-    # In a real application, you would load the lease data from storage
-    return templates.TemplateResponse("edit_form.html", {"request": request, "lease_id": lease_id})
+    """Load a stored lease into the form"""
+    stored = await asyncio.to_thread(lease_store.get, lease_id)
+    if stored is None:
+        return templates.TemplateResponse(request, "form.html", {
+            "request": request,
+            "error_message": f"Lease {lease_id} not found."
+        }, status_code=404)
+    
+    # Stored configurations were validated when saved, so they go to the form as-is
+    config_data = stored.config_data()
+    return templates.TemplateResponse(request, "form.html", {
+        "request": request,
+        "config_data": config_data,
+        "lease_id": lease_id,
+        "agreement_date": stored.agreement_date.isoformat(),
+        "upload_success": f"Loaded the lease for {config_data['parties']['tenant_name']} (last saved {stored.updated_at:%m/%d/%Y})."
+    })
+
+
+@app.get("/leases")
+async def list_leases(tenant: str = "", address: str = "", active_on: Optional[date] = None, limit: int = 100):
+    """Find stored leases by tenant name or address prefix and/or a date the lease covers"""
+    leases = await asyncio.to_thread(lease_store.search, tenant, address, active_on, min(max(limit, 1), 1000))
+    return [lease._asdict() for lease in leases]
+
+
+@app.get("/leases/{lease_id}/{kind}")
+async def stored_lease_document(request: Request, lease_id: str, kind: Literal["html", "pdf"]):
+    """Serve a stored lease as HTML or PDF, reusing stored artifacts whenever their inputs are unchanged"""
+    timings = request_timings(request)
+    timings.output_format = kind
+    with timings.stage("store"):
+        stored = await asyncio.to_thread(lease_store.get, lease_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Lease not found")
+    
+    artifact_hash = input_hash(stored.configuration.encode("utf-8"), stored.agreement_date, templates_fingerprint())
+    # The lease can be saved again under the same URL, so clients must revalidate
+    validators = {"ETag": document_etag(artifact_hash[:32], kind), "Cache-Control": "no-cache"}
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code=304, headers=validators)
+    config_data = stored.config_data()
+    filename = document_filename("lease_agreement", config_data["parties"]["tenant_name"], config_data["lease_terms"]["start_date"], "pdf")
+    if kind == "pdf":
+        # A stored PDF is copied out to a file and streamed, never held in memory
+        with timings.stage("store"):
+            rendered = await asyncio.to_thread(stored_pdf_file, lease_id, artifact_hash)
+        if rendered is not None:
+            response = pdf_file_response(rendered, filename)
+            response.headers.update(validators)
+            return response
+    
+    # A PDF can still skip templating when the HTML artifact is current
+    with timings.stage("store"):
+        html_bytes = await asyncio.to_thread(lease_store.artifact, lease_id, "html", artifact_hash)
+    if html_bytes is None:
+        with timings.stage("validate"):
+            lease, schedule_rows = prepare_lease(stored.config(), stored.agreement_date)
+        with timings.stage("template"):
+            html_bytes = render_lease_html(lease, schedule_rows).encode("utf-8")
+        with timings.stage("store"):
+            await asyncio.to_thread(lease_store.put_artifact, lease_id, "html", artifact_hash, html_bytes)
+    if kind == "html":
+        return HTMLResponse(content=html_bytes, headers=validators)
+    
+    async with render_admission.slot(admission_client(request), "pdf"):
+        with timings.stage("pdf"):
+            rendered = await render_pool.render_file(html_bytes.decode("utf-8"))
+    with timings.stage("store"):
+        await asyncio.to_thread(lease_store.put_artifact_file, lease_id, "pdf", artifact_hash, rendered.path)
+    response = pdf_file_response(rendered, filename)
+    response.headers.update(validators)
+    return response
+
+
+@app.get("/documents/{key}/{kind}")
+async def canonical_document(request: Request, key: str, kind: Literal["html", "pdf"]):
+    """A document generated through /generate or /api/leases/render, at the URL given in its Content-Location.
+
+    The key covers every input of the document, so the URL always serves the
+    same bytes and may be cached indefinitely; once the templates change, it
+    redirects to the key of the updated document.
+    """
+    timings = request_timings(request)
+    timings.output_format = kind
+    with timings.stage("store"):
+        stored = await asyncio.to_thread(lease_store.document, key)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    fingerprint = templates_fingerprint()
+    if stored.fingerprint != fingerprint:
+        with timings.stage("validate"):
+            lease, _ = prepare_lease(stored.config(), stored.agreement_date)
+        validators = await document_validators(request, lease, kind)
+        return RedirectResponse(validators["Content-Location"], status_code=301)
+    
+    validators = {"ETag": document_etag(key, kind), "Cache-Control": DOCUMENT_CACHE_CONTROL}
+    if etag_matches(request, validators["ETag"]):
+        return Response(status_code=304, headers=validators)
+    with timings.stage("validate"):
+        lease, schedule_rows = prepare_lease(stored.config(), stored.agreement_date)
+    with timings.stage("template"):
+        html_content = render_lease_html(lease, schedule_rows)
+    if kind == "html":
+        return HTMLResponse(content=html_content, headers=validators)
+    async with render_admission.slot(admission_client(request), "pdf"):
+        with timings.stage("pdf"):
+            rendered = await render_pool.render_file(html_content)
+    response = pdf_file_response(rendered, document_filename(
+        "lease_agreement", lease.parties.tenant_name, lease.lease_terms.start_date.isoformat(), "pdf"))
+    response.headers.update(validators)
+    return response
+
+
+@app.delete("/leases/{lease_id}")
+async def delete_lease(lease_id: str):
+    """Remove a stored lease and its artifacts"""
+    if not await asyncio.to_thread(lease_store.delete, lease_id):
+        raise HTTPException(status_code=404, detail="Lease not found")
+    return {"deleted": lease_id}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Request/stage latency, PDF sizes, cache hit ratios, in-flight renders, admission and queued jobs in Prometheus text format"""
+    job_counts = await asyncio.to_thread(job_queue.counts)
+    caches = {
+        "pdf": (pdf_cache.hits, pdf_cache.misses),
+        "lease_section": (fragment_stats["hits"], fragment_stats["misses"]),
+    }
+    return PlainTextResponse(exposition([
+        sample_lines("lease_cache_hits_total", "counter", "Cache lookups that found an entry",
+                     [({"cache": name}, hits) for name, (hits, _) in caches.items()]),
+        sample_lines("lease_cache_misses_total", "counter", "Cache lookups that found nothing",
+                     [({"cache": name}, misses) for name, (_, misses) in caches.items()]),
+        sample_lines("lease_cache_hit_ratio", "gauge", "Share of cache lookups that found an entry",
+                     [({"cache": name}, hits / (hits + misses) if hits + misses else 0.0) for name, (hits, misses) in caches.items()]),
+        sample_lines("lease_renders_in_flight", "gauge", "PDF renders submitted to the worker pool and not finished",
+                     [({}, render_pool.in_flight)]),
+        sample_lines("lease_render_workers", "gauge", "Size of the PDF render worker pool", [({}, render_pool.workers)]),
+        sample_lines("lease_jobs", "gauge", "Background jobs in each status",
+                     [({"status": status}, count) for status, count in sorted(job_counts.items())]),
+        *render_admission.metric_lines(),
+    ]), media_type="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Histogram buckets: request/stage latency in seconds and PDF size in bytes
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (10_000, 25_000, 50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """Prometheus-style histogram; observations are a bisect and a few additions"""
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labelvalues, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+
+def sample_lines(name: str, kind: str, documentation: str, samples: Iterable[Tuple[dict, float]]) -> List[str]:
+    """Exposition lines for a counter or gauge whose values are read at scrape time"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {value}")
+    return lines
+
+
+REQUEST_SECONDS = Histogram("lease_request_duration_seconds", "Time from receiving a request to finishing its response",
+                            DURATION_BUCKETS, ("route", "output_format"))
+STAGE_SECONDS = Histogram("lease_stage_duration_seconds", "Time spent in each stage of document generation",
+                          DURATION_BUCKETS, ("stage",))
+PDF_BYTES = Histogram("lease_pdf_size_bytes", "Size of the PDFs served", SIZE_BUCKETS, ("source",))
+
+
+def exposition(extra: Iterable[List[str]] = ()) -> str:
+    """Everything in Prometheus text format, followed by any extra metric blocks"""
+    lines = []
+    for histogram in (REQUEST_SECONDS, STAGE_SECONDS, PDF_BYTES):
+        lines.extend(histogram.expose())
+    for block in extra:
+        lines.extend(block)
+    return "\n".join(lines) + "\n"
+
+
+class Timings:
+    """Stage durations for one request, reported in its Server-Timing header"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.output_format = ""
+
+    def record(self, stage: str, seconds: float):
+        # A stage entered more than once (e.g. two store writes) reports its total
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.stages.items()]
+        if total is not None:
+            entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries)
+
+
+def request_timings(request) -> Timings:
+    """The Timings TimingMiddleware attached to a request (a throwaway one without it)"""
+    timings = request.scope.get("state", {}).get("timings")
+    return timings if timings is not None else Timings()
+
+
+class TimingMiddleware:
+    """Pure ASGI middleware: adds Server-Timing to responses and feeds the latency histograms.
+
+    Handlers record their stages on ``request_timings(request)``; the header
+    is added when the response starts, and the request is observed once its
+    body has been sent, so streamed PDFs count in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = Timings()
+        scope.setdefault("state", {})["timings"] = timings
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                header = timings.server_timing(time.perf_counter() - timings.started)
+                message["headers"] = [*message.get("headers", []), (b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - timings.started, route, timings.output_format)
+            for stage, seconds in timings.stages.items():
+                STAGE_SECONDS.observe(seconds, stage)
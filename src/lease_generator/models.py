@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 from typing import Optional, List, Union
 from datetime import date, datetime
 
@@ -97,4 +97,8 @@ class LeaseAgreement(BaseModel):
     additional_terms: AdditionalTerms
     governing_law_state: str = "Vermont"
     agreement_date: date
-    lead_paint_disclosure: bool = False
\ No newline at end of file
+    lead_paint_disclosure: bool = False
+
+
+# Built once at import; validates raw JSON bytes straight into the models, with no intermediate dict
+configuration_adapter = TypeAdapter(LeaseConfiguration)
@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import threading
+from typing import Callable, Dict, Hashable, NamedTuple, Tuple
+
+
+# Pages are compressed once per change rather than per response, so use the best ratios
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Preferred content-coding when a client accepts several equally
+ENCODING_PREFERENCE = ("br", "gzip", "identity")
+
+
+class CompressedPage(NamedTuple):
+    etag: str  # of the identity body; each encoding gets its own strong ETag from it
+    variants: Dict[str, bytes]  # content-coding -> body
+
+    def variant_etag(self, encoding: str) -> str:
+        return self.etag if encoding == "identity" else f'{self.etag[:-1]}-{encoding}"'
+
+
+def compress_page(html: str) -> CompressedPage:
+    """Encode a page once in every content-coding it will be served in"""
+    body = html.encode("utf-8")
+    variants = {"identity": body, "gzip": gzip.compress(body, GZIP_LEVEL, mtime=0)}
+    try:
+        # Optional (the `compression` extra); gzip alone covers every browser
+        import brotli
+    except ImportError:
+        pass
+    else:
+        variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return CompressedPage(f'"{hashlib.sha256(body).hexdigest()[:32]}"', variants)
+
+
+def negotiate_encoding(accept_encoding: str, available) -> str:
+    """The available content-coding the client ranks highest in Accept-Encoding"""
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+
+    def weight(coding: str) -> float:
+        if coding in weights:
+            return weights[coding]
+        if coding == "identity":
+            # Implicitly acceptable unless refused through "*;q=0", but ranked below anything listed
+            return 0.001 if weights.get("*", 1.0) > 0 else 0.0
+        return weights.get("*", 0.0)
+
+    candidates = [coding for coding in ENCODING_PREFERENCE if coding in available and weight(coding) > 0]
+    if not candidates:
+        return "identity"
+    return max(candidates, key=lambda coding: (weight(coding), -ENCODING_PREFERENCE.index(coding)))
+
+
+class PageCache:
+    """Pre-rendered, pre-compressed pages, rebuilt only when whatever they depend on changes.
+
+    Each page is stored with the key it was built from (e.g. the templates
+    fingerprint and the data shown on it); asking for a page with a different
+    key renders and compresses it again. Rebuilds are serialized so a burst of
+    requests after a change only compresses the page once.
+    """
+
+    def __init__(self):
+        self._pages: Dict[str, Tuple[Hashable, CompressedPage]] = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, name: str, key: Hashable, render: Callable[[], str]) -> CompressedPage:
+        entry = self._pages.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        with self._lock:
+            entry = self._pages.get(name)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+            page = compress_page(render())
+            self._pages[name] = (key, page)
+            self.builds += 1
+            return page
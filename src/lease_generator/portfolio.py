@@ -0,0 +1,172 @@
+"""Roll many lease configurations up into expected monthly cash flow.
+
+Usage: python -m lease_generator.portfolio <path>... [--format json|csv] [--output FILE]
+
+Each path is a directory of lease_configuration_*.json files, a JSONL file
+(one LeaseConfiguration per line) or a ZIP of configuration files.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from array import array
+from datetime import date
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, List, NamedTuple, Tuple
+
+from pydantic import ValidationError
+
+from .bulk import CONFIGURATION_PATTERN, BulkItem, iter_configurations
+from .documents import configuration_schedule_rows, renewal_previous_rent
+from .models import LeaseConfiguration
+
+# NumPy is only needed once a rollup is computed, so the web app starts without it
+if TYPE_CHECKING:
+    import numpy as np
+
+
+# Amounts summed per month, in the order of the totals columns
+ROLLUP_COLUMNS = ("rent_amount", "security_deposit", "pet_deposit", "other_fees", "total")
+
+
+class PortfolioRollup(NamedTuple):
+    first_month: int  # year * 12 + month - 1 of the first row
+    payments: "np.ndarray"  # payments due in each month
+    totals: "np.ndarray"  # one row per month, one column per ROLLUP_COLUMNS entry
+    leases: int
+    errors: List[dict]  # configurations that failed validation: {"source", "error"}
+
+    def month_labels(self) -> List[str]:
+        return [f"{index // 12}-{index % 12 + 1:02d}" for index in range(self.first_month, self.first_month + len(self.payments))]
+
+    def to_json(self) -> dict:
+        totals = self.totals.round(2)
+        return {
+            "leases": self.leases,
+            "errors": self.errors,
+            "months": [
+                {"month": month, "payments": payments, **dict(zip(ROLLUP_COLUMNS, amounts))}
+                for month, payments, amounts in zip(self.month_labels(), self.payments.tolist(), totals.tolist())
+            ],
+            "totals": dict(zip(ROLLUP_COLUMNS, self.totals.sum(axis=0).round(2).tolist())),
+        }
+
+    def csv_lines(self) -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(("month", "payments", *ROLLUP_COLUMNS))
+        writer.writerows([month, payments, *amounts] for month, payments, amounts
+                         in zip(self.month_labels(), self.payments.tolist(), self.totals.round(2).tolist()))
+        yield buffer.getvalue()
+
+
+def lease_deposits(config: LeaseConfiguration) -> Tuple[float, float]:
+    """Security and pet deposit due at the start of a lease, as the lease document states them.
+
+    The security deposit is the custom amount or one month's rent; a renewal
+    with a custom security deposit section only owes what the previous rent
+    didn't already cover.
+    """
+    terms = config.lease_terms
+    security = terms.custom_security_deposit or terms.monthly_rent
+    security -= renewal_previous_rent(terms)
+    return max(security, 0.0), terms.pet_deposit or 0.0
+
+
+def rollup(items: Iterable[BulkItem]) -> PortfolioRollup:
+    """Generate every lease's payment schedule and sum the amounts due per calendar month.
+
+    Schedule rows are collected into flat typed arrays and summed per month with
+    NumPy in one pass per column. Entries without a date (e.g. "Lease signing")
+    count toward the month the lease starts, as do the lease's security and pet
+    deposits unless a manual, undated or start-month schedule entry already
+    carries them - a rent increase's deposit top-up is owed on top. Months without
+    payments between the first and last one are included with zero totals.
+    """
+    import numpy as np
+
+    months, amounts = array("q"), array("d")
+    leases, errors = 0, []
+    for item in items:
+        if item.config is None:
+            errors.append({"source": item.source, "error": item.error})
+            continue
+        leases += 1
+        start = item.config.lease_terms.start_date
+        start_month = start.year * 12 + start.month - 1
+        scheduled_security = scheduled_pet = 0.0
+        for row in configuration_schedule_rows(item.config):
+            due_date = row.due_date
+            months.append(due_date.year * 12 + due_date.month - 1 if isinstance(due_date, date) else start_month)
+            amounts.extend((row.rent_amount, row.security_deposit, row.pet_deposit, row.other_fees, row.total))
+            # Deposits in the lease-start payment or entered by hand stand for the lease's own
+            if row.is_manual or not isinstance(due_date, date) or months[-1] == start_month:
+                scheduled_security += row.security_deposit
+                scheduled_pet += row.pet_deposit
+        # Deposits the schedule doesn't carry are due when the lease starts
+        security, pet = lease_deposits(item.config)
+        security = 0.0 if scheduled_security else security
+        pet = 0.0 if scheduled_pet else pet
+        if security or pet:
+            months.append(start_month)
+            amounts.extend((0.0, security, pet, 0.0, security + pet))
+
+    if not months:
+        return PortfolioRollup(0, np.zeros(0, dtype=np.int64), np.zeros((0, len(ROLLUP_COLUMNS))), leases, errors)
+    month_index = np.frombuffer(months, dtype=np.int64)
+    values = np.frombuffer(amounts, dtype=np.float64).reshape(-1, len(ROLLUP_COLUMNS))
+    first_month = int(month_index.min())
+    offsets = month_index - first_month
+    span = int(offsets.max()) + 1
+    payments = np.bincount(offsets, minlength=span)
+    totals = np.column_stack([np.bincount(offsets, weights=values[:, column], minlength=span)
+                              for column in range(len(ROLLUP_COLUMNS))])
+    return PortfolioRollup(first_month, payments, totals, leases, errors)
+
+
+def iter_paths(paths: Iterable[Path]) -> Iterator[BulkItem]:
+    """Configurations from directories, JSONL files and ZIPs, validated one at a time"""
+    for path in paths:
+        if path.is_dir():
+            for config_path in sorted(path.glob(CONFIGURATION_PATTERN)):
+                try:
+                    yield BulkItem(str(config_path), LeaseConfiguration.model_validate_json(config_path.read_bytes()), None)
+                except ValidationError as e:
+                    yield BulkItem(str(config_path), None, str(e))
+        else:
+            with open(path, "rb") as stream:
+                for item in iter_configurations(stream):
+                    yield item._replace(source=f"{path}: {item.source}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m lease_generator.portfolio",
+                                     description="Sum expected rent and deposits per month across many leases")
+    parser.add_argument("paths", nargs="+", type=Path,
+                        help=f"Directories of {CONFIGURATION_PATTERN} files, JSONL files or ZIPs of configurations")
+    parser.add_argument("--format", choices=("json", "csv"), default="json", help="Output format (default: json)")
+    parser.add_argument("--output", type=Path, help="Write the rollup to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    result = rollup(iter_paths(args.paths))
+    if args.format == "csv":
+        text = "".join(result.csv_lines())
+    else:
+        text = json.dumps(result.to_json(), indent=2) + "\n"
+    if args.output:
+        args.output.write_text(text)
+    else:
+        sys.stdout.write(text)
+
+    print(f"{result.leases} leases over {len(result.payments)} months in {time.perf_counter() - started:.2f}s, "
+          f"{len(result.errors)} invalid", file=sys.stderr)
+    for error in result.errors:
+        print(f"INVALID {error['source']}: {error['error']}", file=sys.stderr)
+    return 1 if result.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
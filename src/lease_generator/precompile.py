@@ -0,0 +1,26 @@
+"""Compile every Jinja template ahead of time into the shared bytecode cache.
+
+Usage: python -m lease_generator.precompile
+
+Run it at deploy/build time: it exits with status 1 and lists the errors when
+any template no longer compiles, so a broken template fails the build instead
+of the first request that uses it.
+"""
+import sys
+import time
+
+from .documents import TEMPLATE_CACHE_DIR, precompile_templates, template_env
+
+
+def main() -> int:
+    started = time.perf_counter()
+    errors = precompile_templates()
+    for name, error in sorted(errors.items()):
+        print(f"FAILED {name}: {error}", file=sys.stderr)
+    compiled = len(template_env.list_templates()) - len(errors)
+    print(f"Compiled {compiled} templates into {TEMPLATE_CACHE_DIR} in {(time.perf_counter() - started) * 1000:.1f} ms, {len(errors)} failed")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
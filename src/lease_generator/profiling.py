@@ -0,0 +1,186 @@
+"""Opt-in sampling profiler for individual requests.
+
+A request is profiled when it carries ``X-Lease-Profile: <LEASE_PROFILE_TOKEN>``
+or is picked at LEASE_PROFILE_SAMPLE_RATE. While it runs, a thread samples the
+event loop's stack every LEASE_PROFILE_INTERVAL_MS and keeps the samples that
+belong to this request; a PDF it renders is sampled inside the render worker.
+The result is written to LEASE_PROFILE_DIR in collapsed-stack format
+(``frame;frame;frame count`` per line), which flamegraph.pl, speedscope and
+inferno read directly, next to a JSON file with the request's tags. Without a
+token or sample rate the middleware isn't installed at all.
+"""
+import asyncio
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from .cache import private_directory, user_temp_path
+
+
+# Profiling triggers - both off unless set
+PROFILE_TOKEN = os.environ.get("LEASE_PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("LEASE_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("LEASE_PROFILE_INTERVAL_MS", "2")) / 1000
+PROFILE_DIR = Path(os.environ.get("LEASE_PROFILE_DIR", user_temp_path("lease_generator_profiles")))
+# Oldest profiles are deleted once the directory grows past this
+PROFILE_MAX_BYTES = int(os.environ.get("LEASE_PROFILE_MAX_BYTES", str(100 * 1024 * 1024)))
+
+PROFILE_HEADER = b"x-lease-profile"
+# Requests picked by the sample rate; the header works on any request
+SAMPLED_PATHS = ("/generate", "/api/leases/render", "/generate-payment-schedule")
+
+
+def profiling_enabled() -> bool:
+    return bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval from a background thread.
+
+    With ``root`` set, only samples running inside that frame are kept and
+    stacks start at it - on an event loop thread, that is one request's work.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL_SECONDS, root=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root = root
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                if frame is self.root:
+                    break
+                frame = frame.f_back
+            else:
+                if self.root is not None:
+                    # Another request, or nothing, was running
+                    continue
+            if labels:
+                self.stacks[";".join(reversed(labels))] += 1
+
+
+def profile_call(interval: float, func, *args):
+    """Run func(*args) under a StackSampler; returns (result, stacks). Used inside render workers."""
+    sampler = StackSampler(threading.get_ident(), interval, root=sys._getframe())
+    sampler.start()
+    try:
+        result = func(*args)
+    finally:
+        stacks = sampler.stop()
+    return result, dict(stacks)
+
+
+class RequestProfile:
+    """Samples collected for one request, plus the tags its profile is filed under"""
+
+    def __init__(self, path: str, interval: float = PROFILE_INTERVAL_SECONDS):
+        self.path = path
+        self.interval = interval
+        self.tags: Dict[str, str] = {}
+        self.stacks: Counter = Counter()
+        self.started = time.perf_counter()
+
+    def tag(self, **tags):
+        self.tags.update({name: str(value) for name, value in tags.items() if value})
+
+    def merge(self, stacks: Dict[str, int], prefix: str):
+        for stack, count in stacks.items():
+            self.stacks[f"{prefix};{stack}"] += count
+
+    def save(self, directory: Path = PROFILE_DIR, max_bytes: int = PROFILE_MAX_BYTES) -> Path:
+        """Write the collapsed stacks and tags, then trim the directory to max_bytes"""
+        private_directory(directory)
+        name_parts = [datetime.now().strftime("%Y%m%dT%H%M%S%f"), self.tags.get("tenant", ""),
+                      self.tags.get("lease_id", ""), self.path]
+        stem = "_".join(re.sub(r"[^A-Za-z0-9]+", "-", part).strip("-").lower() for part in name_parts if part)
+        path = directory / f"{stem}.folded"
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()))
+        path.with_suffix(".json").write_text(json.dumps({
+            "path": self.path,
+            "tags": self.tags,
+            "duration_seconds": round(time.perf_counter() - self.started, 6),
+            "interval_seconds": self.interval,
+            "samples": sum(self.stacks.values()),
+        }, indent=2))
+        trim_profiles(directory, max_bytes)
+        return path
+
+
+def trim_profiles(directory: Path, max_bytes: int):
+    """Delete the oldest profiles until the directory fits in max_bytes"""
+    files = sorted((entry for entry in directory.iterdir() if entry.is_file()), key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in files)
+    for entry in files:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        entry.unlink(missing_ok=True)
+
+
+def request_profile(request) -> Optional[RequestProfile]:
+    """The profile being collected for this request, if it was picked for profiling"""
+    return request.scope.get("state", {}).get("profile")
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware that profiles requests carrying the profile token or picked by the sample rate"""
+
+    def __init__(self, app, token: str = PROFILE_TOKEN, sample_rate: float = PROFILE_SAMPLE_RATE):
+        self.app = app
+        self.token = token.encode("latin-1")
+        self.sample_rate = sample_rate
+
+    def _triggered(self, scope) -> bool:
+        if self.token:
+            for name, value in scope.get("headers", ()):
+                # A wrong token is just an unprofiled request; it can still be sampled
+                if name == PROFILE_HEADER and hmac.compare_digest(value, self.token):
+                    return True
+        return self.sample_rate > 0 and scope["path"] in SAMPLED_PATHS and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._triggered(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = RequestProfile(scope["path"])
+        scope.setdefault("state", {})["profile"] = profile
+        # Everything this request runs on the event loop happens inside this frame
+        sampler = StackSampler(threading.get_ident(), profile.interval, root=sys._getframe())
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.merge(sampler.stop(), "web")
+            await asyncio.to_thread(profile.save)
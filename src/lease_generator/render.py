@@ -0,0 +1,322 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib.metadata import version
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .cache import DocumentCache, content_key
+from .metrics import PDF_BYTES
+from .profiling import RequestProfile, profile_call
+
+# WeasyPrint (and the Pango/cairo/fontconfig stack behind it) is only imported
+# inside render workers, so web processes start without paying for it
+if TYPE_CHECKING:
+    import weasyprint
+    from weasyprint.text.fonts import FontConfiguration
+
+
+# Pool sizing - override with environment variables in production
+RENDER_WORKERS = int(os.environ.get("LEASE_RENDER_WORKERS", os.cpu_count() or 1))
+RENDER_MAX_TASKS_PER_WORKER = int(os.environ.get("LEASE_RENDER_MAX_TASKS", "100"))
+# When workers are started: "background" (after startup, without delaying it),
+# "startup" (before the first request is served) or "lazy" (on the first PDF)
+RENDER_PREWARM = os.environ.get("LEASE_RENDER_PREWARM", "background")
+
+# How often a request waiting for another worker's render of the same document checks the lock
+RENDER_LOCK_POLL_SECONDS = 0.05
+
+# Touches the font families our documents use so fontconfig/Pango lookups are primed
+WARMUP_HTML = ("<!DOCTYPE html><html><body><p style=\"font-family: Times, serif\">Lease</p>"
+               "<p style=\"font-family: monospace\">Lease</p></body></html>")
+
+# Plain <style> blocks; these are parsed once per worker instead of once per PDF
+INLINE_STYLE = re.compile(r"<style>(.*?)</style>", re.DOTALL)
+# What makes that unsafe (see document_stylesheets): any other author styles, and !important
+OTHER_AUTHOR_STYLES = re.compile(r"<style\b|<link\b[^>]*\bstylesheet\b", re.IGNORECASE)
+IMPORTANT = re.compile(r"!\s*important", re.IGNORECASE)
+IMPORTANT_STYLE_ATTRIBUTE = re.compile(r"""\bstyle\s*=\s*(?:"[^"]*|'[^']*)!\s*important""", re.IGNORECASE)
+
+# Parsed stylesheets kept per worker. Keyed by content, so an edited template
+# simply misses and the stale entry ages out.
+STYLESHEET_CACHE_SIZE = 16
+
+# Options passed to write_pdf. Our templates carry no creation/modification
+# date metadata and the file identifier is derived from the content, so the
+# same HTML always produces byte-identical PDFs.
+PDF_OPTIONS = {"custom_metadata": False}
+
+# Everything besides the HTML that affects the PDF bytes; part of the cache key
+RENDER_OPTIONS = {"weasyprint": version("weasyprint"), **PDF_OPTIONS}
+
+
+_font_config: Optional["FontConfiguration"] = None
+_stylesheets: "OrderedDict[str, weasyprint.CSS]" = OrderedDict()
+
+
+def inline_stylesheets(html_content: str) -> List[str]:
+    """CSS text of every plain <style> block in a document"""
+    return INLINE_STYLE.findall(html_content)
+
+
+def document_stylesheets(html_content: str) -> Tuple[str, List[str]]:
+    """Split a document's <style> blocks out to be passed to WeasyPrint pre-parsed.
+
+    WeasyPrint applies ``stylesheets=`` as user-origin styles, not author
+    styles like the blocks they replace. The cascade only comes out the same
+    when no author styles are left in the document besides style="" attributes,
+    which outrank both, and nothing is !important, since user !important
+    outranks author !important. Any other document is returned untouched, with
+    no stylesheets, and has its styles parsed as part of the document.
+    """
+    css_texts = inline_stylesheets(html_content)
+    remaining = INLINE_STYLE.sub("", html_content)
+    if (not css_texts or OTHER_AUTHOR_STYLES.search(remaining) or IMPORTANT_STYLE_ATTRIBUTE.search(remaining)
+            or any(IMPORTANT.search(css_text) for css_text in css_texts)):
+        return html_content, []
+    return remaining, css_texts
+
+
+def font_configuration() -> "FontConfiguration":
+    """This process's font configuration, shared by every document it renders"""
+    global _font_config
+    if _font_config is None:
+        from weasyprint.text.fonts import FontConfiguration
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def parsed_stylesheet(css_text: str) -> "weasyprint.CSS":
+    """Parse a stylesheet once per process and reuse it for every later document"""
+    key = hashlib.sha256(css_text.encode("utf-8")).hexdigest()
+    stylesheet = _stylesheets.get(key)
+    if stylesheet is None:
+        import weasyprint
+        stylesheet = weasyprint.CSS(string=css_text, font_config=font_configuration())
+        _stylesheets[key] = stylesheet
+        if len(_stylesheets) > STYLESHEET_CACHE_SIZE:
+            _stylesheets.popitem(last=False)
+    else:
+        _stylesheets.move_to_end(key)
+    return stylesheet
+
+
+def _write_pdf(html_content: str, target=None, pdf_identifier: Optional[bytes] = None):
+    import weasyprint
+
+    if pdf_identifier is None:
+        pdf_identifier = content_key(html_content, RENDER_OPTIONS)[:32].encode("ascii")
+    # Swap the inline styles for their pre-parsed equivalents when that renders the same
+    html_content, css_texts = document_stylesheets(html_content)
+    stylesheets = [parsed_stylesheet(css_text) for css_text in css_texts]
+    document = weasyprint.HTML(string=html_content)
+    return document.write_pdf(target=target, stylesheets=stylesheets, font_config=font_configuration(),
+                              pdf_identifier=pdf_identifier, **PDF_OPTIONS)
+
+
+def warm_up_worker(stylesheets: Sequence[str] = ()):
+    """Pre-parse the document stylesheets and render a tiny document so the first
+    real PDF doesn't pay for CSS parsing, font and layout setup"""
+    for css_text in stylesheets:
+        parsed_stylesheet(css_text)
+    _write_pdf(WARMUP_HTML)
+
+
+def render_pdf(html_content: str, pdf_identifier: Optional[bytes] = None) -> bytes:
+    """Convert rendered HTML into PDF bytes (runs inside a pool worker)"""
+    return _write_pdf(html_content, pdf_identifier=pdf_identifier)
+
+
+def render_pdf_file(html_content: str, target: str, pdf_identifier: Optional[bytes] = None):
+    """Write the PDF for rendered HTML straight to a file (runs inside a pool worker)"""
+    # Write under a temporary name so readers never see a partial file
+    tmp_target = f"{target}.{os.getpid()}.tmp"
+    try:
+        _write_pdf(html_content, tmp_target, pdf_identifier)
+        os.replace(tmp_target, target)
+    finally:
+        # Only left over when the render or the rename failed
+        Path(tmp_target).unlink(missing_ok=True)
+
+
+class RenderedFile(NamedTuple):
+    path: Path
+    temporary: bool  # True when the caller must delete the file after use
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class PDFRenderPool:
+    """Bounded pool of pre-warmed WeasyPrint worker processes.
+
+    WeasyPrint layout is CPU-bound and blocks whatever thread runs it, so PDF
+    rendering happens in separate processes while the event loop keeps serving
+    other requests. Workers are recycled after ``max_tasks_per_worker`` jobs to
+    keep memory from fragmenting over long uptimes. When a cache is given,
+    identical HTML is only ever rendered once - across every process sharing
+    its directory, which wait on a per-document lock rather than render a
+    document another one is already working on. ``warm_stylesheets`` returns the
+    CSS every worker pre-parses at start-up; it is called whenever the pool
+    is (re)created, so recycled pools pick up edited templates.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS, max_tasks_per_worker: int = RENDER_MAX_TASKS_PER_WORKER,
+                 cache: Optional[DocumentCache] = None, warm_stylesheets: Callable[[], List[str]] = list):
+        self.workers = max(1, workers)
+        self.max_tasks_per_worker = max(1, max_tasks_per_worker)
+        self.cache = cache
+        self.warm_stylesheets = warm_stylesheets
+        # Jobs submitted to the workers and not finished yet
+        self.in_flight = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # max_tasks_per_child requires a start method other than fork
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up_worker,
+            initargs=(self.warm_stylesheets(),),
+            max_tasks_per_child=self.max_tasks_per_worker,
+        )
+
+    async def start(self):
+        """Start every worker and wait until each one has finished warming up"""
+        if self._executor is None:
+            self._executor = self._create_executor()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[
+            loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)
+        ])
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, html_content: str) -> bytes:
+        """Render HTML to PDF in a worker process without blocking the event loop"""
+        key = content_key(html_content, RENDER_OPTIONS)
+        if self.cache is None:
+            pdf = await self._render(html_content, key[:32].encode("ascii"))
+            PDF_BYTES.observe(len(pdf), "render")
+            return pdf
+
+        pdf = await asyncio.to_thread(self.cache.get, key)
+        if pdf is None:
+            async with self._render_lock(key):
+                # Another worker may have rendered it while this one waited for the lock
+                pdf = await asyncio.to_thread(self.cache.get, key, False)
+                if pdf is None:
+                    pdf = await self._render(html_content, key[:32].encode("ascii"))
+                    PDF_BYTES.observe(len(pdf), "render")
+                    await asyncio.to_thread(self.cache.put, key, pdf)
+                    return pdf
+        PDF_BYTES.observe(len(pdf), "cache")
+        return pdf
+
+    async def render_file(self, html_content: str, profile: Optional[RequestProfile] = None) -> RenderedFile:
+        """Render HTML to a PDF file without the document ever passing through this process.
+
+        Results go straight into the cache's disk tier when there is one, so
+        responses can stream from disk with bounded memory. A memory-only cache
+        keeps a copy of each PDF and serves hits from a temporary file. With a
+        profile, the render is sampled inside the worker and merged into it.
+        """
+        key = content_key(html_content, RENDER_OPTIONS)
+        if self.cache is not None and self.cache.directory:
+            path = await asyncio.to_thread(self.cache.fresh_path, key)
+            if path is None:
+                async with self._render_lock(key):
+                    # Another worker may have rendered it while this one waited for the lock
+                    path = await asyncio.to_thread(self.cache.fresh_path, key, False)
+                    if path is None:
+                        rendered = await self._render_file(html_content, key, self.cache.path(key), False, profile)
+                if path is None:
+                    await asyncio.to_thread(self.cache.sweep_if_due)
+                    return rendered
+            PDF_BYTES.observe(path.stat().st_size, "cache")
+            return RenderedFile(path, False)
+
+        fd, tmp_name = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        target = Path(tmp_name)
+        if self.cache is None:
+            return await self._render_file(html_content, key, target, True, profile)
+
+        # Memory-only cache: the bytes pass through this process once on the way in and per hit
+        pdf = self.cache.get(key)
+        if pdf is not None:
+            try:
+                await asyncio.to_thread(target.write_bytes, pdf)
+            except BaseException:
+                target.unlink(missing_ok=True)
+                raise
+            PDF_BYTES.observe(len(pdf), "cache")
+            return RenderedFile(target, True)
+        rendered = await self._render_file(html_content, key, target, True, profile)
+        try:
+            self.cache.put(key, await asyncio.to_thread(rendered.path.read_bytes))
+        except BaseException:
+            rendered.path.unlink(missing_ok=True)
+            raise
+        return rendered
+
+    async def _render_file(self, html_content: str, key: str, target: Path, temporary: bool,
+                           profile: Optional[RequestProfile]) -> RenderedFile:
+        try:
+            if profile is None:
+                await self._run(render_pdf_file, html_content, str(target), key[:32].encode("ascii"))
+            else:
+                _, stacks = await self._run(profile_call, profile.interval, render_pdf_file,
+                                            html_content, str(target), key[:32].encode("ascii"))
+                profile.merge(stacks, "pdf_worker")
+        except BaseException:
+            if temporary:
+                target.unlink(missing_ok=True)
+            raise
+        PDF_BYTES.observe(target.stat().st_size, "render")
+        return RenderedFile(target, temporary)
+
+    @asynccontextmanager
+    async def _render_lock(self, key: str):
+        """Hold the cache's lock on a document for the duration of the block"""
+        if not self.cache.directory:
+            yield
+            return
+        lock = self.cache.lock(key)
+        # Polled rather than blocking, so waiting ties up neither the event loop nor a thread
+        while not lock.acquire():
+            await asyncio.sleep(RENDER_LOCK_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    async def _render(self, html_content: str, pdf_identifier: bytes) -> bytes:
+        return await self._run(render_pdf, html_content, pdf_identifier)
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            self._executor = self._create_executor()
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        except BrokenProcessPool:
+            # A worker died mid-render (e.g. out of memory); start a fresh pool for the next request
+            broken, self._executor = self._executor, None
+            if broken is not None:
+                broken.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,247 @@
+"""Find leases coming up for renewal across a directory of saved configurations.
+
+Usage: python -m lease_generator.renewals <directory> [--from DATE] [--days N | --to DATE]
+                                          [--below-market PERCENT] [--market-rent AMOUNT]
+                                          [--increase-percent PERCENT] [--messages DIR] [--index FILE]
+
+Keeps an SQLite index of the fields renewals are decided on - tenant, address,
+bedrooms, dates, rent and previous rent - for every lease_configuration_*.json
+file in the directory. A scan only reads files whose size or mtime changed and
+only re-validates those whose SHA-256 changed, so after the first scan finding
+the leases that end in a window, or rent below market, takes milliseconds
+instead of loading every file. With --messages, each match gets the renewal
+message /generate would write for it, at the proposed rent.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from datetime import date, timedelta
+from fnmatch import fnmatch
+from pathlib import Path
+from statistics import median
+from typing import Dict, List, NamedTuple, Optional
+
+from pydantic import ValidationError
+
+from .bulk import CONFIGURATION_PATTERN
+from .documents import document_filename, generate_renewal_message, renewal_previous_rent
+from .models import configuration_adapter
+
+
+# Kept inside the scanned directory unless --index says otherwise; doesn't match CONFIGURATION_PATTERN
+INDEX_NAME = ".lease_renewals.db"
+
+# Defaults for the CLI
+RENEWAL_WINDOW_DAYS = 60
+RENEWAL_INCREASE_PERCENT = 3.0
+
+# A file modified this recently may change again within the same mtime tick, so
+# its mtime isn't trusted and the next scan hashes it again
+RACY_MTIME_NS = 2 * 10**9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configurations (
+    path TEXT PRIMARY KEY,  -- file name within the directory
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    tenant_name TEXT,
+    mailing_address TEXT,
+    bedrooms INTEGER,
+    start_date TEXT,
+    end_date TEXT,
+    monthly_rent REAL,
+    previous_rent REAL,
+    error TEXT  -- set (and the lease fields NULL) when the file doesn't validate
+);
+
+CREATE INDEX IF NOT EXISTS configurations_end_date ON configurations (end_date);
+"""
+
+
+class UpcomingRenewal(NamedTuple):
+    path: str
+    tenant_name: str
+    mailing_address: str
+    bedrooms: int
+    start_date: date
+    end_date: date
+    monthly_rent: float
+    previous_rent: float  # 0 unless the lease was itself a renewal
+
+    def proposed_rent(self, increase_percent: float) -> float:
+        """Rent for the renewed lease, rounded to whole dollars"""
+        return float(round(self.monthly_rent * (1 + increase_percent / 100)))
+
+    def renewal_message(self, increase_percent: float) -> str:
+        return generate_renewal_message(self.tenant_name, self.monthly_rent, self.proposed_rent(increase_percent))
+
+    def message_filename(self) -> str:
+        # Named as /generate names it for the renewed lease, which starts the day after this one ends
+        return document_filename("renewal_message", self.tenant_name, (self.end_date + timedelta(days=1)).isoformat(), "txt")
+
+
+class ScanResult(NamedTuple):
+    files: int
+    changed: int  # files read and validated again
+    removed: int
+    errors: List[dict]  # indexed files that failed validation: {"source", "error"}
+
+
+def _lease_fields(data: bytes) -> tuple:
+    """The indexed columns for a configuration file, or NULLs and the validation error"""
+    try:
+        config = configuration_adapter.validate_json(data)
+    except ValidationError as e:
+        return (None,) * 7 + (str(e),)
+    terms = config.lease_terms
+    return (config.parties.tenant_name, config.property_details.mailing_address, config.property_details.bedrooms,
+            terms.start_date.isoformat(), terms.end_date.isoformat(), terms.monthly_rent,
+            renewal_previous_rent(terms), None)
+
+
+class RenewalIndex:
+    """Incrementally maintained index of the lease configurations in one directory"""
+
+    def __init__(self, directory: Path, path: Optional[Path] = None):
+        self.directory = Path(directory)
+        self.path = Path(path) if path else self.directory / INDEX_NAME
+        with closing(self._connect()) as db, db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call, as in store.py
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def scan(self) -> ScanResult:
+        """Bring the index up to date with the directory, reading only files that changed"""
+        now = time.time_ns()
+        seen, changed = set(), 0
+        with closing(self._connect()) as db, db:
+            known = {row["path"]: row for row in db.execute("SELECT path, mtime_ns, size, sha256 FROM configurations")}
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not fnmatch(entry.name, CONFIGURATION_PATTERN) or not entry.is_file():
+                        continue
+                    seen.add(entry.name)
+                    stat = entry.stat()
+                    mtime_ns = 0 if now - stat.st_mtime_ns < RACY_MTIME_NS else stat.st_mtime_ns
+                    row = known.get(entry.name)
+                    if row is not None and row["mtime_ns"] == stat.st_mtime_ns and row["size"] == stat.st_size:
+                        continue
+                    data = Path(entry.path).read_bytes()
+                    digest = hashlib.sha256(data).hexdigest()
+                    if row is not None and row["sha256"] == digest:
+                        # Touched or rewritten with the same content
+                        db.execute("UPDATE configurations SET mtime_ns = ?, size = ? WHERE path = ?",
+                                   (mtime_ns, stat.st_size, entry.name))
+                        continue
+                    changed += 1
+                    db.execute("INSERT OR REPLACE INTO configurations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (entry.name, mtime_ns, stat.st_size, digest, *_lease_fields(data)))
+            removed = [(path,) for path in known if path not in seen]
+            db.executemany("DELETE FROM configurations WHERE path = ?", removed)
+            errors = [{"source": row["path"], "error": row["error"]} for row in
+                      db.execute("SELECT path, error FROM configurations WHERE error IS NOT NULL ORDER BY path")]
+        return ScanResult(len(seen), changed, len(removed), errors)
+
+    def market_rents(self) -> Dict[int, float]:
+        """Median monthly rent of the indexed leases, by number of bedrooms"""
+        rents: Dict[int, List[float]] = {}
+        with closing(self._connect()) as db:
+            for bedrooms, rent in db.execute("SELECT bedrooms, monthly_rent FROM configurations WHERE error IS NULL"):
+                rents.setdefault(bedrooms, []).append(rent)
+        return {bedrooms: median(values) for bedrooms, values in rents.items()}
+
+    def find(self, ending_from: Optional[date] = None, ending_to: Optional[date] = None,
+             below_market: Optional[float] = None, market_rent: Optional[float] = None) -> List[UpcomingRenewal]:
+        """Leases ending between two dates (inclusive), soonest first.
+
+        With ``below_market`` (a fraction, e.g. 0.1), only leases renting for at
+        least that much under market: ``market_rent`` when given, otherwise the
+        median rent of indexed leases with the same number of bedrooms.
+        """
+        conditions, params = ["error IS NULL"], []
+        if ending_from:
+            conditions.append("end_date >= ?")
+            params.append(ending_from.isoformat())
+        if ending_to:
+            conditions.append("end_date <= ?")
+            params.append(ending_to.isoformat())
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT path, tenant_name, mailing_address, bedrooms, start_date, end_date, monthly_rent, previous_rent "
+                f"FROM configurations WHERE {' AND '.join(conditions)} ORDER BY end_date, tenant_name",
+                params,
+            ).fetchall()
+        leases = [UpcomingRenewal(row["path"], row["tenant_name"], row["mailing_address"], row["bedrooms"],
+                                  date.fromisoformat(row["start_date"]), date.fromisoformat(row["end_date"]),
+                                  row["monthly_rent"], row["previous_rent"]) for row in rows]
+        if below_market is None:
+            return leases
+        market = self.market_rents() if market_rent is None else {}
+        return [lease for lease in leases
+                if lease.monthly_rent < (market.get(lease.bedrooms, 0.0) if market_rent is None else market_rent)
+                * (1 - below_market)]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m lease_generator.renewals",
+                                     description="List leases ending soon and write their renewal messages")
+    parser.add_argument("directory", type=Path, help=f"Directory of {CONFIGURATION_PATTERN} files")
+    parser.add_argument("--from", dest="ending_from", type=date.fromisoformat,
+                        help="Earliest end date, YYYY-MM-DD (default: today)")
+    parser.add_argument("--days", type=int, default=RENEWAL_WINDOW_DAYS,
+                        help=f"Leases ending within this many days of --from (default: {RENEWAL_WINDOW_DAYS})")
+    parser.add_argument("--to", dest="ending_to", type=date.fromisoformat, help="Latest end date, instead of --days")
+    parser.add_argument("--below-market", type=float, metavar="PERCENT",
+                        help="Only leases renting at least PERCENT below market (0 for any amount)")
+    parser.add_argument("--market-rent", type=float,
+                        help="Market rent for --below-market (default: median rent of indexed leases with as many bedrooms)")
+    parser.add_argument("--increase-percent", type=float, default=RENEWAL_INCREASE_PERCENT,
+                        help=f"Rent increase offered in renewal messages (default: {RENEWAL_INCREASE_PERCENT})")
+    parser.add_argument("--messages", type=Path, help="Write a renewal message for every match into this directory")
+    parser.add_argument("--index", type=Path, help=f"Index file (default: <directory>/{INDEX_NAME})")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    index = RenewalIndex(args.directory, args.index)
+    scan = index.scan()
+    scanned = time.perf_counter()
+    ending_from = args.ending_from or date.today()
+    ending_to = args.ending_to or ending_from + timedelta(days=args.days)
+    below_market = None if args.below_market is None else args.below_market / 100
+    leases = index.find(ending_from, ending_to, below_market, args.market_rent)
+    queried = time.perf_counter()
+
+    if args.messages:
+        args.messages.mkdir(parents=True, exist_ok=True)
+    results = []
+    for lease in leases:
+        result = {**lease._asdict(), "start_date": lease.start_date.isoformat(), "end_date": lease.end_date.isoformat(),
+                  "proposed_rent": lease.proposed_rent(args.increase_percent)}
+        if args.messages:
+            message_path = args.messages / lease.message_filename()
+            message_path.write_text(lease.renewal_message(args.increase_percent), encoding="utf-8")
+            result["message"] = str(message_path)
+        results.append(result)
+    sys.stdout.write(json.dumps(results, indent=2) + "\n")
+
+    print(f"Indexed {scan.files} configurations in {(scanned - started) * 1000:.1f} ms ({scan.changed} re-read, "
+          f"{scan.removed} removed, {len(scan.errors)} invalid); {len(leases)} leases end between {ending_from} "
+          f"and {ending_to} ({(queried - scanned) * 1000:.1f} ms)", file=sys.stderr)
+    for error in scan.errors:
+        print(f"INVALID {error['source']}: {error['error']}", file=sys.stderr)
+    return 1 if scan.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
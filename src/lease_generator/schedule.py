@@ -0,0 +1,191 @@
+import bisect
+from datetime import date
+from typing import List, Optional, Union
+
+from .models import PaymentEntry
+
+
+def _as_date(value: Union[date, str]) -> date:
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _month_starts(start: date, end: date):
+    """Yield the first day of every month from start's month through end"""
+    month_index = start.year * 12 + start.month - 1
+    while True:
+        current = date(month_index // 12, month_index % 12 + 1, 1)
+        if current > end:
+            return
+        yield current
+        month_index += 1
+
+
+class ScheduleRow:
+    """One payment schedule row, without Pydantic validation overhead.
+
+    Schedules are built and rendered from these rows; they are converted to
+    PaymentEntry models only where a model is actually needed.
+    """
+
+    __slots__ = ("due_date", "rent_amount", "security_deposit", "pet_deposit", "other_fees",
+                 "total", "comment", "is_manual", "entry_number")
+
+    def __init__(self, due_date: Union[date, str], rent_amount: float, security_deposit: float = 0.0,
+                 pet_deposit: float = 0.0, other_fees: float = 0.0, total: float = 0.0,
+                 comment: Optional[str] = None, is_manual: bool = False, entry_number: Optional[int] = None):
+        self.due_date = due_date
+        self.rent_amount = rent_amount
+        self.security_deposit = security_deposit
+        self.pet_deposit = pet_deposit
+        self.other_fees = other_fees
+        self.total = total
+        self.comment = comment
+        self.is_manual = is_manual
+        self.entry_number = entry_number
+
+    @classmethod
+    def from_entry(cls, entry: PaymentEntry) -> "ScheduleRow":
+        return cls(entry.due_date, entry.rent_amount, entry.security_deposit, entry.pet_deposit,
+                   entry.other_fees, entry.total, entry.comment, entry.is_manual, entry.entry_number)
+
+    def to_entry(self) -> PaymentEntry:
+        # Row values are already the right types, so skip re-validation
+        return PaymentEntry.model_construct(**{name: getattr(self, name) for name in self.__slots__})
+
+
+class RentTimeline:
+    """Rent in effect over the life of a lease.
+
+    Rent increases are parsed and sorted once; the rent on any day is a binary
+    search over the increase dates, and the increase scheduled for a given
+    month is a dictionary lookup. Several increases may share the same new
+    rent - each one is kept.
+    """
+
+    def __init__(self, monthly_rent: float, rent_increases: List[dict]):
+        self.monthly_rent = float(monthly_rent)
+        parsed = [(_as_date(increase['date']), increase) for increase in rent_increases]
+
+        # Stable sort keeps input order among same-day increases; the last one wins
+        ordered = sorted(parsed, key=lambda item: item[0])
+        self._dates = [increase_date for increase_date, _ in ordered]
+        self._rents = [float(increase['new_rent']) for _, increase in ordered]
+
+        # First increase (in input order) scheduled in each month, for comments
+        self._by_month = {}
+        for increase_date, increase in parsed:
+            self._by_month.setdefault((increase_date.year, increase_date.month), increase)
+
+    def rent_on(self, day: date) -> float:
+        """Rent in effect on a given day"""
+        position = bisect.bisect_right(self._dates, day)
+        return self._rents[position - 1] if position else self.monthly_rent
+
+    def increase_in_month(self, day: date) -> Optional[dict]:
+        """The rent increase scheduled in the same month as day, if any"""
+        return self._by_month.get((day.year, day.month))
+
+
+def build_schedule_rows(start_date: date, end_date: date, monthly_rent: float, rent_increases: List[dict], custom_entries: List[PaymentEntry], security_deposit_increase: float = 0.0, lease_start_comment: str = "", previous_rent: float = 0.0) -> List[ScheduleRow]:
+    """Generate a complete payment schedule with auto-generated monthly payments and custom entries"""
+    if custom_entries is None:
+        custom_entries = []
+
+    schedule = []
+    entry_number = 1
+
+    # Add custom entries first (they take priority)
+    custom_by_date = {}
+    for entry in map(ScheduleRow.from_entry, custom_entries):
+        if isinstance(entry.due_date, date):
+            custom_by_date[entry.due_date] = entry
+        # Non-date entries (like "Lease signing") are added separately
+        else:
+            entry.entry_number = entry_number if not entry.entry_number else entry.entry_number
+            schedule.append(entry)
+            entry_number += 1
+
+    # Parse and sort rent increases once for the whole schedule
+    timeline = RentTimeline(monthly_rent, rent_increases)
+
+    # Add previous month rent entry if there's a rent increase (previous_rent > 0)
+    if previous_rent > 0 and previous_rent != monthly_rent:
+        # Calculate the previous month date (month before lease start)
+        if start_date.month == 1:
+            prev_month_date = date(start_date.year - 1, 12, 1)
+        else:
+            prev_month_date = date(start_date.year, start_date.month - 1, 1)
+
+        # Add entry for previous month at old rate
+        prev_month_entry = ScheduleRow(
+            due_date=prev_month_date,
+            rent_amount=previous_rent,
+            total=previous_rent,
+            comment="Last month at current rate",
+            entry_number=entry_number
+        )
+        schedule.append(prev_month_entry)
+        entry_number += 1
+
+    # Generate monthly payments - one pass over the first of each month
+    for current_date in _month_starts(start_date, end_date):
+        # Skip if there's already a custom entry for this date
+        if current_date in custom_by_date:
+            # Add the custom entry
+            custom_entry = custom_by_date[current_date]
+            custom_entry.entry_number = entry_number if not custom_entry.entry_number else custom_entry.entry_number
+            schedule.append(custom_entry)
+            entry_number += 1
+            continue
+
+        current_rent = timeline.rent_on(current_date)
+
+        # Check if this is the lease start date (first payment)
+        is_lease_start = current_date.year == start_date.year and current_date.month == start_date.month
+
+        comment = ""
+        additional_deposit = 0.0
+
+        if is_lease_start:
+            if security_deposit_increase > 0:
+                # Apply the calculated security deposit increase for lease start
+                additional_deposit = security_deposit_increase
+                if lease_start_comment:
+                    comment = lease_start_comment
+                else:
+                    # Generate default comment with actual dollar amount
+                    comment = f"New lease first month rent plus ${int(security_deposit_increase):,} security deposit increase."
+            else:
+                # No security deposit increase, just first month
+                if lease_start_comment:
+                    comment = lease_start_comment
+                else:
+                    comment = "First month rent"
+        else:
+            # Check if this is a rent increase month
+            matching_increase = timeline.increase_in_month(current_date)
+            if matching_increase is not None:
+                comment = matching_increase.get('comment', '')
+                # Add security deposit difference if rent increased
+                if current_rent > monthly_rent:
+                    additional_deposit = current_rent - monthly_rent
+
+        entry = ScheduleRow(
+            due_date=current_date,
+            rent_amount=current_rent,
+            security_deposit=additional_deposit,
+            total=current_rent + additional_deposit,
+            comment=comment,
+            entry_number=entry_number
+        )
+        schedule.append(entry)
+        entry_number += 1
+
+    return sorted(schedule, key=lambda x: (isinstance(x.due_date, str), x.due_date if isinstance(x.due_date, date) else date.min))
+
+
+def create_payment_schedule(start_date: date, end_date: date, monthly_rent: float, rent_increases: List[dict], custom_entries: List[PaymentEntry], security_deposit_increase: float = 0.0, lease_start_comment: str = "", previous_rent: float = 0.0) -> List[PaymentEntry]:
+    """Generate a payment schedule as PaymentEntry models"""
+    rows = build_schedule_rows(start_date, end_date, monthly_rent, rent_increases, custom_entries,
+                               security_deposit_increase, lease_start_comment, previous_rent)
+    return [row.to_entry() for row in rows]
@@ -0,0 +1,130 @@
+"""Production server: several uvicorn workers forked from one preloaded process.
+
+Usage: python -m lease_generator.serve [--workers N] [--host 0.0.0.0] [--port 8888] [--cache-dir DIR]
+
+The parent imports the app, compiles every template and renders the form
+pages, then binds the listening socket and forks the workers, so everything
+loaded up to that point is shared copy-on-write instead of being rebuilt and
+held once per worker. Workers accept connections from the same socket and
+share the on-disk PDF cache (LEASE_CACHE_DIR), where a per-document lock
+makes concurrent requests for the same lease wait for one render instead of
+each rendering it. The parent restarts workers that die and stops them all on
+SIGTERM or SIGINT.
+
+Unix only (os.fork). ``python -m lease_generator.main`` remains the
+single-process development server.
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import sys
+import time
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+# Web worker processes - override with an environment variable in production
+WEB_WORKERS = int(os.environ.get("LEASE_WEB_WORKERS", str(os.cpu_count() or 1)))
+
+# A worker that dies sooner than this after starting is restarted only after
+# this long, so a worker that can't start doesn't become a fork loop
+RESTART_BACKOFF_SECONDS = 1.0
+
+
+def preload():
+    """Import the app and do its start-up work once, before any worker exists"""
+    from .main import app, precompile_templates, prerender_pages
+
+    for name, error in precompile_templates().items():
+        logger.error("Template %s failed to compile: %s", name, error)
+    prerender_pages()
+    # Move everything loaded so far out of the collector's reach; otherwise the
+    # first collection in each worker touches every object and un-shares its page
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+def run_worker(config, sock):
+    import uvicorn
+
+    # Drop the parent's handlers; uvicorn installs its own for a graceful shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the lease generator with several preloaded workers")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS,
+                        help="Web worker processes (default: LEASE_WEB_WORKERS or the CPU count)")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on (default: 0.0.0.0)")
+    parser.add_argument("--port", type=int, default=8888, help="Port to listen on (default: 8888)")
+    parser.add_argument("--cache-dir", help="PDF cache directory shared by the workers (default: LEASE_CACHE_DIR)")
+    parser.add_argument("--log-level", default="info", help="uvicorn log level (default: info)")
+    args = parser.parse_args(argv)
+    workers = max(1, args.workers)
+
+    # Both are read when the app is imported, so they have to be settled first
+    if args.cache_dir:
+        os.environ["LEASE_CACHE_DIR"] = args.cache_dir
+    # Each worker has its own render pool; split the CPUs between them unless sized explicitly
+    os.environ.setdefault("LEASE_RENDER_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+    import uvicorn
+
+    app = preload()
+    config = uvicorn.Config(app, host=args.host, port=args.port, log_level=args.log_level)
+    sock = config.bind_socket()
+
+    children = {}  # pid -> when it was started
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run_worker(config, sock)
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on {args.host}:{args.port} with {workers} workers "
+          f"({os.environ['LEASE_RENDER_WORKERS']} PDF render processes each), parent pid {os.getpid()}")
+
+    while children:
+        pid, status = os.wait()
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        logger.warning("Worker %d exited with status %d; restarting it", pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < RESTART_BACKOFF_SECONDS:
+            time.sleep(RESTART_BACKOFF_SECONDS)
+        if not stopping:
+            spawn()
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from datetime import date, datetime
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from .models import LeaseConfiguration
+
+
+# Database location - override with an environment variable in production
+LEASE_DB_PATH = Path(os.environ.get("LEASE_DB_PATH", "lease_generator.db"))
+
+# PDF artifacts are copied between files and the database in chunks of this size
+ARTIFACT_CHUNK_BYTES = 1024 * 1024
+
+# Documents neither generated nor served for this long are forgotten, and their
+# canonical URLs 404 - override with an environment variable in production
+DOCUMENT_TTL_SECONDS = int(os.environ.get("LEASE_DOCUMENT_TTL_SECONDS", str(90 * 24 * 3600)))
+# A document's last use is recorded at most this often, so repeat requests only read
+DOCUMENT_TOUCH_SECONDS = 24 * 3600
+# How often expired documents are removed
+PRUNE_INTERVAL_SECONDS = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    lease_id TEXT PRIMARY KEY,
+    tenant_name TEXT NOT NULL,
+    mailing_address TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT NOT NULL,
+    agreement_date TEXT NOT NULL,
+    configuration TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_tenant_name ON leases (tenant_name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS leases_mailing_address ON leases (mailing_address COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS leases_start_date ON leases (start_date);
+CREATE INDEX IF NOT EXISTS leases_end_date ON leases (end_date);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    lease_id TEXT NOT NULL REFERENCES leases (lease_id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    content BLOB NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (lease_id, kind)
+);
+
+CREATE TABLE IF NOT EXISTS documents (
+    document_key TEXT PRIMARY KEY,
+    configuration TEXT NOT NULL,
+    agreement_date TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    used_at REAL NOT NULL DEFAULT 0  -- unix time it was last generated or served, within DOCUMENT_TOUCH_SECONDS
+);
+CREATE INDEX IF NOT EXISTS documents_used_at ON documents (used_at);
+"""
+
+
+def _like_prefix(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+class StoredLease(NamedTuple):
+    lease_id: str
+    configuration: str  # LeaseConfiguration JSON exactly as saved (validated on write)
+    agreement_date: date
+    created_at: datetime
+    updated_at: datetime
+
+    def config_data(self) -> dict:
+        """The configuration as plain JSON data, e.g. for populating the form"""
+        return json.loads(self.configuration)
+
+    def config(self) -> LeaseConfiguration:
+        return LeaseConfiguration.model_validate_json(self.configuration)
+
+
+class StoredDocument(NamedTuple):
+    document_key: str
+    configuration: str
+    agreement_date: date
+    fingerprint: str  # templates_fingerprint() when the document was first rendered
+
+    def config(self) -> LeaseConfiguration:
+        return LeaseConfiguration.model_validate_json(self.configuration)
+
+
+class LeaseSummary(NamedTuple):
+    lease_id: str
+    tenant_name: str
+    mailing_address: str
+    start_date: str
+    end_date: str
+    updated_at: str
+
+
+class LeaseStore:
+    """SQLite store for lease configurations and the documents rendered from them.
+
+    Configurations are validated once when saved and kept as JSON alongside the
+    columns leases are looked up by. Rendered HTML and PDF artifacts are stored
+    with the hash of everything that produced them, so a re-render whose inputs
+    haven't changed is served straight from the database. Documents rendered
+    without saving a lease are remembered by their document key, so they can be
+    served again from a canonical URL until they go unused for DOCUMENT_TTL_SECONDS.
+    """
+
+    def __init__(self, path: Path = LEASE_DB_PATH):
+        self.path = Path(path)
+        with closing(self._connect()) as db, db:
+            # WAL lets web workers read while another one writes
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+        self._last_prune = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call, so the store is safe to use from any thread
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA foreign_keys=ON")
+        return db
+
+    def save(self, config: LeaseConfiguration, agreement_date: date, lease_id: Optional[str] = None) -> Optional[str]:
+        """Store a new lease, or update an existing one and drop the artifacts rendered from its previous version.
+
+        New leases always get an id generated here; an id that isn't already
+        stored is refused (None), so clients can't choose the ids later shown
+        back in pages.
+        """
+        now = datetime.now().isoformat()
+        fields = (config.parties.tenant_name, config.property_details.mailing_address,
+                  config.lease_terms.start_date.isoformat(), config.lease_terms.end_date.isoformat(),
+                  agreement_date.isoformat(), config.model_dump_json())
+        with closing(self._connect()) as db, db:
+            if lease_id is None:
+                lease_id = uuid.uuid4().hex
+                db.execute(
+                    """
+                    INSERT INTO leases (tenant_name, mailing_address, start_date, end_date, agreement_date,
+                                        configuration, lease_id, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (*fields, lease_id, now, now),
+                )
+                return lease_id
+            updated = db.execute(
+                """
+                UPDATE leases SET tenant_name = ?, mailing_address = ?, start_date = ?, end_date = ?,
+                                  agreement_date = ?, configuration = ?, updated_at = ?
+                WHERE lease_id = ?
+                """,
+                (*fields, now, lease_id),
+            ).rowcount
+            if not updated:
+                return None
+            db.execute("DELETE FROM artifacts WHERE lease_id = ?", (lease_id,))
+        return lease_id
+
+    def get(self, lease_id: str) -> Optional[StoredLease]:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT lease_id, configuration, agreement_date, created_at, updated_at FROM leases WHERE lease_id = ?",
+                (lease_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return StoredLease(row["lease_id"], row["configuration"], date.fromisoformat(row["agreement_date"]),
+                           datetime.fromisoformat(row["created_at"]), datetime.fromisoformat(row["updated_at"]))
+
+    def search(self, tenant_name: Optional[str] = None, mailing_address: Optional[str] = None,
+               active_on: Optional[date] = None, limit: int = 100) -> List[LeaseSummary]:
+        """Find leases by tenant or address prefix and/or the date they are in effect"""
+        conditions, params = [], []
+        # Prefix LIKE (case-insensitive by default) is answered from the NOCASE indexes
+        if tenant_name:
+            conditions.append("tenant_name LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(tenant_name))
+        if mailing_address:
+            conditions.append("mailing_address LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(mailing_address))
+        if active_on:
+            conditions.append("start_date <= ? AND end_date >= ?")
+            params.extend([active_on.isoformat(), active_on.isoformat()])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                f"SELECT lease_id, tenant_name, mailing_address, start_date, end_date, updated_at "
+                f"FROM leases {where} ORDER BY start_date DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [LeaseSummary(*row) for row in rows]
+
+    def delete(self, lease_id: str) -> bool:
+        with closing(self._connect()) as db, db:
+            return db.execute("DELETE FROM leases WHERE lease_id = ?", (lease_id,)).rowcount > 0
+
+    def artifact(self, lease_id: str, kind: str, input_hash: str) -> Optional[bytes]:
+        """A stored rendering ("html" or "pdf"), if it was produced from the given inputs"""
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT content FROM artifacts WHERE lease_id = ? AND kind = ? AND input_hash = ?",
+                (lease_id, kind, input_hash),
+            ).fetchone()
+        return row["content"] if row else None
+
+    def put_artifact(self, lease_id: str, kind: str, input_hash: str, content: bytes):
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO artifacts (lease_id, kind, input_hash, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (lease_id, kind, input_hash, content, datetime.now().isoformat()),
+            )
+
+    def put_artifact_file(self, lease_id: str, kind: str, input_hash: str, path: Path):
+        """Store an artifact from a file, copying it in chunks rather than reading it into memory"""
+        with open(path, "rb") as f, closing(self._connect()) as db, db:
+            cursor = db.execute(
+                "INSERT OR REPLACE INTO artifacts (lease_id, kind, input_hash, content, created_at) "
+                "VALUES (?, ?, ?, zeroblob(?), ?)",
+                (lease_id, kind, input_hash, os.fstat(f.fileno()).st_size, datetime.now().isoformat()),
+            )
+            with db.blobopen("artifacts", "content", cursor.lastrowid) as blob:
+                while chunk := f.read(ARTIFACT_CHUNK_BYTES):
+                    blob.write(chunk)
+
+    def copy_artifact(self, lease_id: str, kind: str, input_hash: str, target: Path) -> bool:
+        """Write a stored artifact to a file in chunks; False if there is none for these inputs"""
+        with closing(self._connect()) as db:
+            # One read transaction, so the row can't be replaced between finding and copying it
+            db.execute("BEGIN")
+            row = db.execute(
+                "SELECT rowid FROM artifacts WHERE lease_id = ? AND kind = ? AND input_hash = ?",
+                (lease_id, kind, input_hash),
+            ).fetchone()
+            if row is None:
+                return False
+            with db.blobopen("artifacts", "content", row["rowid"], readonly=True) as blob, open(target, "wb") as f:
+                while chunk := blob.read(ARTIFACT_CHUNK_BYTES):
+                    f.write(chunk)
+        return True
+
+    def touch_document(self, document_key: str) -> bool:
+        """Whether a document is stored under this key, recording that it was used again"""
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT used_at FROM documents WHERE document_key = ?", (document_key,)).fetchone()
+            if row is None:
+                return False
+            self._touch(db, document_key, row["used_at"])
+        return True
+
+    def _touch(self, db: sqlite3.Connection, document_key: str, used_at: float):
+        now = time.time()
+        if now - used_at >= DOCUMENT_TOUCH_SECONDS:
+            with db:
+                db.execute("UPDATE documents SET used_at = ? WHERE document_key = ?", (now, document_key))
+
+    def put_document(self, document_key: str, config: LeaseConfiguration, agreement_date: date, fingerprint: str):
+        """Remember the inputs of a rendered document under its key"""
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR IGNORE INTO documents (document_key, configuration, agreement_date, fingerprint, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (document_key, config.model_dump_json(), agreement_date.isoformat(), fingerprint,
+                 datetime.now().isoformat(), time.time()),
+            )
+        self.prune_documents_if_due()
+
+    def prune_documents_if_due(self):
+        """Forget documents unused for DOCUMENT_TTL_SECONDS, at most once every PRUNE_INTERVAL_SECONDS"""
+        now = time.time()
+        if now - self._last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        with closing(self._connect()) as db, db:
+            db.execute("DELETE FROM documents WHERE used_at < ?", (now - DOCUMENT_TTL_SECONDS,))
+
+    def document(self, document_key: str) -> Optional[StoredDocument]:
+        """The inputs of a document by key, recording that it was used again"""
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT document_key, configuration, agreement_date, fingerprint, used_at FROM documents WHERE document_key = ?",
+                (document_key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self._touch(db, document_key, row["used_at"])
+        return StoredDocument(row["document_key"], row["configuration"], date.fromisoformat(row["agreement_date"]), row["fingerprint"])
@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+# Settings are read when the app is imported, so point everything at a throwaway directory first
+_tmp = tempfile.mkdtemp(prefix="lease_generator_tests_")
+os.environ.setdefault("LEASE_DB_PATH", os.path.join(_tmp, "lease_generator.db"))
+os.environ.setdefault("LEASE_CACHE_DIR", os.path.join(_tmp, "cache"))
+os.environ.setdefault("LEASE_JOB_DIR", os.path.join(_tmp, "jobs"))
+os.environ.setdefault("LEASE_JOB_WORKERS", "0")
+os.environ.setdefault("LEASE_RENDER_PREWARM", "lazy")
+
+import pytest
+
+
+def lease_form_data(**overrides) -> dict:
+    """A complete /generate form submission"""
+    data = {
+        "landlord_name": "John Smith",
+        "landlord_address": "123 Main Street, Anytown, State 12345",
+        "tenant_name": "Jane Doe",
+        "mailing_address": "789 Rental Street, Unit 1, Anytown, State 12345",
+        "residence_type": "Apartment",
+        "bedrooms": "2",
+        "bathrooms": "1",
+        "start_date": "2025-01-01",
+        "end_date": "2025-12-31",
+        "monthly_rent": "1200",
+        "payment_instructions": "Mail a check",
+        "include_payment_schedule": "true",
+        "auto_generate_schedule": "true",
+        "rent_increases": '[{"date": "2025-07-01", "new_rent": 1250, "comment": "Mid-year"}]',
+        "agreement_date": "2024-12-15",
+        "output_format": "html",
+    }
+    data.update(overrides)
+    return data
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    from lease_generator.main import app
+
+    with TestClient(app) as client:
+        yield client
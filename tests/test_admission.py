@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from lease_generator.admission import AdmissionController
+
+from conftest import lease_form_data
+
+
+async def hold(controller: AdmissionController, client: str, priority: str, release: asyncio.Event):
+    async with controller.slot(client, priority):
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_client_over_its_limit_gets_429_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(limit=4, per_client=1)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(controller, "a", "pdf", release))
+        await settle()
+        with pytest.raises(HTTPException) as rejected:
+            async with controller.slot("a", "pdf"):
+                pass
+        # Other clients are unaffected
+        async with controller.slot("b", "pdf"):
+            pass
+        release.set()
+        await holder
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 429
+    assert int(rejected.headers["Retry-After"]) >= 1
+
+
+def test_full_queue_and_expired_wait_get_503_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(limit=1, per_client=10, max_queue=1, max_wait=0.05)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(controller, "a", "pdf", release))
+        await settle()
+        waiter = asyncio.create_task(hold(controller, "b", "pdf", asyncio.Event()))
+        await settle()
+        with pytest.raises(HTTPException) as full:
+            async with controller.slot("c", "pdf"):
+                pass
+        with pytest.raises(HTTPException) as timed_out:
+            await waiter
+        release.set()
+        await holder
+        return controller, full.value, timed_out.value
+
+    controller, full, timed_out = asyncio.run(scenario())
+    for rejected in (full, timed_out):
+        assert rejected.status_code == 503
+        assert int(rejected.headers["Retry-After"]) >= 1
+    assert controller.rejected == {("pdf", "queue_full"): 1, ("pdf", "timeout"): 1}
+    assert controller.active == 0 and controller.waiting == 0
+
+
+def test_preview_displaces_a_queued_pdf_and_is_admitted_first():
+    async def scenario():
+        controller = AdmissionController(limit=1, per_client=10, max_queue=2, max_wait=5)
+        order = []
+
+        async def request(client, priority, release):
+            async with controller.slot(client, priority):
+                order.append(client)
+                await release.wait()
+
+        release = asyncio.Event()
+        holder = asyncio.create_task(request("holder", "pdf", release))
+        await settle()
+        pdf_old = asyncio.create_task(request("pdf-old", "pdf", release))
+        await settle()
+        pdf_new = asyncio.create_task(request("pdf-new", "pdf", release))
+        await settle()
+        preview = asyncio.create_task(request("preview", "preview", release))
+        await settle()
+        with pytest.raises(HTTPException) as displaced:
+            await pdf_new
+        release.set()
+        await asyncio.gather(holder, pdf_old, preview)
+        return controller, order, displaced.value
+
+    controller, order, displaced = asyncio.run(scenario())
+    assert displaced.status_code == 503
+    assert "Retry-After" in displaced.headers
+    assert order == ["holder", "preview", "pdf-old"]
+    assert controller.rejected == {("pdf", "displaced"): 1}
+
+
+def test_slot_is_released_when_the_request_fails():
+    async def scenario():
+        controller = AdmissionController(limit=1, per_client=1, max_queue=0)
+        with pytest.raises(RuntimeError):
+            async with controller.slot("a", "pdf"):
+                raise RuntimeError("render failed")
+        # Both the process-wide slot and the client's count are free again
+        async with controller.slot("a", "pdf"):
+            pass
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert controller.active == 0
+    assert controller._clients == {}
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    """A fresh controller for the app, allowing one document per client"""
+    from lease_generator import main
+
+    controller = AdmissionController(per_client=1)
+    monkeypatch.setattr(main, "render_admission", controller)
+    return controller
+
+
+def test_every_pdf_route_is_admitted(client, admission):
+    lease_id = client.post("/generate", data=lease_form_data(save_lease="true")).headers["x-lease-id"]
+    canonical = client.post("/generate", data=lease_form_data()).headers["content-location"].replace("/html", "/pdf")
+
+    # The test client already has as many documents in progress as it may
+    admission._clients["testclient"] = 1
+    responses = [
+        client.post("/generate", data=lease_form_data(output_format="pdf")),
+        client.get(f"/leases/{lease_id}/pdf"),
+        client.get(canonical),
+        client.post("/generate/bulk", files={"configurations": ("leases.jsonl", b"{}\n")}),
+    ]
+    for response in responses:
+        assert response.status_code == 429, response.request.url
+        assert "retry-after" in response.headers
+    assert admission.rejected == {("pdf", "client_limit"): 4}
+
+
+def test_bulk_download_gives_its_slot_back(client, admission):
+    for _ in range(2):
+        response = client.post("/generate/bulk", files={"configurations": ("leases.jsonl", b"not json\n")})
+        assert response.status_code == 200
+    assert admission.active == 0
+    assert admission._clients == {}
+
+
+def test_revalidation_needs_no_slot(client, admission):
+    etag = client.post("/generate", data=lease_form_data()).headers["etag"]
+
+    admission._clients["testclient"] = 1
+    response = client.post("/generate", data=lease_form_data(), headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert admission.rejected == {}
@@ -0,0 +1,76 @@
+import json
+from datetime import date
+
+import pytest
+
+from lease_generator.documents import prepare_lease, render_lease_html
+from lease_generator.main import EXAMPLE_TEMPLATE_PATH
+from lease_generator.models import LeaseConfiguration
+
+EXAMPLE = json.loads(EXAMPLE_TEMPLATE_PATH.read_text())
+RENDER_URL = "/api/leases/render"
+
+
+def renewal_example() -> dict:
+    data = json.loads(json.dumps(EXAMPLE))
+    data["lease_terms"]["security_deposit_details"] = {"previous_rent": 1100.0, "use_custom_section": True}
+    return data
+
+
+def test_html_is_the_lease_rendered_from_the_configuration(client):
+    response = client.post(RENDER_URL, params={"agreement_date": "2024-12-15"}, json=EXAMPLE)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    assert "etag" in response.headers
+    lease, schedule_rows = prepare_lease(LeaseConfiguration.model_validate(EXAMPLE), date(2024, 12, 15))
+    assert response.text == render_lease_html(lease, schedule_rows)
+
+    revalidated = client.post(RENDER_URL, params={"agreement_date": "2024-12-15"}, json=EXAMPLE,
+                              headers={"If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+
+
+def test_config_echoes_the_validated_configuration(client):
+    response = client.post(RENDER_URL, params={"output_format": "config"}, json=EXAMPLE)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["content-disposition"] == "attachment; filename=lease_configuration_jane_doe_2025_01_01.json"
+    assert LeaseConfiguration.model_validate_json(response.content) == LeaseConfiguration.model_validate(EXAMPLE)
+
+
+def test_renewal_message_uses_the_previous_rent(client):
+    response = client.post(RENDER_URL, params={"output_format": "renewal_message"}, json=renewal_example())
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert response.headers["content-disposition"] == "attachment; filename=renewal_message_jane_doe_2025_01_01.txt"
+    assert response.text.startswith("Hi Jane!")
+    assert "increase by 9% ($100)" in response.text
+
+
+def test_renewal_message_without_previous_rent_is_a_400(client):
+    response = client.post(RENDER_URL, params={"output_format": "renewal_message"}, json=EXAMPLE)
+    assert response.status_code == 400
+    assert "previous_rent" in response.json()["detail"]
+
+
+@pytest.mark.parametrize("body", [
+    {key: value for key, value in EXAMPLE.items() if key != "parties"},
+    {**EXAMPLE, "lease_terms": {**EXAMPLE["lease_terms"], "monthly_rent": "a lot"}},
+])
+def test_invalid_configuration_is_a_422_located_in_the_body(client, body):
+    response = client.post(RENDER_URL, json=body)
+    assert response.status_code == 422
+    locations = [error["loc"] for error in response.json()["detail"]]
+    assert locations and all(location[0] == "body" for location in locations)
+
+
+def test_malformed_json_is_a_422(client):
+    response = client.post(RENDER_URL, content=b'{"parties": ', headers={"Content-Type": "application/json"})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "json_invalid"
+
+
+def test_unknown_output_format_is_a_422(client):
+    response = client.post(RENDER_URL, params={"output_format": "docx"}, json=EXAMPLE)
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["query", "output_format"]
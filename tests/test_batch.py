@@ -0,0 +1,68 @@
+import asyncio
+import io
+import json
+import zipfile
+
+from lease_generator.batch import percentile, read_configurations
+from lease_generator.bulk import iter_configurations, stream_lease_pdfs, unique_name
+from lease_generator.main import EXAMPLE_TEMPLATE_PATH
+
+
+def test_unique_name_numbers_repeats():
+    used = set()
+    assert [unique_name(name, used) for name in ("a.pdf", "a.pdf", "b.pdf", "a.pdf")] == ["a.pdf", "a_2.pdf", "b.pdf", "a_3.pdf"]
+
+
+def test_leases_with_the_same_name_get_their_own_outputs(tmp_path):
+    example = json.loads(EXAMPLE_TEMPLATE_PATH.read_text())
+    paths = []
+    for number in range(3):
+        path = tmp_path / f"lease_configuration_{number}.json"
+        example["lease_terms"]["monthly_rent"] = 1000 + number
+        path.write_text(json.dumps(example))
+        paths.append(path)
+    invalid = tmp_path / "lease_configuration_invalid.json"
+    invalid.write_text("{}")
+    # Removed between listing the directory and reading it
+    missing = tmp_path / "lease_configuration_missing.json"
+
+    inputs, errors = read_configurations(paths + [invalid, missing], None, "templates")
+    names = {path: batch_input.output for path, batch_input in inputs.items()}
+    assert len(set(names.values())) == 3
+    first = names[paths[0]]
+    assert names[paths[1]] == first.replace(".pdf", "_2.pdf")
+    assert names[paths[2]] == first.replace(".pdf", "_3.pdf")
+    assert list(errors) == [invalid, missing]
+
+
+def test_unreadable_zip_member_is_reported_and_the_batch_goes_on():
+    example = EXAMPLE_TEMPLATE_PATH.read_bytes()
+    upload = io.BytesIO()
+    with zipfile.ZipFile(upload, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("lease_configuration_corrupt.json", example)
+        archive.writestr("lease_configuration_good.json", example)
+    # Overwrite the first member's compressed data so inflating it fails
+    data = bytearray(upload.getvalue())
+    corrupt = zipfile.ZipFile(io.BytesIO(bytes(data))).infolist()[0]
+    start = corrupt.header_offset + 30 + len(corrupt.filename)
+    data[start:start + 16] = b"\xff" * 16
+
+    async def render(html_content):
+        return b"%PDF"
+
+    async def collect():
+        items = iter_configurations(io.BytesIO(bytes(data)))
+        return b"".join([chunk async for chunk in stream_lease_pdfs(items, render, concurrency=2)])
+
+    with zipfile.ZipFile(io.BytesIO(asyncio.run(collect()))) as result:
+        manifest = json.loads(result.read("manifest.json"))
+    assert (manifest["rendered"], manifest["failed"]) == (1, 1)
+    assert manifest["items"][0]["source"] == "lease_configuration_corrupt.json"
+    assert manifest["items"][0]["error"]
+
+
+def test_percentile_is_nearest_rank():
+    assert percentile([3.0, 1.0, 2.0, 4.0], 0.50) == 2.0
+    assert percentile([3.0, 1.0, 2.0, 4.0], 0.99) == 4.0
+    assert percentile([5.0], 0.0) == 5.0
+    assert percentile([], 0.95) == 0.0
@@ -0,0 +1,80 @@
+import os
+import stat
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from lease_generator.cache import DocumentCache, private_directory
+
+unix_only = pytest.mark.skipif(not hasattr(os, "getuid"), reason="ownership checks are Unix-only")
+
+
+@unix_only
+def test_private_directory_is_created_owner_only(tmp_path):
+    path = private_directory(tmp_path / "a" / "cache")
+    assert stat.S_IMODE(path.stat().st_mode) == 0o700
+
+
+@unix_only
+def test_private_directory_tightens_our_own_shared_directory(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    private_directory(shared)
+    assert stat.S_IMODE(shared.stat().st_mode) == 0o700
+
+
+@unix_only
+def test_private_directory_refuses_another_users_directory(tmp_path, monkeypatch):
+    planted = tmp_path / "planted"
+    planted.mkdir()
+    monkeypatch.setattr(os, "getuid", lambda: planted.stat().st_uid + 1)
+    with pytest.raises(RuntimeError):
+        private_directory(planted)
+
+
+@unix_only
+def test_private_directory_refuses_a_file(tmp_path):
+    (tmp_path / "file").write_text("")
+    with pytest.raises((RuntimeError, FileExistsError)):
+        private_directory(tmp_path / "file")
+
+
+def test_sweep_removes_expired_entries_and_stale_temporary_files(tmp_path):
+    cache = DocumentCache(memory_bytes=0, directory=tmp_path / "cache", ttl_seconds=7200)
+    cache.put("ab" * 32, b"%PDF-old")
+    cache.put("cd" * 32, b"%PDF-new")
+    shard = cache.path("ab" * 32).parent
+    leftovers = {
+        "render": shard / f"{'ab' * 32}.pdf.1234.tmp",  # render_pdf_file
+        "write": shard / "tmpa1b2c3.tmp",  # _write_disk
+        "current": shard / "tmpd4e5f6.tmp",
+    }
+    for path in leftovers.values():
+        path.write_bytes(b"partial")
+    hours_ago = time.time() - 3 * 3600
+    for path in (cache.path("ab" * 32), leftovers["render"], leftovers["write"]):
+        os.utime(path, (hours_ago, hours_ago))
+
+    # put() swept already; the next sweep is due once the interval has passed
+    cache._last_sweep = 0.0
+    cache.sweep_if_due()
+    assert not cache.path("ab" * 32).exists()
+    assert cache.path("cd" * 32).exists()
+    assert not leftovers["render"].exists() and not leftovers["write"].exists()
+    # Could still be being written
+    assert leftovers["current"].exists()
+
+
+def test_empty_cache_dir_setting_means_memory_only(tmp_path):
+    src = Path(__file__).resolve().parent.parent / "src"
+    env = {**os.environ, "LEASE_CACHE_DIR": "", "PYTHONPATH": str(src)}
+    script = "from lease_generator.cache import CACHE_DIR, DocumentCache; print(CACHE_DIR, DocumentCache().directory)"
+    output = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    assert output.split() == ["None", "None"]
+    # Nothing is written to the working directory
+    assert list(tmp_path.iterdir()) == []
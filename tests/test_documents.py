@@ -0,0 +1,143 @@
+import json
+from datetime import date
+
+import pytest
+
+from conftest import lease_form_data
+from lease_generator.documents import _fragments, lease_template_context, prepare_lease, render_lease_html, template_env
+from lease_generator.main import EXAMPLE_TEMPLATE_PATH
+from lease_generator.models import LeaseConfiguration
+
+
+# Submissions that differ only in fields the lease model may or may not record
+VARIANTS = [
+    {},
+    {"previous_rent": "1100"},
+    {"previous_rent": "1150"},
+    {"use_custom_security_deposit": "true", "previous_rent": "1100"},
+    {"use_custom_security_deposit": "true", "previous_rent": "1150"},
+    {"lease_start_comment": "Welcome"},
+    {"auto_generate_schedule": "false"},
+]
+
+
+def test_same_document_key_means_same_bytes(client):
+    documents = {}
+    for overrides in VARIANTS:
+        response = client.post("/generate", data=lease_form_data(**overrides))
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        assert documents.setdefault(etag, response.content) == response.content, overrides
+
+        # The canonical URL serves exactly what /generate did
+        canonical = client.get(response.headers["content-location"])
+        assert canonical.status_code == 200
+        assert canonical.content == response.content
+
+
+def test_previous_rent_without_custom_deposit_is_ignored(client):
+    plain = client.post("/generate", data=lease_form_data())
+    with_previous = client.post("/generate", data=lease_form_data(previous_rent="1100"))
+    assert plain.headers["etag"] == with_previous.headers["etag"]
+    assert plain.content == with_previous.content
+    assert b"Last month at current rate" not in with_previous.content
+
+
+def test_previous_rent_with_custom_deposit_changes_the_document(client):
+    plain = client.post("/generate", data=lease_form_data())
+    renewal = client.post("/generate", data=lease_form_data(use_custom_security_deposit="true", previous_rent="1100"))
+    assert plain.headers["etag"] != renewal.headers["etag"]
+    assert b"Last month at current rate" in renewal.content
+
+
+@pytest.mark.parametrize("overrides", VARIANTS)
+def test_if_none_match_only_matches_the_same_document(client, overrides):
+    response = client.post("/generate", data=lease_form_data(**overrides))
+    revalidated = client.post("/generate", data=lease_form_data(**overrides),
+                              headers={"If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+
+
+@pytest.mark.parametrize("output_format", ["csv", "jsonl", "html", "pdf"])
+def test_invalid_schedule_entry_is_rejected_before_streaming(client, output_format):
+    lease_data = {"additional_terms": {"payment_schedule": {"custom_entries": [
+        {"due_date": "2025-01-01", "rent_amount": 1500, "total": 1500},
+        {"due_date": "2025-02-01", "rent_amount": "abc", "total": 1500},
+    ]}}}
+    response = client.post(f"/generate-payment-schedule?output_format={output_format}", json=lease_data)
+    assert response.status_code == 400
+    assert "rent_amount" in response.text
+
+
+def example_lease(**payment_schedule):
+    data = json.loads(EXAMPLE_TEMPLATE_PATH.read_text())
+    data["additional_terms"]["payment_schedule"].update(payment_schedule)
+    return prepare_lease(LeaseConfiguration.model_validate(data), date(2024, 12, 15))
+
+
+def render_both(lease, schedule_rows):
+    """The section-cached render and a direct render of lease_template.html"""
+    direct = template_env.get_template("lease_template.html").render(lease_template_context(lease, schedule_rows))
+    return render_lease_html(lease, schedule_rows), direct
+
+
+def rerendered_sections(render) -> set:
+    """Names of the sections a render had to render instead of taking from the cache"""
+    before = set(_fragments)
+    render()
+    return {key[0] for key in set(_fragments) - before}
+
+
+INCREASE = {"date": "2025-07-01", "new_rent": 1250, "comment": "Mid-year"}
+CUSTOM_ENTRY = {"due_date": "2025-01-01", "rent_amount": 1200, "total": 1200, "comment": "First month"}
+
+
+@pytest.mark.parametrize("payment_schedule", [
+    {},
+    {"rent_increases": [INCREASE]},
+    {"auto_generate": False, "custom_entries": [CUSTOM_ENTRY]},
+    {"include_in_lease": False},
+])
+def test_section_render_matches_the_whole_template(payment_schedule):
+    lease, schedule_rows = example_lease(**payment_schedule)
+    cached, direct = render_both(lease, schedule_rows)
+    assert cached == direct
+    # And again once every section comes from the cache
+    assert render_both(lease, schedule_rows) == (direct, direct)
+
+
+def test_changing_a_field_only_rerenders_the_sections_that_read_it():
+    lease, schedule_rows = example_lease()
+    render_lease_html(lease, schedule_rows)
+    renamed = lease.model_copy(update={"parties": lease.parties.model_copy(update={"landlord_address": "1 New Road"})})
+    sections = rerendered_sections(lambda: render_lease_html(renamed, schedule_rows))
+    assert "lease/parties.html" in sections
+    assert not sections & {"lease/head.html", "lease/rent.html", "lease/standard_terms.html", "lease/payment_schedule.html"}
+    cached, direct = render_both(renamed, schedule_rows)
+    assert cached == direct
+
+
+@pytest.mark.parametrize("original, changed", [
+    ({"rent_increases": [INCREASE]}, {"rent_increases": [{**INCREASE, "new_rent": 1275}]}),
+    ({"rent_increases": [INCREASE]}, {"rent_increases": [{**INCREASE, "comment": "Market adjustment"}]}),
+    ({"auto_generate": False, "custom_entries": [CUSTOM_ENTRY]},
+     {"auto_generate": False, "custom_entries": [{**CUSTOM_ENTRY, "rent_amount": 1100, "total": 1100}]}),
+])
+def test_nested_schedule_changes_invalidate_the_fragment(original, changed):
+    render_lease_html(*example_lease(**original))
+    lease, schedule_rows = example_lease(**changed)
+    assert "lease/payment_schedule.html" in rerendered_sections(lambda: render_lease_html(lease, schedule_rows))
+    cached, direct = render_both(lease, schedule_rows)
+    assert cached == direct
+    assert cached != render_lease_html(*example_lease(**original))
+
+
+def test_unknown_output_format_is_the_html_document(client):
+    html = client.post("/generate", data=lease_form_data())
+    unknown = client.post("/generate", data=lease_form_data(output_format="docx"))
+    assert unknown.status_code == 200
+    assert unknown.content == html.content
+    assert unknown.headers["etag"] == html.headers["etag"]
+    assert unknown.headers["content-location"] == html.headers["content-location"]
+    assert unknown.headers["content-location"].endswith("/html")
+    assert client.get(unknown.headers["content-location"]).content == html.content
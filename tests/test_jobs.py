@@ -0,0 +1,171 @@
+import asyncio
+import io
+import json
+import sqlite3
+from datetime import date
+
+import pytest
+
+from conftest import lease_form_data
+from lease_generator import jobs
+from lease_generator.documents import prepare_lease, render_lease_html
+from lease_generator.jobs import JobQueue
+from lease_generator.main import EXAMPLE_TEMPLATE_PATH
+from lease_generator.models import LeaseConfiguration
+from lease_generator.render import PDFRenderPool
+
+EXAMPLE = json.loads(EXAMPLE_TEMPLATE_PATH.read_text())
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(tmp_path / "jobs.db", tmp_path / "jobs", result_ttl_seconds=60, max_attempts=2)
+
+
+def test_jobs_are_claimed_oldest_first_and_only_once(queue):
+    first = queue.submit("lease", {"n": 1})
+    second = queue.submit("lease", {"n": 2})
+
+    claimed = queue.claim()
+    assert (claimed.job_id, claimed.payload, claimed.status, claimed.attempts) == (first, {"n": 1}, "running", 1)
+    assert queue.claim().job_id == second
+    assert queue.claim() is None
+    assert queue.counts() == {"running": 2}
+
+
+def test_completed_job_keeps_its_result_and_drops_its_input(queue):
+    job_id = queue.submit("bulk", {}, upload=io.BytesIO(b"{}\n"))
+    assert queue.input_path(job_id).read_bytes() == b"{}\n"
+    queue.claim()
+    queue.heartbeat(job_id, "1 of 1")
+    assert queue.get(job_id).progress == "1 of 1"
+
+    queue.result_path(job_id).write_bytes(b"PK")
+    queue.complete(job_id, "application/zip", "lease_agreements.zip")
+    job = queue.get(job_id)
+    assert (job.status, job.media_type, job.filename) == ("done", "application/zip", "lease_agreements.zip")
+    assert not queue.input_path(job_id).exists()
+
+
+def test_failed_job_is_retried_until_out_of_attempts(queue):
+    job_id = queue.submit("lease", {})
+    queue.claim()
+    queue.fail(job_id, "worker crashed", retry=True)
+    assert queue.get(job_id).status == "queued"
+
+    assert queue.claim().attempts == 2
+    queue.fail(job_id, "worker crashed again", retry=True)
+    job = queue.get(job_id)
+    assert (job.status, job.error) == ("failed", "worker crashed again")
+
+
+def test_invalid_input_fails_without_retry(queue):
+    job_id = queue.submit("lease", {})
+    queue.claim()
+    queue.fail(job_id, "bad configuration", retry=False)
+    assert queue.get(job_id).status == "failed"
+    assert queue.claim() is None
+
+
+def test_released_job_does_not_use_up_an_attempt(queue):
+    job_id = queue.submit("lease", {})
+    queue.claim()
+    queue.release(job_id)
+    job = queue.get(job_id)
+    assert (job.status, job.attempts) == ("queued", 0)
+
+
+def test_job_of_a_dead_worker_is_claimed_again(queue, monkeypatch):
+    job_id = queue.submit("lease", {})
+    monkeypatch.setattr(jobs, "JOB_CLAIM_SECONDS", -1)
+    queue.claim()
+    # The claim has already lapsed, so another worker takes the job over
+    reclaimed = queue.claim()
+    assert (reclaimed.job_id, reclaimed.attempts) == (job_id, 2)
+    # Out of attempts: given up rather than handed out again
+    assert queue.claim() is None
+    assert queue.get(job_id).status == "failed"
+
+
+def test_finished_jobs_expire_with_their_results(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.db", tmp_path / "jobs", result_ttl_seconds=0)
+    job_id = queue.submit("lease", {})
+    queue.claim()
+    queue.result_path(job_id).write_bytes(b"<html>")
+    queue.complete(job_id, "text/html", "lease.html")
+
+    queue.expire_if_due()
+    assert queue.get(job_id) is None
+    assert not queue.result_path(job_id).exists()
+
+
+def test_worker_survives_queue_errors(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "WORKER_ERROR_SECONDS", 0)
+    monkeypatch.setattr(jobs, "POLL_SECONDS", 0)
+    claim, calls = queue.claim, []
+
+    def flaky_claim():
+        calls.append(None)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return claim()
+
+    monkeypatch.setattr(queue, "claim", flaky_claim)
+    job_id = queue.submit("lease", {"configuration": json.dumps(EXAMPLE), "agreement_date": "2024-12-15",
+                                    "output_format": "html"})
+
+    async def scenario():
+        worker = asyncio.create_task(jobs.run_worker(queue, PDFRenderPool()))
+        for _ in range(200):
+            if queue.get(job_id).status == "done":
+                break
+            await asyncio.sleep(0.01)
+        worker.cancel()
+
+    asyncio.run(scenario())
+    assert queue.get(job_id).status == "done"
+    assert b"Jane Doe" in queue.result_path(job_id).read_bytes()
+
+
+def test_failed_bulk_job_leaves_no_partial_archive(queue, monkeypatch):
+    job_id = queue.submit("bulk", {}, upload=io.BytesIO(b"{}\n"))
+    job = queue.claim()
+
+    async def failing_stream(items, render, concurrency):
+        yield b"PK partial archive"
+        raise OSError("disk full")
+
+    monkeypatch.setattr(jobs, "stream_lease_pdfs", failing_stream)
+    asyncio.run(jobs.run_job(queue, job, PDFRenderPool()))
+    assert queue.get(job_id).status == "queued"  # retried after the disk error
+    assert list(queue.directory.glob("*.tmp")) == []
+
+
+def test_unknown_output_format_fails_without_rendering(queue):
+    job_id = queue.submit("lease", {"configuration": json.dumps(EXAMPLE), "agreement_date": "2024-12-15",
+                                    "output_format": "docx"})
+    job = queue.claim()
+
+    class NoRenders(PDFRenderPool):
+        async def render_file(self, html_content, profile=None):
+            raise AssertionError("rendered a PDF")
+
+    asyncio.run(jobs.run_job(queue, job, NoRenders()))
+    job = queue.get(job_id)
+    assert job.status == "failed"
+    assert "docx" in job.error
+
+
+def test_jobs_endpoint_rejects_an_unknown_output_format(client):
+    response = client.post("/jobs", data=lease_form_data(output_format="docx"))
+    assert response.status_code == 422
+    assert "renewal_message" in response.text
+
+
+def test_html_job_renders_the_same_lease_as_the_web_app(queue):
+    job_id = queue.submit("lease", {"configuration": json.dumps(EXAMPLE), "agreement_date": "2024-12-15",
+                                    "output_format": "html"})
+    asyncio.run(jobs.run_job(queue, queue.claim(), PDFRenderPool()))
+    assert queue.get(job_id).status == "done"
+    expected = render_lease_html(*prepare_lease(LeaseConfiguration.model_validate(EXAMPLE), date(2024, 12, 15)))
+    assert queue.result_path(job_id).read_text(encoding="utf-8") == expected
@@ -0,0 +1,70 @@
+from conftest import lease_form_data
+from lease_generator.metrics import Histogram, Timings
+
+
+def test_histogram_exposition_is_cumulative():
+    histogram = Histogram("lease_test_seconds", "Test durations", (1, 2.5, 5), ("route",))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value, "/generate")
+    histogram.observe(2, 'say "hi"')
+    assert histogram.expose() == [
+        "# HELP lease_test_seconds Test durations",
+        "# TYPE lease_test_seconds histogram",
+        'lease_test_seconds_bucket{route="/generate",le="1"} 2',
+        'lease_test_seconds_bucket{route="/generate",le="2.5"} 2',
+        'lease_test_seconds_bucket{route="/generate",le="5"} 3',
+        'lease_test_seconds_bucket{route="/generate",le="+Inf"} 4',
+        'lease_test_seconds_sum{route="/generate"} 14.5',
+        'lease_test_seconds_count{route="/generate"} 4',
+        'lease_test_seconds_bucket{route="say \\"hi\\"",le="1"} 0',
+        'lease_test_seconds_bucket{route="say \\"hi\\"",le="2.5"} 1',
+        'lease_test_seconds_bucket{route="say \\"hi\\"",le="5"} 1',
+        'lease_test_seconds_bucket{route="say \\"hi\\"",le="+Inf"} 1',
+        'lease_test_seconds_sum{route="say \\"hi\\""} 2.0',
+        'lease_test_seconds_count{route="say \\"hi\\""} 1',
+    ]
+
+
+def test_histogram_without_labels_or_observations():
+    histogram = Histogram("lease_empty_bytes", "Nothing yet", (10,))
+    assert histogram.expose() == ["# HELP lease_empty_bytes Nothing yet", "# TYPE lease_empty_bytes histogram"]
+    histogram.observe(5)
+    assert histogram.expose()[2:] == ['lease_empty_bytes_bucket{le="10"} 1', 'lease_empty_bytes_bucket{le="+Inf"} 1',
+                                      "lease_empty_bytes_sum 5.0", "lease_empty_bytes_count 1"]
+
+
+def test_repeated_stages_report_their_total():
+    timings = Timings()
+    timings.record("store", 0.001)
+    timings.record("store", 0.002)
+    timings.record("template", 0.0105)
+    assert timings.server_timing(0.02) == "store;dur=3.00, template;dur=10.50, total;dur=20.00"
+
+
+def server_timing(response) -> dict:
+    entries = {}
+    for entry in response.headers["server-timing"].split(", "):
+        name, _, duration = entry.partition(";dur=")
+        entries[name] = float(duration)
+    return entries
+
+
+def test_generate_reports_its_stages_in_server_timing(client):
+    response = client.post("/generate", data=lease_form_data())
+    assert response.status_code == 200
+    stages = server_timing(response)
+    assert {"parse", "schedule", "template", "total"} <= set(stages)
+    assert all(duration >= 0 for duration in stages.values())
+    assert stages["total"] >= stages["template"]
+
+
+def test_metrics_exposes_the_request_histograms(client):
+    client.post("/generate", data=lease_form_data())
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "server-timing" in response.headers
+    text = response.text
+    assert 'lease_request_duration_seconds_count{route="/generate",output_format="html"}' in text
+    assert 'lease_stage_duration_seconds_bucket{stage="template",le="+Inf"}' in text
+    assert 'lease_cache_hit_ratio{cache="lease_section"}' in text
+    assert text.startswith("# HELP lease_request_duration_seconds")
@@ -0,0 +1,68 @@
+import pytest
+
+from lease_generator.main import EXAMPLE_PAGE_CACHE_CONTROL
+from lease_generator.pages import negotiate_encoding
+
+ALL = ("identity", "gzip", "br")
+NO_BROTLI = ("identity", "gzip")
+
+
+@pytest.mark.parametrize("accept_encoding, available, expected", [
+    ("", ALL, "identity"),
+    ("gzip", ALL, "gzip"),
+    ("gzip, deflate, br", ALL, "br"),
+    ("gzip, deflate, br", NO_BROTLI, "gzip"),
+    ("br;q=0.5, gzip;q=0.8", ALL, "gzip"),
+    ("BR;Q=1.0, gzip;q=0.8", ALL, "br"),
+    ("br;q=0, gzip", ALL, "gzip"),
+    ("gzip;q=0", ALL, "identity"),
+    ("identity;q=0, gzip", NO_BROTLI, "gzip"),
+    ("*", ALL, "br"),
+    ("*;q=0, gzip", NO_BROTLI, "gzip"),
+    ("gzip;q=oops, identity", NO_BROTLI, "identity"),
+    # Nothing acceptable is available: identity is still better than no page
+    ("identity;q=0, deflate", NO_BROTLI, "identity"),
+])
+def test_negotiate_encoding(accept_encoding, available, expected):
+    assert negotiate_encoding(accept_encoding, available) == expected
+
+
+def test_home_page_is_revalidated(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == "no-cache"
+    assert response.headers["vary"] == "Accept-Encoding"
+
+    revalidated = client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == response.headers["etag"]
+
+
+def test_example_page_is_cacheable_and_revalidated_per_encoding(client):
+    gzipped = client.get("/templates/example", headers={"Accept-Encoding": "gzip"})
+    plain = client.get("/templates/example", headers={"Accept-Encoding": "identity"})
+    assert gzipped.status_code == plain.status_code == 200
+    assert gzipped.headers["cache-control"] == plain.headers["cache-control"] == EXAMPLE_PAGE_CACHE_CONTROL
+    assert "max-age" in EXAMPLE_PAGE_CACHE_CONTROL
+    assert "content-encoding" not in plain.headers
+    assert gzipped.content == plain.content  # decoded by the client
+    assert gzipped.headers["etag"] != plain.headers["etag"]
+
+    revalidated = client.get("/templates/example", headers={"Accept-Encoding": "gzip",
+                                                            "If-None-Match": gzipped.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["cache-control"] == EXAMPLE_PAGE_CACHE_CONTROL
+    # Another encoding's ETag is not a match
+    assert client.get("/templates/example", headers={"Accept-Encoding": "gzip",
+                                                     "If-None-Match": plain.headers["etag"]}).status_code == 200
+
+
+def test_form_loads_the_example_with_get(client):
+    assert '<form action="/templates/example" method="get"' in client.get("/").text
+    # The old POST route serves the same page, without telling caches to keep it
+    posted = client.post("/templates/load-example", headers={"Accept-Encoding": "identity"})
+    assert posted.status_code == 200
+    assert posted.headers["cache-control"] == "no-cache"
+    assert posted.content == client.get("/templates/example", headers={"Accept-Encoding": "identity"}).content
@@ -0,0 +1,58 @@
+import json
+
+from lease_generator.bulk import BulkItem
+from lease_generator.main import EXAMPLE_TEMPLATE_PATH
+from lease_generator.models import LeaseConfiguration, PaymentEntry
+from lease_generator.portfolio import rollup
+
+
+def example_config(**lease_terms) -> LeaseConfiguration:
+    data = json.loads(EXAMPLE_TEMPLATE_PATH.read_text())
+    data["lease_terms"].update(lease_terms)
+    return LeaseConfiguration.model_validate(data)
+
+
+def month(result: dict, label: str) -> dict:
+    return next(row for row in result["months"] if row["month"] == label)
+
+
+def test_deposits_are_due_in_the_start_month():
+    result = rollup([BulkItem("example", example_config(), None),
+                     BulkItem("custom", example_config(custom_security_deposit=1500.0, pet_deposit=None), None)]).to_json()
+    january = month(result, "2025-01")
+    # One month's rent for the example, the custom amount for the other; only the example has a pet deposit
+    assert january["security_deposit"] == 1200.0 + 1500.0
+    assert january["pet_deposit"] == 200.0
+    assert result["totals"]["security_deposit"] == 2700.0
+    assert result["totals"]["total"] == result["totals"]["rent_amount"] + 2700.0 + 200.0
+    assert month(result, "2025-02")["security_deposit"] == 0.0
+
+
+def test_renewal_only_owes_the_deposit_increase_once():
+    config = example_config(security_deposit_details={"previous_rent": 1100.0, "use_custom_section": True})
+    result = rollup([BulkItem("renewal", config, None)]).to_json()
+    # The schedule already carries the $100 increase; nothing is added on top of it
+    assert result["totals"]["security_deposit"] == 100.0
+    assert result["totals"]["pet_deposit"] == 200.0
+
+
+def test_rent_increase_top_up_is_owed_on_top_of_the_deposit():
+    config = example_config()
+    config.additional_terms.payment_schedule.rent_increases = [{"date": "2025-07-01", "new_rent": 1250, "comment": "Mid-year"}]
+    result = rollup([BulkItem("increase", config, None)]).to_json()
+    assert month(result, "2025-01")["security_deposit"] == 1200.0
+    assert month(result, "2025-07")["security_deposit"] == 50.0
+    assert result["totals"]["security_deposit"] == 1250.0
+    assert result["totals"]["pet_deposit"] == 200.0
+
+
+def test_deposits_entered_in_the_schedule_are_not_added_again():
+    config = example_config()
+    config.additional_terms.payment_schedule.auto_generate = False
+    config.additional_terms.payment_schedule.custom_entries = [
+        PaymentEntry(due_date="Lease signing", rent_amount=0.0, security_deposit=1200.0, pet_deposit=200.0,
+                     total=1400.0, is_manual=True),
+    ]
+    result = rollup([BulkItem("manual", config, None)]).to_json()
+    assert result["totals"]["security_deposit"] == 1200.0
+    assert result["totals"]["pet_deposit"] == 200.0
@@ -0,0 +1,24 @@
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
+
+from lease_generator import precompile
+from lease_generator.documents import template_env
+
+
+def test_every_template_compiles_into_the_bytecode_cache(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(template_env, "bytecode_cache", FileSystemBytecodeCache(str(tmp_path)))
+    # Compile from source, not from what earlier tests already loaded
+    monkeypatch.setattr(template_env, "cache", {})
+    assert precompile.main() == 0
+    output = capsys.readouterr()
+    assert output.err == ""
+    assert f"Compiled {len(template_env.list_templates())} templates" in output.out
+    assert len(list(tmp_path.iterdir())) == len(template_env.list_templates())
+
+
+def test_broken_template_fails_the_build_check(monkeypatch, capsys):
+    broken = DictLoader({"lease/broken.html": "{% if lease_terms %}\n<p>{{ lease_terms.monthly_rent | currency }}</p>\n"})
+    monkeypatch.setattr(template_env, "loader", ChoiceLoader([broken, template_env.loader]))
+    assert precompile.main() == 1
+    output = capsys.readouterr()
+    assert output.err.startswith("FAILED lease/broken.html: line ")
+    assert "1 failed" in output.out
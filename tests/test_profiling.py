@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from lease_generator.profiling import ProfilingMiddleware, RequestProfile, profile_call
+
+
+def scope(path: str = "/generate", token: bytes = None) -> dict:
+    headers = [(b"x-lease-profile", token)] if token is not None else []
+    return {"type": "http", "path": path, "headers": headers}
+
+
+@pytest.mark.parametrize("token, sample_rate, triggered", [
+    (b"secret", 0.0, True),
+    (b"wrong", 0.0, False),
+    (None, 0.0, False),
+    # A wrong token doesn't keep the request out of sampling
+    (b"wrong", 1.0, True),
+    (None, 1.0, True),
+])
+def test_token_header_or_sample_rate_triggers_a_profile(token, sample_rate, triggered):
+    middleware = ProfilingMiddleware(app=None, token="secret", sample_rate=sample_rate)
+    assert middleware._triggered(scope(token=token)) is triggered
+
+
+def test_token_profiles_any_path_but_sampling_only_render_paths():
+    middleware = ProfilingMiddleware(app=None, token="secret", sample_rate=1.0)
+    assert middleware._triggered(scope("/metrics", b"secret"))
+    assert not middleware._triggered(scope("/metrics"))
+
+
+def busy(seconds: float) -> str:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+    return "done"
+
+
+def test_profile_call_collects_collapsed_stacks(tmp_path):
+    result, stacks = profile_call(0.001, busy, 0.1)
+    assert result == "done"
+    assert stacks and all(isinstance(count, int) and count > 0 for count in stacks.values())
+    # Stacks start at profile_call and run root-first down to the sampled frame
+    assert all(stack.startswith("profile_call (profiling.py:") for stack in stacks)
+    assert any(stack.split(";")[-1].startswith("busy (test_profiling.py:") for stack in stacks)
+
+    profile = RequestProfile("/generate", interval=0.001)
+    profile.merge(stacks, "pdf_worker")
+    path = profile.save(tmp_path)
+    lines = path.read_text().splitlines()
+    assert len(lines) == len(stacks)
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith("pdf_worker;profile_call")
+        assert int(count) == stacks[stack.split(";", 1)[1]]
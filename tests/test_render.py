@@ -0,0 +1,194 @@
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from lease_generator.cache import DocumentCache, FileLock, fcntl
+from lease_generator.render import PDFRenderPool, document_stylesheets, render_pdf_file
+
+from conftest import lease_form_data
+
+unix_only = pytest.mark.skipif(fcntl is None, reason="render locks need flock")
+
+
+@unix_only
+def test_file_lock_is_exclusive_until_released(tmp_path):
+    first, second = FileLock(tmp_path / "doc.lock"), FileLock(tmp_path / "doc.lock")
+    assert first.acquire()
+    assert not second.acquire()
+    first.release()
+    assert not (tmp_path / "doc.lock").exists()
+    assert second.acquire()
+    second.release()
+
+
+@unix_only
+def test_file_lock_on_a_replaced_file_is_not_held(tmp_path, monkeypatch):
+    from lease_generator import cache
+
+    path = tmp_path / "doc.lock"
+    waiter, newcomer = FileLock(path), FileLock(path)
+    flock = cache.fcntl.flock
+    calls = []
+
+    def racing_flock(fd, operation):
+        # Between the waiter opening the file and locking it, the holder releases
+        # (unlinking the file) and a newcomer locks a fresh file at the same path
+        if not calls:
+            calls.append(fd)
+            path.unlink()
+            assert newcomer.acquire()
+        return flock(fd, operation)
+
+    monkeypatch.setattr(cache.fcntl, "flock", racing_flock)
+    assert not waiter.acquire()
+    newcomer.release()
+    assert waiter.acquire()
+    waiter.release()
+
+
+def counting_pools(cache_dir: Path, count: int, renders: list) -> list:
+    """Pools sharing one cache directory, as the workers of serve.py do, with a fake renderer"""
+    pools = []
+    for _ in range(count):
+        pool = PDFRenderPool(cache=DocumentCache(directory=cache_dir))
+
+        async def run(func, *args):
+            renders.append(func)
+            await asyncio.sleep(0.05)
+            if func is render_pdf_file:
+                Path(args[1]).write_bytes(b"%PDF-file")
+                return None
+            return b"%PDF-bytes"
+
+        pool._run = run
+        pools.append(pool)
+    return pools
+
+
+@unix_only
+def test_workers_sharing_a_cache_render_a_document_once(tmp_path):
+    renders = []
+    pools = counting_pools(tmp_path / "cache", 3, renders)
+
+    async def scenario():
+        return await asyncio.gather(*[pool.render_file("<p>lease</p>") for pool in pools for _ in range(2)])
+
+    rendered = asyncio.run(scenario())
+    assert renders == [render_pdf_file]
+    assert {result.path for result in rendered} == {rendered[0].path}
+    assert not any(result.temporary for result in rendered)
+    assert rendered[0].path.read_bytes() == b"%PDF-file"
+    # No lock files are left behind
+    assert list((tmp_path / "cache").glob("*/*.lock")) == []
+
+
+@unix_only
+def test_concurrent_byte_renders_share_one_render(tmp_path):
+    renders = []
+    pools = counting_pools(tmp_path / "cache", 2, renders)
+
+    async def scenario():
+        return await asyncio.gather(*[pool.render("<p>lease</p>") for pool in pools for _ in range(3)])
+
+    assert asyncio.run(scenario()) == [b"%PDF-bytes"] * 6
+    assert len(renders) == 1
+
+
+@unix_only
+def test_failed_render_releases_the_lock(tmp_path):
+    pool = PDFRenderPool(cache=DocumentCache(directory=tmp_path / "cache"))
+    calls = []
+
+    async def run(func, *args):
+        calls.append(func)
+        if len(calls) == 1:
+            raise RuntimeError("worker died")
+        Path(args[1]).write_bytes(b"%PDF-file")
+
+    pool._run = run
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await pool.render_file("<p>lease</p>")
+        return await asyncio.wait_for(pool.render_file("<p>lease</p>"), 5)
+
+    assert asyncio.run(scenario()).path.read_bytes() == b"%PDF-file"
+    assert len(calls) == 2
+
+
+def test_memory_only_cache_serves_file_renders():
+    renders = []
+    pools = counting_pools(None, 1, renders)
+
+    async def scenario():
+        return [await pools[0].render_file("<p>lease</p>") for _ in range(2)]
+
+    rendered = asyncio.run(scenario())
+    assert renders == [render_pdf_file]
+    assert all(result.temporary for result in rendered)
+    assert rendered[0].path != rendered[1].path
+    assert [result.path.read_bytes() for result in rendered] == [b"%PDF-file"] * 2
+    for result in rendered:
+        result.path.unlink()
+
+
+def test_failed_file_render_leaves_no_temporary_file(tmp_path, monkeypatch):
+    from lease_generator import render
+
+    def failing_write(html_content, target=None, pdf_identifier=None):
+        Path(target).write_bytes(b"%PDF-partial")
+        raise RuntimeError("layout failed")
+
+    monkeypatch.setattr(render, "_write_pdf", failing_write)
+    with pytest.raises(RuntimeError):
+        render_pdf_file("<p>lease</p>", str(tmp_path / "lease.pdf"))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_plain_style_blocks_are_split_out_in_order():
+    html = "<html><head><style>p { color: red }</style><style>h1 { margin: 0 }</style></head>" \
+           "<body><p style=\"color: blue\">Lease</p></body></html>"
+    remaining, css_texts = document_stylesheets(html)
+    assert css_texts == ["p { color: red }", "h1 { margin: 0 }"]
+    assert "<style" not in remaining and 'style="color: blue"' in remaining
+
+
+@pytest.mark.parametrize("html", [
+    "<style>p { color: red !important }</style><p>Lease</p>",
+    "<style>p { color: red }</style><p style=\"color: blue ! important\">Lease</p>",
+    "<style>p { color: red }</style><style media=\"print\">p { color: green }</style><p>Lease</p>",
+    "<style>p { color: red }</style><link rel=\"stylesheet\" href=\"lease.css\"><p>Lease</p>",
+])
+def test_styles_stay_in_documents_the_user_origin_would_change(html):
+    assert document_stylesheets(html) == (html, [])
+
+
+def test_important_in_the_text_does_not_keep_styles_in():
+    html = "<style>p { color: red }</style><p>Rent is due on the 1st!important</p>"
+    assert document_stylesheets(html)[1] == ["p { color: red }"]
+
+
+def test_lease_templates_are_split_out(client):
+    html = client.post("/generate", data=lease_form_data()).text
+    remaining, css_texts = document_stylesheets(html)
+    assert css_texts and "<style" not in remaining
+
+
+def test_web_process_serves_pages_without_importing_weasyprint():
+    script = "\n".join([
+        "import sys",
+        "from fastapi.testclient import TestClient",
+        "from lease_generator.main import app",
+        "with TestClient(app) as client:",
+        "    assert client.get('/').status_code == 200",
+        "print('weasyprint' in sys.modules)",
+    ])
+    src = Path(__file__).resolve().parent.parent / "src"
+    # Settings from conftest.py keep the subprocess in the test directories, with render workers started lazily
+    env = {**os.environ, "PYTHONPATH": str(src)}
+    output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "False"
@@ -0,0 +1,131 @@
+import json
+import os
+import time
+from datetime import date
+
+import pytest
+
+from lease_generator import renewals
+from lease_generator.main import EXAMPLE_TEMPLATE_PATH
+from lease_generator.renewals import RenewalIndex
+
+EXAMPLE = json.loads(EXAMPLE_TEMPLATE_PATH.read_text())
+# The example lease ends 2025-12-31
+WINDOW = (date(2025, 12, 1), date(2026, 1, 31))
+
+
+def write_configuration(directory, name: str, monthly_rent: float = 1200, bedrooms: int = 2, tenant_name: str = None,
+                        age_seconds: int = 3600):
+    data = json.loads(json.dumps(EXAMPLE))
+    data["lease_terms"]["monthly_rent"] = monthly_rent
+    data["property_details"]["bedrooms"] = bedrooms
+    data["parties"]["tenant_name"] = tenant_name or f"Tenant {name}"
+    path = directory / f"lease_configuration_{name}.json"
+    path.write_text(json.dumps(data))
+    # Old enough that the scan trusts its mtime
+    written = time.time() - age_seconds
+    os.utime(path, (written, written))
+    return path
+
+
+@pytest.fixture
+def index(tmp_path):
+    return RenewalIndex(tmp_path)
+
+
+def rents(index: RenewalIndex, **kwargs) -> dict:
+    return {lease.path: lease.monthly_rent for lease in index.find(*WINDOW, **kwargs)}
+
+
+def test_unchanged_files_are_not_read_again(tmp_path, index, monkeypatch):
+    write_configuration(tmp_path, "a")
+    write_configuration(tmp_path, "b")
+    first = index.scan()
+    assert (first.files, first.changed, first.removed, first.errors) == (2, 2, 0, [])
+
+    def no_reads(*args):
+        raise AssertionError("an unchanged file was read")
+
+    monkeypatch.setattr(renewals.hashlib, "sha256", no_reads)
+    second = index.scan()
+    assert (second.files, second.changed, second.removed) == (2, 0, 0)
+    assert set(rents(index)) == {"lease_configuration_a.json", "lease_configuration_b.json"}
+
+
+def test_rewritten_file_with_the_same_content_is_not_revalidated(tmp_path, index, monkeypatch):
+    path = write_configuration(tmp_path, "a")
+    index.scan()
+    os.utime(path, (time.time() - 60, time.time() - 60))
+    monkeypatch.setattr(renewals, "_lease_fields", lambda data: pytest.fail("revalidated an unchanged file"))
+    assert index.scan().changed == 0
+
+
+def test_edited_file_is_reindexed(tmp_path, index):
+    write_configuration(tmp_path, "a", monthly_rent=1200)
+    index.scan()
+    write_configuration(tmp_path, "a", monthly_rent=1350, age_seconds=60)
+    scan = index.scan()
+    assert (scan.files, scan.changed) == (1, 1)
+    assert rents(index) == {"lease_configuration_a.json": 1350.0}
+
+
+def test_deleted_file_leaves_the_index(tmp_path, index):
+    write_configuration(tmp_path, "a")
+    removed = write_configuration(tmp_path, "b")
+    index.scan()
+    removed.unlink()
+    scan = index.scan()
+    assert (scan.files, scan.changed, scan.removed) == (1, 0, 1)
+    assert set(rents(index)) == {"lease_configuration_a.json"}
+
+
+def test_invalid_file_is_indexed_with_its_error(tmp_path, index):
+    write_configuration(tmp_path, "a")
+    (tmp_path / "lease_configuration_broken.json").write_text("{}")
+    # Neither the index itself nor other files are picked up
+    (tmp_path / "notes.json").write_text("{}")
+    scan = index.scan()
+    assert scan.files == 2
+    assert [error["source"] for error in scan.errors] == ["lease_configuration_broken.json"]
+    assert "parties" in scan.errors[0]["error"]
+    assert set(rents(index)) == {"lease_configuration_a.json"}
+
+    # Still reported on the next scan
+    assert index.scan().errors == scan.errors
+    # And dropped once it is fixed
+    write_configuration(tmp_path, "broken", age_seconds=60)
+    assert index.scan().errors == []
+
+
+def test_below_market_compares_with_the_median_for_the_bedroom_count(tmp_path, index):
+    for name, rent in (("low", 1000), ("median", 1200), ("high", 1400)):
+        write_configuration(tmp_path, name, monthly_rent=rent, bedrooms=2)
+    write_configuration(tmp_path, "large", monthly_rent=1100, bedrooms=3)
+    write_configuration(tmp_path, "large_median", monthly_rent=2000, bedrooms=3)
+    write_configuration(tmp_path, "large_high", monthly_rent=2200, bedrooms=3)
+    index.scan()
+    assert index.market_rents() == {2: 1200.0, 3: 2000.0}
+
+    # 10% under the median: under $1,080 for two bedrooms, $1,800 for three
+    assert set(rents(index, below_market=0.1)) == {"lease_configuration_low.json", "lease_configuration_large.json"}
+    assert set(rents(index, below_market=0.0)) == {"lease_configuration_low.json", "lease_configuration_large.json"}
+    # A given market rent applies to every lease
+    assert set(rents(index, below_market=0.1, market_rent=1500)) == {
+        "lease_configuration_low.json", "lease_configuration_median.json", "lease_configuration_large.json"}
+
+
+def test_cli_filters_below_market_and_writes_messages(tmp_path, capsys):
+    leases = tmp_path / "leases"
+    leases.mkdir()
+    write_configuration(leases, "low", monthly_rent=1000, tenant_name="Jane Doe")
+    write_configuration(leases, "median", monthly_rent=1200)
+    write_configuration(leases, "high", monthly_rent=1400)
+    messages = tmp_path / "messages"
+
+    status = renewals.main([str(leases), "--from", "2025-12-01", "--to", "2026-01-31", "--below-market", "10",
+                            "--increase-percent", "5", "--messages", str(messages)])
+    assert status == 0
+    results = json.loads(capsys.readouterr().out)
+    assert [(result["path"], result["proposed_rent"]) for result in results] == [("lease_configuration_low.json", 1050.0)]
+    message = (messages / "renewal_message_jane_doe_2026_01_01.txt").read_text()
+    assert message.startswith("Hi Jane!") and "$1,050" in message
@@ -0,0 +1,68 @@
+from datetime import date
+
+from lease_generator.models import PaymentEntry
+from lease_generator.schedule import build_schedule_rows, create_payment_schedule
+
+START = date(2025, 1, 1)
+END = date(2025, 12, 31)
+
+
+def rents(rows) -> dict:
+    return {row.due_date.month: row.rent_amount for row in rows if isinstance(row.due_date, date)}
+
+
+def test_increases_to_the_same_rent_are_all_applied():
+    increases = [
+        {"date": "2025-03-01", "new_rent": 1300, "comment": "Spring"},
+        {"date": "2025-05-01", "new_rent": 1250, "comment": "Adjustment"},
+        {"date": "2025-08-01", "new_rent": 1300, "comment": "Autumn"},
+    ]
+    rows = build_schedule_rows(START, END, 1200.0, increases, [])
+    assert rents(rows) == {1: 1200.0, 2: 1200.0, 3: 1300.0, 4: 1300.0, 5: 1250.0, 6: 1250.0,
+                           7: 1250.0, 8: 1300.0, 9: 1300.0, 10: 1300.0, 11: 1300.0, 12: 1300.0}
+    comments = {row.due_date.month: row.comment for row in rows}
+    assert (comments[3], comments[5], comments[8]) == ("Spring", "Adjustment", "Autumn")
+
+
+def test_rent_stays_raised_after_an_increase():
+    rows = build_schedule_rows(START, END, 1200.0, [{"date": "2025-07-01", "new_rent": 1250, "comment": "Mid-year"}], [])
+    assert all(rent == 1200.0 for month, rent in rents(rows).items() if month < 7)
+    assert all(rent == 1250.0 for month, rent in rents(rows).items() if month >= 7)
+    july, august = rows[6], rows[7]
+    # The deposit top-up is only due in the month of the increase
+    assert (july.security_deposit, july.total) == (50.0, 1300.0)
+    assert (august.security_deposit, august.total, august.comment) == (0.0, 1250.0, "")
+
+
+def test_mid_month_increase_takes_effect_the_next_month():
+    rows = build_schedule_rows(START, END, 1200.0, [{"date": "2025-03-15", "new_rent": 1300}], [])
+    assert rents(rows)[3] == 1200.0
+    assert rents(rows)[4] == 1300.0
+    assert rows[2].security_deposit == 0.0
+
+
+def test_custom_entries_override_generated_months():
+    custom = [
+        PaymentEntry(due_date=date(2025, 3, 1), rent_amount=999.0, total=999.0, comment="Agreed discount", is_manual=True),
+        PaymentEntry(due_date="Lease signing", rent_amount=0.0, security_deposit=1200.0, total=1200.0, is_manual=True),
+    ]
+    rows = build_schedule_rows(START, END, 1200.0, [], custom)
+    march = [row for row in rows if row.due_date == date(2025, 3, 1)]
+    assert len(march) == 1
+    assert (march[0].rent_amount, march[0].comment, march[0].is_manual) == (999.0, "Agreed discount", True)
+    # Undated entries sort after every dated month
+    assert rows[-1].due_date == "Lease signing"
+    assert len(rows) == 13
+
+
+def test_create_payment_schedule_matches_rows():
+    increases = [{"date": "2025-07-01", "new_rent": 1250, "comment": "Mid-year"}]
+    custom = [PaymentEntry(due_date=date(2025, 10, 1), rent_amount=1000.0, total=1000.0, is_manual=True)]
+    arguments = (START, END, 1200.0, increases, custom, 100.0, "", 1100.0)
+    entries = create_payment_schedule(*arguments)
+    rows = build_schedule_rows(*arguments)
+    assert all(isinstance(entry, PaymentEntry) for entry in entries)
+    assert [entry.model_dump() for entry in entries] == [row.to_entry().model_dump() for row in rows]
+    # The models are valid as constructed
+    assert [PaymentEntry.model_validate(entry.model_dump()) for entry in entries] == entries
+    assert entries[0].comment == "Last month at current rate"
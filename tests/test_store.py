@@ -0,0 +1,140 @@
+from datetime import date
+
+from lease_generator import store
+from lease_generator.models import LeaseConfiguration
+from lease_generator.store import LeaseStore
+
+from conftest import lease_form_data
+
+
+def saved_lease(client) -> str:
+    response = client.post("/generate", data=lease_form_data(save_lease="true"))
+    assert response.status_code == 200
+    return response.headers["x-lease-id"]
+
+
+def test_artifact_file_round_trip(client, tmp_path, monkeypatch):
+    from lease_generator.main import lease_store
+
+    lease_id = saved_lease(client)
+    monkeypatch.setattr(store, "ARTIFACT_CHUNK_BYTES", 7)
+    content = bytes(range(256)) * 10
+    source = tmp_path / "source.pdf"
+    source.write_bytes(content)
+
+    lease_store.put_artifact_file(lease_id, "pdf", "inputs", source)
+    assert lease_store.artifact(lease_id, "pdf", "inputs") == content
+    target = tmp_path / "copy.pdf"
+    assert lease_store.copy_artifact(lease_id, "pdf", "inputs", target)
+    assert target.read_bytes() == content
+    assert not lease_store.copy_artifact(lease_id, "pdf", "other inputs", tmp_path / "missing.pdf")
+
+
+def test_stored_pdf_is_streamed_without_rendering(client, monkeypatch):
+    from lease_generator import main
+    from lease_generator.documents import input_hash, templates_fingerprint
+
+    lease_id = saved_lease(client)
+    stored = main.lease_store.get(lease_id)
+    artifact_hash = input_hash(stored.configuration.encode("utf-8"), stored.agreement_date, templates_fingerprint())
+    main.lease_store.put_artifact(lease_id, "pdf", artifact_hash, b"%PDF-stored")
+
+    async def no_render(*args, **kwargs):
+        raise AssertionError("stored PDF was rendered again")
+
+    monkeypatch.setattr(main.render_pool, "render_file", no_render)
+    response = client.get(f"/leases/{lease_id}/pdf")
+    assert response.status_code == 200
+    assert response.content == b"%PDF-stored"
+    assert response.headers["content-length"] == str(len(b"%PDF-stored"))
+    assert response.headers["etag"]
+
+
+def test_rendered_pdf_is_stored_from_its_file(client, tmp_path, monkeypatch):
+    from lease_generator import main
+    from lease_generator.render import RenderedFile
+
+    lease_id = saved_lease(client)
+    rendered = tmp_path / "rendered.pdf"
+    rendered.write_bytes(b"%PDF-rendered")
+
+    async def render_file(html_content, profile=None):
+        return RenderedFile(rendered, False)
+
+    monkeypatch.setattr(main.render_pool, "render_file", render_file)
+    response = client.get(f"/leases/{lease_id}/pdf")
+    assert response.status_code == 200
+    assert response.content == b"%PDF-rendered"
+
+    # Served from the stored artifact from now on
+    rendered.unlink()
+    assert client.get(f"/leases/{lease_id}/pdf").content == b"%PDF-rendered"
+
+
+def test_saving_a_lease_drops_its_artifacts(tmp_path):
+    from lease_generator.main import EXAMPLE_TEMPLATE_PATH
+
+    lease_store = LeaseStore(tmp_path / "leases.db")
+    config = LeaseConfiguration.model_validate_json(EXAMPLE_TEMPLATE_PATH.read_text())
+    lease_id = lease_store.save(config, date(2024, 12, 15))
+    source = tmp_path / "lease.pdf"
+    source.write_bytes(b"%PDF-1")
+    lease_store.put_artifact_file(lease_id, "pdf", "inputs", source)
+    lease_store.save(config, date(2024, 12, 15), lease_id)
+    assert lease_store.artifact(lease_id, "pdf", "inputs") is None
+
+
+def test_only_stored_lease_ids_can_be_saved_to(tmp_path):
+    from lease_generator.main import EXAMPLE_TEMPLATE_PATH
+
+    lease_store = LeaseStore(tmp_path / "leases.db")
+    config = LeaseConfiguration.model_validate_json(EXAMPLE_TEMPLATE_PATH.read_text())
+    assert lease_store.save(config, date(2024, 12, 15), "chosen-by-client") is None
+    assert lease_store.get("chosen-by-client") is None
+    lease_id = lease_store.save(config, date(2024, 12, 15))
+    assert len(lease_id) == 32 and int(lease_id, 16) >= 0
+    assert lease_store.save(config, date(2025, 1, 2), lease_id) == lease_id
+    assert lease_store.get(lease_id).agreement_date == date(2025, 1, 2)
+
+
+def test_client_chosen_lease_ids_are_refused(client):
+    lease_id = "x');alert(1);//"
+    response = client.post("/generate", data=lease_form_data(save_lease="true", lease_id=lease_id))
+    assert response.status_code == 404
+    response = client.post("/jobs", data=lease_form_data(save_lease="true", lease_id=lease_id))
+    assert response.status_code == 404
+
+
+def test_saved_lease_ids_are_not_put_in_scripts(client):
+    from lease_generator import main
+
+    lease_id = saved_lease(client)
+    # As if an id had been stored before ids were always generated
+    with main.lease_store._connect() as db:
+        db.execute("INSERT INTO leases SELECT ?, tenant_name, mailing_address, start_date, end_date, agreement_date, "
+                   "configuration, created_at, updated_at FROM leases WHERE lease_id = ?", ("x');alert(1);//", lease_id))
+    page = client.get("/").text
+    main.lease_store.delete("x');alert(1);//")
+    assert 'data-lease-id="x&#39;);alert(1);//"' in page
+    assert "loadConfiguration('" not in page and "deleteConfiguration('" not in page
+
+
+def test_unused_documents_are_pruned(tmp_path, monkeypatch):
+    from lease_generator.main import EXAMPLE_TEMPLATE_PATH
+
+    lease_store = LeaseStore(tmp_path / "leases.db")
+    config = LeaseConfiguration.model_validate_json(EXAMPLE_TEMPLATE_PATH.read_text())
+    lease_store.put_document("old", config, date(2024, 12, 15), "templates")
+    lease_store.put_document("recent", config, date(2024, 12, 15), "templates")
+
+    later = store.time.time() + store.DOCUMENT_TTL_SECONDS - 60
+    monkeypatch.setattr(store.time, "time", lambda: later)
+    # Used again just before it would have expired
+    assert lease_store.touch_document("recent")
+
+    monkeypatch.setattr(store.time, "time", lambda: later + 120)
+    lease_store.prune_documents_if_due()
+    assert lease_store.document("old") is None
+    assert lease_store.document("recent") is not None
+    assert not lease_store.touch_document("old")
+